@@ -1,11 +1,18 @@
 from abc import ABC, abstractmethod
+import asyncio
+from collections import OrderedDict
 import hashlib
+from http.cookiejar import CookieJar, DefaultCookiePolicy
 import json
+import math
 import os
-from typing import Generic, TypeVar
+import random
+import time
+from typing import Any, Awaitable, Callable, Generic, Hashable, TypeVar
 import fastapi
 import httpx
 from dotenv import load_dotenv
+from jose import JWTError, jwt
 
 class Methods:
     GET = "GET"
@@ -14,40 +21,567 @@ class Methods:
     PATCH = "PATCH"
     DELETE = "DELETE"
 
+_WARDEN_ISSUER = "warden"
+# keys signed with a shared secret are never published, never accept them
+_ASYMMETRIC_ALGORITHMS = ("ES256", "ES384", "ES512", "RS256", "RS384", "RS512")
+
+_invalid_access_token = fastapi.HTTPException(fastapi.status.HTTP_401_UNAUTHORIZED, "Invalid access token.")
+
+# methods safe to send again once the server may have seen them. Only reads: a repeated
+# DELETE /user or DELETE /user/sessions answers 401 for work the first attempt already did.
+_RETRYABLE_METHODS = frozenset({ Methods.GET })
+# answers that mean the server, not the request, is at fault
+_RETRY_STATUS_CODES = frozenset({ 500, 502, 503, 504 })
+
+def _warden_unavailable(retry_after_sec: float = None):
+    headers = { "Retry-After": str(math.ceil(retry_after_sec)) } if retry_after_sec else None
+    return fastapi.HTTPException(fastapi.status.HTTP_503_SERVICE_UNAVAILABLE, "Warden is unavailable.", headers=headers)
+
+class _CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and fails calls fast for reset_sec.
+    Then a single probe call is let through, its outcome closes or reopens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_sec: float):
+        self.failure_threshold = failure_threshold
+        self.reset_sec = reset_sec
+
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def before_call(self):
+        """
+        Returns True when this call is the probe, release_probe() must follow it.
+        """
+
+        if (self.state == self.CLOSED):
+            return False
+
+        if (self.state == self.OPEN):
+            remaining_sec = self._opened_at + self.reset_sec - time.monotonic()
+            if (remaining_sec > 0):
+                raise _warden_unavailable(remaining_sec)
+            self.state = self.HALF_OPEN
+
+        if (self._probing):
+            raise _warden_unavailable(self.reset_sec)
+
+        self._probing = True
+        return True
+
+    def release_probe(self):
+        # a probe that was cancelled or failed without an outcome lets the next call probe
+        self._probing = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self._failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._probing = False
+
+        if (self.state == self.HALF_OPEN or self._failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+class _JWKSCache:
+    """
+    Warden's public signing keys, refreshed in the background every refresh_sec.
+
+    A token signed with an unknown kid, e.g. right after a key rotation, triggers an
+    immediate refresh, at most once per min_refresh_sec. Concurrent refreshes share one request.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, refresh_sec: float, min_refresh_sec: float = 30.0):
+        self._client = client
+        self.refresh_sec = refresh_sec
+        self.min_refresh_sec = min_refresh_sec
+
+        self._keys: dict[str, dict] = {}
+        self._fetched_at: float = None
+        self._fetching: asyncio.Future = None
+        self._refresher: asyncio.Task = None
+
+    async def get(self, kid: str):
+        if (self._refresher is None):
+            self._refresher = asyncio.create_task(self._refresh_periodically())
+
+        key = self._keys.get(kid)
+
+        if (key is None and (self._fetched_at is None or time.monotonic() - self._fetched_at >= self.min_refresh_sec)):
+            try:
+                await self.refresh()
+            except httpx.HTTPError:
+                if (not self._keys):
+                    raise
+            key = self._keys.get(kid)
+
+        return key
+
+    async def refresh(self):
+        if (self._fetching is None or self._fetching.done()):
+            self._fetching = asyncio.ensure_future(self._fetch())
+
+        # a cancelled caller must not cancel the request the others are waiting on
+        await asyncio.shield(self._fetching)
+
+    async def _fetch(self):
+        try:
+            res = await self._client.get("/.well-known/jwks.json")
+            res.raise_for_status()
+            self._keys = { key["kid"]: key for key in res.json()["keys"] if "kid" in key }
+        finally:
+            # failures count too, so an unreachable server isn't asked on every request
+            self._fetched_at = time.monotonic()
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_sec)
+            try:
+                await self.refresh()
+            except httpx.HTTPError:
+                # keep the cached keys, the next round tries again
+                pass
+
+    async def aclose(self):
+        if (self._refresher is not None):
+            self._refresher.cancel()
+            self._refresher = None
+
+class _TTLCache:
+    """
+    Bounded LRU cache whose entries expire after a TTL.
+
+    Concurrent misses on the same key share a single load (single-flight). A loaded
+    value is returned to every waiter but only stored when store_if accepts it.
+    """
+
+    def __init__(self, max_size: int, ttl_sec: float):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._loading: dict[Hashable, asyncio.Future] = {}
+        # bumped on every invalidation so loads started before it are not stored
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable):
+        entry = self._entries.get(key)
+
+        if (entry is None):
+            return None
+
+        expires_at, value = entry
+
+        if (expires_at <= time.monotonic()):
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_sec, value)
+        self._entries.move_to_end(key)
+
+        while (len(self._entries) > self.max_size):
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]):
+        self._generation += 1
+        self.invalidations += 1
+        for key in [ key for key in self._entries if predicate(key) ]:
+            del self._entries[key]
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], store_if: Callable[[Any], bool]):
+        value = self.get(key)
+
+        if (value is not None):
+            self.hits += 1
+            return value
+
+        load = self._loading.get(key)
+
+        if (load is None):
+            self.misses += 1
+            load = asyncio.ensure_future(self._load(key, loader, store_if))
+            self._loading[key] = load
+            load.add_done_callback(lambda _: self._loading.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        # shield so a cancelled caller doesn't cancel the load other callers are waiting on
+        return await asyncio.shield(load)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], store_if: Callable[[Any], bool]):
+        generation = self._generation
+
+        value = await loader()
+
+        if (store_if(value) and generation == self._generation):
+            self.set(key, value)
+
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_sec": self.ttl_sec,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+class WardenBatch:
+    """
+    Collects user operations and sends them as one POST /batch request, authenticated by
+    the app's API key alone. Build it with warden.batch():
+
+        results = await warden.batch().get(user_a).update_data(user_b, { "plan": "pro" }).delete(user_c).send()
+    """
+
+    def __init__(self, warden: "_WardenInterface"):
+        self._warden = warden
+        self._operations: list[dict] = []
+
+    def __len__(self):
+        return len(self._operations)
+
+    def get(self, user_id: str):
+        self._operations.append({ "op": "get", "user_id": user_id })
+        return self
+
+    def update_data(self, user_id: str, data: dict):
+        """
+        Merges data into the user's data like update_user_data, None removes a field.
+        """
+
+        self._operations.append({ "op": "update_data", "user_id": user_id, "data": data })
+        return self
+
+    def delete(self, user_id: str):
+        self._operations.append({ "op": "delete", "user_id": user_id })
+        return self
+
+    def lock(self, user_id: str, lock_sec: int):
+        self._operations.append({ "op": "lock", "user_id": user_id, "lock_sec": lock_sec })
+        return self
+
+    def unlock(self, user_id: str):
+        self._operations.append({ "op": "unlock", "user_id": user_id })
+        return self
+
+    async def send(self):
+        """
+        Returns:
+            list[dict]: One result per operation, in order, each with status and, for gets,
+                user or, for failures, error.
+        """
+
+        response = await self._warden._query(Methods.POST, "/batch", body={ "operations": self._operations })
+
+        if (response.status_code != 200):
+            raise fastapi.HTTPException(response.status_code, response.text)
+
+        written_user_ids = { operation["user_id"] for operation in self._operations if operation["op"] != "get" }
+        if (written_user_ids and self._warden._user_data_cache is not None):
+            self._warden._user_data_cache.discard_where(lambda key: key[0] in written_user_ids)
+
+        return response.json()["results"]
+
 class _WardenInterface(ABC):
     """
     Interface of Warden.
+
+    Every instance owns one pooled HTTP client, so calls reuse open connections to the
+    Warden server. Close it with aclose(), or use the instance as an async context manager,
+    e.g. from a FastAPI lifespan.
+
+    Calls retry GET requests with jittered backoff and go through a circuit breaker
+    that answers 503 right away while the server keeps failing. get_user_data can hedge.
     """
 
-    def __init__(self, api_id: str, api_key: str):
+    def __init__(
+        self, 
+        api_id: str, 
+        api_key: str, 
+        *,
+        server_address: str = None,
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        jwks_refresh_sec: float = 300.0,
+        user_data_cache_ttl_sec: float = None,
+        user_data_cache_max_size: int = 10_000,
+        max_retries: int = 2,
+        retry_backoff_sec: float = 0.1,
+        retry_backoff_max_sec: float = 2.0,
+        circuit_failure_threshold: int = 5,
+        circuit_reset_sec: float = 30.0,
+        hedge_delay_sec: float = None,
+        transport: httpx.AsyncBaseTransport = None
+    ):
         self.__api_id = api_id
         self.__api_key = api_key
 
         load_dotenv()
 
-        if (os.getenv("WARDEN_ENV") == "DEV"):
+        if (server_address is not None):
+            self.__warden_server_address = server_address
+        elif (os.getenv("WARDEN_ENV") == "DEV"):
             self.__warden_server_address = "http://localhost:8000"
         else:
             self.__warden_server_address = "https://warden-nsem.vercel.app"
 
+        # the client is shared by every end user, so it must never keep their cookies,
+        # they are forwarded per request instead
+        no_cookies = CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+
+        self._client = httpx.AsyncClient(
+            base_url=self.__warden_server_address,
+            headers={
+                "Warden-App-ID": self.__api_id,
+                "Warden-App-API-Key": self.__api_key
+            },
+            cookies=no_cookies,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            ),
+            http2=http2,
+            transport=transport
+        )
+
+        self._jwks = _JWKSCache(self._client, jwks_refresh_sec)
+
+        self.max_retries = max_retries
+        self.retry_backoff_sec = retry_backoff_sec
+        self.retry_backoff_max_sec = retry_backoff_max_sec
+        # None disables hedging, get_user_data otherwise sends a second request after this delay
+        self.hedge_delay_sec = hedge_delay_sec
+        self._circuit = _CircuitBreaker(circuit_failure_threshold, circuit_reset_sec)
+
+        # opt-in, get_user_data always asks Warden when no TTL is given
+        self._user_data_cache = _TTLCache(user_data_cache_max_size, user_data_cache_ttl_sec) if user_data_cache_ttl_sec else None
+
+    async def aclose(self):
+        await self._jwks.aclose()
+        await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.aclose()
+
+    def batch(self):
+        """
+        Starts a WardenBatch of user operations sent together in one request.
+        """
+
+        return WardenBatch(self)
+
+    def user_data_cache_stats(self):
+        """
+        Returns:
+            dict | None: Hits, misses, coalesced loads, evictions and size of the
+                get_user_data cache, None when it is disabled.
+        """
+
+        return self._user_data_cache.stats() if self._user_data_cache else None
+
+    def _user_cache_key(self, access_token: str):
+        """
+        (user id, token digest). The unverified user id only groups entries for invalidation,
+        the digest makes sure a response is only served again for the exact token it was fetched with.
+        """
+
+        try:
+            user_id = jwt.get_unverified_claims(access_token).get("id")
+        except JWTError:
+            return None
+
+        return (user_id, hashlib.sha256(access_token.encode()).hexdigest())
+
+    def _invalidate_user_data(self, req: fastapi.Request):
+        access_token = req.cookies.get("access_token")
+
+        if (self._user_data_cache is None or not access_token):
+            return
+
+        user_key = self._user_cache_key(access_token)
+
+        if (user_key is not None):
+            self._user_data_cache.discard_where(lambda key: key[0] == user_key[0])
+
     def _hash(_, text: str):
         return hashlib.sha256(text.encode()).hexdigest()
     
-    async def _query(self, method: Methods, route: str, cookies = None, params = None, body = None):
-        headers = {
-            "Warden-App-API-ID": self.__api_id,
-            "Warden-App-API-Key": self.__api_key
-        }
-        async with httpx.AsyncClient() as client:
-            return await client.request(
+    async def _query(self, method: Methods, route: str, cookies = None, params = None, body = None, content_type: str = None, hedge: bool = False):
+        headers = {}
+
+        if (cookies):
+            headers["Cookie"] = "; ".join(f"{name}={value}" for name, value in cookies.items())
+
+        # patch media types aren't plain JSON, so the body is encoded by hand
+        content = None
+        if (content_type is not None):
+            headers["Content-Type"] = content_type
+            content = json.dumps(body)
+            body = None
+
+        def send():
+            return self._client.request(
                 method=method, 
-                url=f"{self.__warden_server_address}{route}", 
+                url=route, 
                 headers=headers,
-                cookies=cookies,
                 params=params, 
-                json=body
+                json=body,
+                content=content
             )
+
+        if (hedge and self.hedge_delay_sec is not None):
+            return await self._send_with_retries(method, lambda: self._send_hedged(send))
+
+        return await self._send_with_retries(method, send)
+
+    def _backoff_sec(self, attempt: int):
+        # full jitter, so clients that failed together don't retry together
+        return random.uniform(0, min(self.retry_backoff_max_sec, self.retry_backoff_sec * 2 ** attempt))
+
+    async def _send_with_retries(self, method: Methods, send: Callable[[], Awaitable[httpx.Response]]):
+        """
+        GET requests are retried after transport errors and 5xx answers, other methods only
+        when the connection couldn't be opened, as the request never reached the server then.
+        Every attempt goes through the circuit breaker.
+        """
+
+        retryable = method in _RETRYABLE_METHODS
+
+        for attempt in range(self.max_retries + 1):
+            probe = self._circuit.before_call()
+
+            try:
+                res = await send()
+            except httpx.TransportError as error:
+                self._circuit.record_failure()
+
+                never_sent = isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+                if (attempt == self.max_retries or not (retryable or never_sent)):
+                    raise _warden_unavailable() from error
+
+                await asyncio.sleep(self._backoff_sec(attempt))
+                continue
+            finally:
+                if (probe):
+                    self._circuit.release_probe()
+
+            if (res.status_code not in _RETRY_STATUS_CODES):
+                self._circuit.record_success()
+                return res
+
+            self._circuit.record_failure()
+
+            if (attempt == self.max_retries or not retryable):
+                return res
+
+            delay_sec = self._backoff_sec(attempt)
+            retry_after = res.headers.get("Retry-After", "")
+            if (retry_after.isdigit()):
+                delay_sec = max(delay_sec, min(int(retry_after), self.retry_backoff_max_sec))
+
+            await asyncio.sleep(delay_sec)
+
+    async def _send_hedged(self, send: Callable[[], Awaitable[httpx.Response]]):
+        """
+        Sends a second copy of a slow request after hedge_delay_sec and keeps whichever
+        answers first without a server error. Only for reads.
+        """
+
+        first = asyncio.ensure_future(send())
+        done, _ = await asyncio.wait({ first }, timeout=self.hedge_delay_sec)
+
+        if (done):
+            return first.result()
+
+        pending = { first, asyncio.ensure_future(send()) }
+
+        try:
+            while (pending):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if (task.exception() is None and task.result().status_code not in _RETRY_STATUS_CODES):
+                        return task.result()
+
+            # both copies failed, report the last one
+            return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
         
+    async def verify_access_token(self, access_token: str):
+        """
+        Verifies a Warden access token locally against Warden's published keys, without
+        a request per call. Needs the server to sign with an asymmetric JWT_ALGORITHM.
+
+        Revocations (password change, deleted user) only take effect once the token
+        expires, use get_user_data where that matters.
+
+        Returns:
+            dict: The token claims.
+        """
+
+        try:
+            kid = jwt.get_unverified_header(access_token).get("kid")
+        except JWTError:
+            raise _invalid_access_token
+
+        try:
+            key = await self._jwks.get(kid)
+        except httpx.HTTPError:
+            raise fastapi.HTTPException(fastapi.status.HTTP_503_SERVICE_UNAVAILABLE, "Warden signing keys are unavailable.")
+
+        if (key is None or key.get("alg") not in _ASYMMETRIC_ALGORITHMS):
+            raise _invalid_access_token
+
+        try:
+            claims = jwt.decode(access_token, key, algorithms=[ key["alg"] ], audience=self.__api_id, issuer=_WARDEN_ISSUER)
+        except JWTError:
+            raise _invalid_access_token
+
+        # python-jose accepts tokens without an aud claim even when an audience is expected
+        if (claims.get("aud") != self.__api_id):
+            raise _invalid_access_token
+
+        return claims
+
     @abstractmethod
     def _parse_response(self, httpx_res: httpx.Response):
         pass
@@ -69,18 +603,53 @@ class _WardenInterface(ABC):
         pass
 
     @abstractmethod
-    async def get_user_data():
+    async def get_user_data(fields: list[str] = None):
         pass
 
     @abstractmethod
     async def update_user_data(user_data: dict):
         pass
 
+    @abstractmethod
+    async def patch_user_data(operations: list[dict]):
+        pass
+
     @abstractmethod
     async def delete_user():
         pass
 
+    @abstractmethod
+    async def refresh():
+        pass
+
+    @abstractmethod
+    async def logout():
+        pass
+
+    @abstractmethod
+    async def revoke_sessions():
+        pass
+
 class FastAPI_Warden(_WardenInterface):
+    async def current_user(self, req: fastapi.Request):
+        """
+        FastAPI dependency that verifies the request's access token locally.
+
+            @app.get("/me")
+            async def me(user: dict = Depends(warden.current_user)):
+                ...
+
+        Returns:
+            dict: The token claims, id and email among them.
+        """
+
+        access_token = req.cookies.get("access_token")
+
+        if (not access_token):
+            raise _invalid_access_token
+
+        return await self.verify_access_token(access_token)
+
     def _parse_response(self, httpx_res: httpx.Response):
         response = fastapi.Response(
             content=httpx_res.content,
@@ -136,42 +705,87 @@ class FastAPI_Warden(_WardenInterface):
         return self._parse_response(response)
     
     async def change_password(self, req: fastapi.Request, email: str, password: str, new_password: str):
-        password_hash = self._hash(password)
-        new_password_hash = self._hash(new_password)
         response = await self._query(
             Methods.PATCH, 
             "/user/changepassword",
             cookies=req.cookies,
             body={ 
                 "email": email, 
-                "password_hash": password_hash, 
-                "new_password_hash": new_password_hash 
+                "hash": self._hash(password), 
+                "new_hash": self._hash(new_password) 
             }
         )
+        self._invalidate_user_data(req)
         return self._parse_response(response)
 
-    async def get_user_data(self, req: fastapi.Request):
+    async def get_user_data(self, req: fastapi.Request, fields: list[str] = None):
         """
         Get user body.
 
+        Responses are cached per access token for user_data_cache_ttl_sec when the cache
+        is enabled. update_user_data, patch_user_data, change_password and delete_user on
+        this instance drop the user's cached responses.
+
+        Args:
+            fields: Dotted paths inside the user data to return, e.g. ["theme", "profile.name"].
+                Returns all of it when None.
+
         Returns:
             dict: Contains email and user body.
         """
         
+        async def load():
+            return await self._query(
+                Methods.GET, 
+                "/user",
+                cookies=req.cookies,
+                params={ "fields": ",".join(fields) } if fields else None,
+                hedge=True
+            )
+
+        access_token = req.cookies.get("access_token")
+        user_key = self._user_cache_key(access_token) if (self._user_data_cache and access_token) else None
+
+        if (user_key is None):
+            return self._parse_response(await load())
+
+        response = await self._user_data_cache.get_or_load(
+            (*user_key, tuple(fields or ())),
+            load,
+            store_if=lambda res: res.status_code == 200
+        )
+        return self._parse_response(response)
+
+    async def update_user_data(self, req: fastapi.Request, user_data: dict):
+        """
+        Merges user_data into the stored user data, None removes a field.
+        Only the given fields are sent and written.
+        """
+
         response = await self._query(
-            Methods.GET, 
+            Methods.PATCH, 
             "/user",
             cookies=req.cookies,
+            body=user_data,
+            content_type="application/merge-patch+json"
         )
+        self._invalidate_user_data(req)
         return self._parse_response(response)
 
-    async def update_user_data(self, req: fastapi.Request, user_data: dict):
+    async def patch_user_data(self, req: fastapi.Request, operations: list[dict]):
+        """
+        Applies JSON patch (RFC 6902) operations to the user data. Paths are relative
+        to the user data, e.g. { "op": "inc", "path": "/logins", "value": 1 }.
+        """
+
         response = await self._query(
             Methods.PATCH, 
             "/user",
             cookies=req.cookies,
-            body=user_data
+            body=operations,
+            content_type="application/json-patch+json"
         )
+        self._invalidate_user_data(req)
         return self._parse_response(response)
 
     async def delete_user(self, req: fastapi.Request):
@@ -180,4 +794,39 @@ class FastAPI_Warden(_WardenInterface):
             "/user",
             cookies=req.cookies,
         )
-        return self._parse_response(response)
\ No newline at end of file
+        self._invalidate_user_data(req)
+        return self._parse_response(response)
+
+    async def refresh(self, req: fastapi.Request):
+        """
+        Rotates the refresh token and issues a new access token. Not retried, a retried
+        rotation would look like a replayed refresh token and revoke the session.
+        """
+
+        response = await self._query(
+            Methods.POST, 
+            "/user/refresh",
+            cookies=req.cookies,
+        )
+        return self._parse_response(response)
+
+    async def logout(self, req: fastapi.Request):
+        response = await self._query(
+            Methods.GET, 
+            "/user/logout",
+            cookies=req.cookies,
+        )
+        self._invalidate_user_data(req)
+        return self._parse_response(response)
+
+    async def revoke_sessions(self, req: fastapi.Request):
+        """
+        Signs the user out on every device.
+        """
+
+        response = await self._query(
+            Methods.DELETE, 
+            "/user/sessions",
+            cookies=req.cookies,
+        )
+        return self._parse_response(response)
@@ -0,0 +1,83 @@
+"""
+Compares the per-call latency of a fresh httpx client per call, as the SDK used to do,
+with the SDK's pooled client.
+
+    python benchmark_client.py [--calls 500] [--server-address https://warden-nsem.vercel.app]
+
+Without --server-address a local stand-in for GET /user is started. It has no TLS
+and no network round trip, so the gap against a real deployment is larger.
+"""
+
+import argparse
+import asyncio
+import socket
+import statistics
+import threading
+import time
+from fastapi import FastAPI
+import httpx
+import uvicorn
+
+from Warden import FastAPI_Warden, Methods
+
+
+def start_stand_in_server():
+    stand_in = FastAPI()
+
+    @stand_in.get("/user")
+    async def get_user():
+        return { "email": "benchmark@gmail.com", "data": { "theme": "dark" } }
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(stand_in, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+
+    while (not server.started):
+        time.sleep(0.01)
+
+    return f"http://127.0.0.1:{port}"
+
+async def time_calls(calls: int, call):
+    latencies = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        await call()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def report(name: str, latencies: list[float]):
+    latencies.sort()
+    print(
+        f"{name:<16} mean {statistics.mean(latencies):7.2f} ms   "
+        f"p50 {latencies[len(latencies) // 2]:7.2f} ms   "
+        f"p99 {latencies[int(len(latencies) * 0.99)]:7.2f} ms"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--server-address")
+    args = parser.parse_args()
+
+    server_address = args.server_address or start_stand_in_server()
+
+    async def fresh_client_call():
+        async with httpx.AsyncClient() as client:
+            await client.get(f"{server_address}/user")
+
+    async with FastAPI_Warden("benchmark", "benchmark", server_address=server_address) as warden:
+        async def pooled_call():
+            await warden._query(Methods.GET, "/user")
+
+        # warm up both paths before timing
+        await fresh_client_call()
+        await pooled_call()
+
+        report("client per call", await time_calls(args.calls, fresh_client_call))
+        report("pooled client", await time_calls(args.calls, pooled_call))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,5 @@
 import asyncio
+from contextlib import asynccontextmanager
 import os
 from typing import List
 
@@ -15,7 +16,13 @@ warden = FastAPI_Warden(
     "1d6eae59d4cc2e8950e4066dd1efd7ec4a22a59ff587f4adabbdcf5da338f73f"
 )
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # closes the SDK's pooled connections on shutdown
+    async with warden:
+        yield
+
+app = FastAPI(lifespan=lifespan)
 
 app_router = APIRouter()
 
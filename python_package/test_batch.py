@@ -0,0 +1,28 @@
+import asyncio
+import json
+import httpx
+
+from Warden import FastAPI_Warden
+
+
+def test_batch_builder_sends_one_request():
+    sent = []
+
+    def handler(req: httpx.Request):
+        sent.append(json.loads(req.content))
+        assert req.url.path == "/batch"
+        assert req.headers["Warden-App-ID"] == "app"
+        return httpx.Response(200, json={ "results": [ { "status": 200 } ] * len(sent[-1]["operations"]) })
+
+    async def run():
+        async with FastAPI_Warden("app", "key", server_address="http://warden.test", transport=httpx.MockTransport(handler)) as warden:
+            batch = warden.batch().get("a").update_data("b", { "plan": "pro" }).lock("c", 60).unlock("c").delete("d")
+            assert len(batch) == 5
+
+            results = await batch.send()
+
+            assert len(sent) == 1
+            assert [ operation["op"] for operation in sent[0]["operations"] ] == [ "get", "update_data", "lock", "unlock", "delete" ]
+            assert len(results) == 5
+
+    asyncio.run(run())
@@ -0,0 +1,164 @@
+import asyncio
+from collections import deque
+import fastapi
+from fastapi import FastAPI, Request, Response
+import pytest
+import socket
+import threading
+import time
+import uvicorn
+
+from Warden import FastAPI_Warden
+
+
+class StandInServer:
+    """
+    Local stand-in for Warden that answers each request with the next planned fault:
+    an int status code, ("slow", seconds), or "ok" once the plan runs out.
+    """
+
+    def __init__(self):
+        self.plan = deque()
+        self.requests = 0
+
+        stand_in = FastAPI()
+
+        @stand_in.api_route("/user", methods=[ "GET", "PATCH", "DELETE" ])
+        async def user(req: Request):
+            self.requests += 1
+            fault = self.plan.popleft() if self.plan else "ok"
+
+            if (isinstance(fault, int)):
+                return Response(status_code=fault)
+
+            if (isinstance(fault, tuple)):
+                await asyncio.sleep(fault[1])
+
+            return { "email": "user@gmail.com", "data": {} }
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+
+        self.server = uvicorn.Server(uvicorn.Config(stand_in, port=self.port, log_level="warning"))
+
+    def start(self):
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while (not self.server.started):
+            time.sleep(0.01)
+
+    def stop(self):
+        self.server.should_exit = True
+
+@pytest.fixture(scope="module")
+def stand_in():
+    server = StandInServer()
+    server.start()
+    yield server
+    server.stop()
+
+@pytest.fixture(autouse=True)
+def reset(stand_in: StandInServer):
+    stand_in.plan.clear()
+    stand_in.requests = 0
+
+def warden_for(stand_in: StandInServer, **options):
+    return FastAPI_Warden(
+        "app", "key",
+        server_address=f"http://127.0.0.1:{stand_in.port}",
+        retry_backoff_sec=0.01,
+        **options
+    )
+
+def request():
+    return fastapi.Request({ "type": "http", "headers": [] })
+
+def test_retries_reads_only(stand_in: StandInServer):
+    async def run():
+        async with warden_for(stand_in) as warden:
+            stand_in.plan.extend([ 503, 502 ])
+            res = await warden.get_user_data(request())
+            assert res.status_code == 200
+            assert stand_in.requests == 3
+
+            stand_in.requests = 0
+            stand_in.plan.extend([ 503 ])
+            res = await warden.update_user_data(request(), { "theme": "dark" })
+            assert res.status_code == 503
+            assert stand_in.requests == 1
+
+            # a repeated delete would report 401 for a delete that already happened
+            stand_in.requests = 0
+            stand_in.plan.extend([ 503 ])
+            res = await warden.delete_user(request())
+            assert res.status_code == 503
+            assert stand_in.requests == 1
+
+    asyncio.run(run())
+
+def test_circuit_breaker_fails_fast_then_recovers(stand_in: StandInServer):
+    async def run():
+        async with warden_for(stand_in, max_retries=0, circuit_failure_threshold=2, circuit_reset_sec=0.2) as warden:
+            stand_in.plan.extend([ 500, 500 ])
+            assert (await warden.get_user_data(request())).status_code == 500
+            assert (await warden.get_user_data(request())).status_code == 500
+
+            with pytest.raises(fastapi.HTTPException) as error:
+                await warden.get_user_data(request())
+            assert error.value.status_code == 503
+            assert stand_in.requests == 2
+
+            await asyncio.sleep(0.25)
+
+            # the probe succeeds and closes the circuit
+            assert (await warden.get_user_data(request())).status_code == 200
+            assert (await warden.get_user_data(request())).status_code == 200
+            assert stand_in.requests == 4
+
+    asyncio.run(run())
+
+def test_cancelled_probe_releases_the_circuit(stand_in: StandInServer):
+    async def run():
+        async with warden_for(stand_in, max_retries=0, circuit_failure_threshold=1, circuit_reset_sec=0.1) as warden:
+            stand_in.plan.extend([ 500, ("slow", 1.0) ])
+            assert (await warden.get_user_data(request())).status_code == 500
+
+            await asyncio.sleep(0.15)
+
+            probe = asyncio.ensure_future(warden.get_user_data(request()))
+            await asyncio.sleep(0.05)
+            probe.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await probe
+
+            # the next call probes instead of failing fast for good
+            assert (await warden.get_user_data(request())).status_code == 200
+
+    asyncio.run(run())
+
+def test_hedged_get_cuts_tail_latency(stand_in: StandInServer):
+    async def run():
+        async with warden_for(stand_in, hedge_delay_sec=0.05) as warden:
+            stand_in.plan.extend([ ("slow", 1.0) ])
+
+            started = time.perf_counter()
+            res = await warden.get_user_data(request())
+
+            assert res.status_code == 200
+            assert time.perf_counter() - started < 0.5
+            assert stand_in.requests == 2
+
+    asyncio.run(run())
+
+def test_unreachable_server_is_reported_as_unavailable():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    async def run():
+        async with FastAPI_Warden("app", "key", server_address=f"http://127.0.0.1:{port}", retry_backoff_sec=0.01) as warden:
+            with pytest.raises(fastapi.HTTPException) as error:
+                await warden.login("user@gmail.com", "password")
+            assert error.value.status_code == 503
+
+    asyncio.run(run())
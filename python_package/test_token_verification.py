@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import ecdsa
+import fastapi
+import httpx
+from jose import jwk, jwt
+import pytest
+
+from Warden import FastAPI_Warden
+
+APP_ID = "683bfaa26caa16a64f98f5e4"
+
+
+def new_key(kid: str):
+    pem = ecdsa.SigningKey.generate(curve=ecdsa.NIST256p).to_pem().decode()
+    public_jwk = { **jwk.construct(pem, "ES256").public_key().to_dict(), "kid": kid, "use": "sig" }
+    return pem, public_jwk
+
+def sign(pem: str, kid: str, audience: str = APP_ID, expire_in_sec: int = 60):
+    claims = {
+        "id": "user",
+        "aud": audience,
+        "iss": "warden",
+        "exp": datetime.now(tz=timezone.utc) + timedelta(seconds=expire_in_sec)
+    }
+    return jwt.encode(claims, pem, "ES256", headers={ "kid": kid })
+
+def test_verifies_locally_and_follows_rotation():
+    old_pem, old_jwk = new_key("old")
+    new_pem, new_jwk = new_key("new")
+
+    published = [ old_jwk ]
+    jwks_requests = 0
+
+    def handler(req: httpx.Request):
+        nonlocal jwks_requests
+        assert req.url.path == "/.well-known/jwks.json"
+        jwks_requests += 1
+        return httpx.Response(200, json={ "keys": list(published) })
+
+    async def run():
+        nonlocal published
+
+        async with FastAPI_Warden(
+            APP_ID, "key",
+            server_address="http://warden.test",
+            transport=httpx.MockTransport(handler)
+        ) as warden:
+            warden._jwks.min_refresh_sec = 0
+
+            # concurrent first verifications share one JWKS request
+            claims = await asyncio.gather(*[ warden.verify_access_token(sign(old_pem, "old")) for _ in range(10) ])
+            assert all(claim["id"] == "user" for claim in claims)
+            assert jwks_requests == 1
+
+            # an unknown kid refreshes the keys once
+            published = [ old_jwk, new_jwk ]
+            assert (await warden.verify_access_token(sign(new_pem, "new")))["id"] == "user"
+            assert jwks_requests == 2
+
+            for token in (
+                sign(old_pem, "old", audience="other_app"),
+                sign(old_pem, "old", expire_in_sec=-60),
+                sign(new_pem, "old"),
+                jwt.encode({ "id": "user", "aud": APP_ID, "iss": "warden" }, "secret", "HS256", headers={ "kid": "old" }),
+                "not a token"
+            ):
+                with pytest.raises(fastapi.HTTPException) as error:
+                    await warden.verify_access_token(token)
+                assert error.value.status_code == 401
+
+    asyncio.run(run())
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import fastapi
+import httpx
+import json
+from jose import jwt
+from starlette.datastructures import Headers
+
+from Warden import FastAPI_Warden
+
+
+def request_with_token(user_id: str):
+    access_token = jwt.encode({ "id": user_id }, "secret", "HS256")
+    scope = { "type": "http", "headers": Headers({ "cookie": f"access_token={access_token}" }).raw }
+    return fastapi.Request(scope)
+
+def test_get_user_data_is_cached_coalesced_and_invalidated():
+    user_requests = 0
+
+    async def handler(req: httpx.Request):
+        nonlocal user_requests
+        if (req.method == "GET"):
+            user_requests += 1
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, json={ "email": "user@gmail.com", "data": { "version": user_requests } })
+        return httpx.Response(200, json={ "message": "User data updated." })
+
+    async def run():
+        async with FastAPI_Warden(
+            "app", "key",
+            server_address="http://warden.test",
+            user_data_cache_ttl_sec=60,
+            transport=httpx.MockTransport(handler)
+        ) as warden:
+            req = request_with_token("user")
+
+            responses = await asyncio.gather(*[ warden.get_user_data(req) for _ in range(10) ])
+            assert user_requests == 1
+            assert all(res.body == responses[0].body for res in responses)
+
+            await warden.get_user_data(req)
+            assert user_requests == 1
+
+            # another user, or another field selection, is a different entry
+            await warden.get_user_data(request_with_token("other"))
+            await warden.get_user_data(req, fields=[ "theme" ])
+            assert user_requests == 3
+
+            await warden.update_user_data(req, { "theme": "dark" })
+            res = await warden.get_user_data(req)
+            assert user_requests == 4
+            assert b'"version":4' in res.body
+
+            stats = warden.user_data_cache_stats()
+            assert stats["hits"] == 1
+            assert stats["coalesced"] == 9
+            assert stats["invalidations"] == 1
+
+    asyncio.run(run())
+
+def test_change_password_sends_hashes_and_invalidates():
+    user_requests = 0
+    change_password_bodies = []
+
+    async def handler(req: httpx.Request):
+        nonlocal user_requests
+        if (req.url.path == "/user/changepassword"):
+            change_password_bodies.append(json.loads(req.content))
+            return httpx.Response(200, json={ "message": "Password changed successfully." })
+        user_requests += 1
+        return httpx.Response(200, json={ "email": "user@gmail.com", "data": {} })
+
+    async def run():
+        async with FastAPI_Warden(
+            "app", "key",
+            server_address="http://warden.test",
+            user_data_cache_ttl_sec=60,
+            transport=httpx.MockTransport(handler)
+        ) as warden:
+            req = request_with_token("user")
+
+            await warden.get_user_data(req)
+            res = await warden.change_password(req, "user@gmail.com", "old", "new")
+            assert res.status_code == 200
+
+            # the server's ChangePassword schema
+            assert change_password_bodies == [ {
+                "email": "user@gmail.com",
+                "hash": hashlib.sha256(b"old").hexdigest(),
+                "new_hash": hashlib.sha256(b"new").hexdigest()
+            } ]
+
+            await warden.get_user_data(req)
+            assert user_requests == 2
+
+    asyncio.run(run())
+
+def test_cache_is_opt_in():
+    async def run():
+        async with FastAPI_Warden("app", "key", server_address="http://warden.test") as warden:
+            assert warden.user_data_cache_stats() is None
+
+    asyncio.run(run())
@@ -2,27 +2,79 @@ from datetime import datetime
 import uuid
 from bson import ObjectId
 from fastapi import Depends, Request
-from jose import jwt
 import os
 import hashlib
+import time
 from pymongo.collection import Collection
 
 from models import Admin, App, User
+from signing import ADMIN_AUDIENCE, InvalidToken, signing_keys
 from utils import exception
+from utils.cache import TTLCache
 from database import db
+from throttling import limit_app, limit_by_ip
 
-SECRET_KEY = os.environ["SECRET_KEY"]
-ALGORITHM = os.environ["HASHING_ALGORITHM"]
+APP_CACHE_MAX_SIZE = int(os.environ.get("APP_CACHE_MAX_SIZE", 1024))
+APP_CACHE_TTL_SEC = float(os.environ.get("APP_CACHE_TTL_SEC", 60))
+
+# "database" checks the user in the database on every authenticated request.
+# "token" trusts the signed access token and only checks its token_version through a cache.
+# The cache is per worker: a revocation is seen at once by the worker that made it, other
+# workers keep accepting the revoked token for up to TOKEN_VERSION_CACHE_TTL_SEC.
+USER_AUTH_MODE = os.environ.get("USER_AUTH_MODE", "database")
+TOKEN_VERSION_CACHE_MAX_SIZE = int(os.environ.get("TOKEN_VERSION_CACHE_MAX_SIZE", 100_000))
+TOKEN_VERSION_CACHE_TTL_SEC = float(os.environ.get("TOKEN_VERSION_CACHE_TTL_SEC", 30))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get("TOKEN_CACHE_MAX_SIZE", 10_000))
 
 admin_col = db.admin
 app_col = db.app
 
+# verified (app_id, api_key_hash) -> App
+app_cache = TTLCache(APP_CACHE_MAX_SIZE, APP_CACHE_TTL_SEC)
+# (app_id, user_id) -> token_version
+token_version_cache = TTLCache(TOKEN_VERSION_CACHE_MAX_SIZE, TOKEN_VERSION_CACHE_TTL_SEC)
+# (audience, sha256 of the raw token) -> verified claims, each entry expires with its token
+token_cache = TTLCache(TOKEN_CACHE_MAX_SIZE, 0)
+
+
+def generate_token(data: dict, expire: datetime, audience: str):
+    """
+    audience is ADMIN_AUDIENCE for admin tokens and the app id for user tokens.
+    """
+
+    return signing_keys.encode(data, expire, audience)
+
+def decode_token(token: str, audience: str):
+    """
+    Verifies the token once and serves repeats of the same token from token_cache until it
+    expires. Revocation is still checked by the callers through token_version.
+    """
+
+    key = (audience, hashlib.sha256(token.encode()).digest())
+    claims = token_cache.get(key)
 
-def generate_token(data: dict, expire: datetime):
-    to_encode = data.copy()
-    to_encode.update({ "exp": expire })
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, ALGORITHM)
-    return encoded_jwt
+    if (claims is None):
+        claims = signing_keys.decode(token, audience)
+        if ("exp" in claims):
+            token_cache.set(key, claims, claims["exp"] - time.time())
+
+    # callers get their own copy so nothing they change leaks into the cache
+    return dict(claims)
+
+def current_session_id(req: Request, audience: str):
+    """
+    Returns the session id of the request's refresh token, None without a valid one.
+    """
+
+    refresh_token = req.cookies.get("refresh_token")
+
+    if (not refresh_token):
+        return None
+
+    try:
+        return decode_token(refresh_token, audience).get("sid")
+    except InvalidToken:
+        return None
 
 def hash(text: str):
     return hashlib.sha256(text.encode()).hexdigest()
@@ -30,16 +82,16 @@ def hash(text: str):
 def generate_api_key():
     return hash(str(uuid.uuid4()))
 
-def get_current_admin(req: Request):
+async def get_current_admin(req: Request):
     access_token = req.cookies.get("access_token")
 
     if (not access_token):
         raise exception.unauthorized_access
 
     try:
-        admin_id = jwt.decode(access_token, SECRET_KEY, ALGORITHM)["id"]
+        admin_id = decode_token(access_token, ADMIN_AUDIENCE)["id"]
 
-        admin: dict = admin_col.find_one({ "_id": ObjectId(admin_id) })
+        admin: dict = await admin_col.find_one({ "_id": ObjectId(admin_id) })
 
         if (not admin):
             raise exception.unauthorized_access
@@ -51,26 +103,48 @@ def get_current_admin(req: Request):
     except:
         raise exception.invalid_access_token
     
-def get_app(req: Request):
+async def get_app(req: Request):
     app_id = req.headers.get("Warden-App-ID")
     app_api_key = req.headers.get("Warden-App-API-Key")
 
     if (app_id == None or app_api_key == None):
         raise exception.missing_headers
+
+    if (not ObjectId.is_valid(app_id)):
+        raise exception.invalid_headers
+
+    # other spellings of the same id, e.g. uppercase hex, must share its cache entry
+    app_id = str(ObjectId(app_id))
     
     api_key_hash = hash(app_api_key)
 
-    app = app_col.find_one({ 
-        "_id": ObjectId(app_id), 
-        "api_key_hash": api_key_hash
-    })
+    async def load_app():
+        app = await app_col.find_one({ 
+            "_id": ObjectId(app_id), 
+            "api_key_hash": api_key_hash
+        })
+        return App(**app) if app else None
+
+    # an app's backend sends all its users' requests from one address, so only requests
+    # whose key isn't verified and cached yet count against the address. Checked per caller,
+    # a limited caller must not fail the load other callers share
+    if ((app_id, api_key_hash) not in app_cache):
+        await limit_by_ip(req)
+
+    app = await app_cache.get_or_load((app_id, api_key_hash), load_app)
 
     if (not app):
         raise exception.invalid_headers
 
-    return App(**app)
+    await limit_app(req, app)
+
+    return app
+
+def invalidate_app(app_id: str):
+    app_id = str(ObjectId(app_id))
+    app_cache.discard_where(lambda key: key[0] == app_id)
 
-def get_app_and_current_user(req: Request, app: App = Depends(get_app)):
+async def get_app_and_current_user(req: Request, app: App = Depends(get_app)):
     app_col = db[f"app_{app.id}"]
 
     access_token = req.cookies.get("access_token")
@@ -79,9 +153,10 @@ def get_app_and_current_user(req: Request, app: App = Depends(get_app)):
         raise exception.unauthorized_access
 
     try:
-        user_id = jwt.decode(access_token, SECRET_KEY, ALGORITHM)["id"]
+        claims = decode_token(access_token, app.id)
+        user_id = claims["id"]
 
-        user: dict = app_col.find_one({ "_id": ObjectId(user_id) })
+        user: dict = await app_col.find_one({ "_id": ObjectId(user_id) })
 
         if (not user):
             raise exception.unauthorized_access
@@ -89,6 +164,58 @@ def get_app_and_current_user(req: Request, app: App = Depends(get_app)):
         if (user.get("verification_code")):
             return exception.account_not_verified
 
-        return app, User(**user)
+        user = User(**user)
+
+        if (claims.get("token_version", 0) != user.token_version):
+            raise exception.unauthorized_access
+
+        return app, user
+    except:
+        raise exception.invalid_access_token
+
+async def get_app_and_current_user_id(req: Request, app: App = Depends(get_app)):
+    """
+    Identity-only variant of get_app_and_current_user for handlers that don't need the user document.
+
+    Only the user's token_version is read, from the cache in token mode.
+    """
+
+    access_token = req.cookies.get("access_token")
+
+    if (not access_token):
+        raise exception.unauthorized_access
+
+    try:
+        claims = decode_token(access_token, app.id)
+        user_id = claims["id"]
+        ObjectId(user_id)
     except:
-        raise exception.invalid_access_token
\ No newline at end of file
+        raise exception.invalid_access_token
+
+    if (USER_AUTH_MODE == "token"):
+        token_version = await token_version_cache.get_or_load(
+            (app.id, user_id), 
+            lambda: load_token_version(app.id, user_id)
+        )
+    else:
+        token_version = await load_token_version(app.id, user_id)
+
+    if (token_version is None or claims.get("token_version", 0) != token_version):
+        raise exception.unauthorized_access
+
+    return app, user_id
+
+async def load_token_version(app_id: str, user_id: str):
+    user = await db[f"app_{app_id}"].find_one(
+        { "_id": ObjectId(user_id) }, 
+        { "token_version": 1 }
+    )
+    return user.get("token_version", 0) if user else None
+
+def revoke_user_tokens(app_id: str, user_id: str):
+    """
+    Call after incrementing the user's token_version in the database. Only this worker's
+    cache is cleared, others catch up within TOKEN_VERSION_CACHE_TTL_SEC.
+    """
+
+    token_version_cache.discard((app_id, user_id))
\ No newline at end of file
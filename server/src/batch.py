@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from auth import revoke_user_tokens
+from database import db
+from schemas import BatchOperation, BatchResult, UserDataResponse
+from sessions import sessions
+from utils.patch import merge_patch_to_update
+
+WRITE_OPS = frozenset({ "update_data", "delete", "lock", "unlock" })
+
+
+def _write_request(operation: BatchOperation, user_id: ObjectId):
+    if (operation.op == "update_data"):
+        if (operation.data is None):
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "update_data needs data.")
+        update = merge_patch_to_update(operation.data)
+        return UpdateOne({ "_id": user_id }, update) if update else None
+
+    if (operation.op == "delete"):
+        return DeleteOne({ "_id": user_id })
+
+    if (operation.op == "lock"):
+        if (operation.lock_sec is None):
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "lock needs lock_sec.")
+        locked_until = datetime.now(tz=timezone.utc) + timedelta(seconds=operation.lock_sec)
+        return UpdateOne({ "_id": user_id }, { "$set": { "locked_until": locked_until } })
+
+    return UpdateOne({ "_id": user_id }, { "$set": { "login_attempts": 0 }, "$unset": { "locked_until": "" } })
+
+async def run_user_batch(app_id: str, operations: list[BatchOperation]):
+    """
+    Runs the operations against the app's users in at most three round trips: one $in
+    read, one ordered bulk_write, and a second read only when a get targets a user the
+    batch also writes, so gets see the batch's writes.
+
+    Writes apply in order and stop at the first failure, later writes report 409.
+    """
+
+    app_col = db[f"app_{app_id}"]
+    results: list[BatchResult] = [ None ] * len(operations)
+    user_ids: list[ObjectId] = [ None ] * len(operations)
+
+    for index, operation in enumerate(operations):
+        if (not ObjectId.is_valid(operation.user_id)):
+            results[index] = BatchResult(status=status.HTTP_400_BAD_REQUEST, error="Invalid user id.")
+        else:
+            user_ids[index] = ObjectId(operation.user_id)
+
+    projection = { "email": 1, "data": 1 }
+    requested_ids = list({ user_id for user_id in user_ids if user_id })
+    users = { user["_id"]: user async for user in app_col.find({ "_id": { "$in": requested_ids } }, projection) }
+
+    requests = []
+    request_indexes = []
+    written_ids = set()
+
+    for index, operation in enumerate(operations):
+        if (results[index] is not None):
+            continue
+
+        if (user_ids[index] not in users):
+            results[index] = BatchResult(status=status.HTTP_404_NOT_FOUND, error="User not found.")
+            continue
+
+        if (operation.op not in WRITE_OPS):
+            continue
+
+        try:
+            request = _write_request(operation, user_ids[index])
+        except HTTPException as error:
+            results[index] = BatchResult(status=error.status_code, error=error.detail)
+            continue
+
+        results[index] = BatchResult(status=status.HTTP_200_OK)
+
+        if (request is not None):
+            requests.append(request)
+            request_indexes.append(index)
+            written_ids.add(user_ids[index])
+
+    if (requests):
+        try:
+            await app_col.bulk_write(requests, ordered=True)
+        except BulkWriteError as error:
+            failed_at = error.details["writeErrors"][0]["index"]
+            results[request_indexes[failed_at]] = BatchResult(
+                status=status.HTTP_400_BAD_REQUEST,
+                error=error.details["writeErrors"][0]["errmsg"]
+            )
+            for index in request_indexes[failed_at + 1:]:
+                results[index] = BatchResult(status=status.HTTP_409_CONFLICT, error="Not applied, an earlier write failed.")
+
+    deleted_ids = [
+        str(user_ids[index]) for index, operation in enumerate(operations)
+        if operation.op == "delete" and results[index].status == status.HTTP_200_OK
+    ]
+
+    for user_id in deleted_ids:
+        revoke_user_tokens(app_id, user_id)
+    await sessions.revoke_accounts(app_id, deleted_ids)
+
+    get_indexes = [ index for index, operation in enumerate(operations) if operation.op == "get" and results[index] is None ]
+
+    stale_ids = list({ user_ids[index] for index in get_indexes } & written_ids)
+    if (stale_ids):
+        reread = { user["_id"]: user async for user in app_col.find({ "_id": { "$in": stale_ids } }, projection) }
+        users.update({ user_id: reread.get(user_id) for user_id in stale_ids })
+
+    for index in get_indexes:
+        user = users[user_ids[index]]
+        if (user is None):
+            results[index] = BatchResult(status=status.HTTP_404_NOT_FOUND, error="User not found.")
+        else:
+            results[index] = BatchResult(
+                status=status.HTTP_200_OK,
+                user=UserDataResponse(email=user["email"], data=user.get("data", {}))
+            )
+
+    return results
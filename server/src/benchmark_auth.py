@@ -0,0 +1,196 @@
+"""
+Times the per-request CPU work of the authentication path in isolation: API key hashing,
+token signing and verification, model construction, log masking, JSON responses and
+request metrics.
+Payloads that scale with the user's data are timed with 1 KB, 64 KB and 1 MB of data.
+
+    python benchmark_auth.py [--save results.json] [--compare ../benchmarks/auth_baseline.json]
+                             [--filter generate_token]
+
+--compare prints each benchmark next to the saved run with the relative change, so an
+optimization can show its effect against ../benchmarks/auth_baseline.json. Results are
+per call, the median of several timed repeats.
+"""
+
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=".env.development")
+load_dotenv()
+
+import os
+
+# nothing here talks to the database or sends mail, the imports only need the settings
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017/")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("HASHING_ALGORITHM", "HS256")
+os.environ.setdefault("EMAIL_SERVICE_USER", "benchmark@warden.test")
+os.environ.setdefault("EMAIL_SERVICE_PASSWORD", "benchmark")
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import json
+import platform
+import statistics
+import subprocess
+import time
+import timeit
+from bson import ObjectId
+
+from auth import decode_token, generate_token, hash, token_cache
+from models import Admin, App, User
+from signing import signing_keys
+from utils import metrics, success
+from utils.logging import logger
+
+DATA_SIZES = { "1kb": 1024, "64kb": 64 * 1024, "1mb": 1024 * 1024 }
+REPEATS = 5
+
+
+def user_data(size_bytes: int):
+    """
+    Nested user data whose JSON encoding is about size_bytes long.
+    """
+
+    items = []
+    data = { "theme": "dark", "profile": { "name": "Benchmark User", "locale": "en" }, "items": items }
+
+    # add the missing bytes' worth of items at once, re-encoding per item is quadratic
+    while ((size := len(json.dumps(data))) < size_bytes):
+        for _ in range(max(1, (size_bytes - size) // 80)):
+            index = len(items)
+            items.append({ "id": index, "name": f"item-{index:06d}", "tags": [ "a", "b", "c" ], "score": index * 1.5 })
+
+    return data
+
+def user_document(size_bytes: int):
+    return {
+        "_id": ObjectId(),
+        "email": "benchmark@gmail.com",
+        "hash": "$scrypt$n=16384,r=8,p=1$" + "0" * 22 + "$" + "0" * 43,
+        "login_attempts": 0,
+        "data": user_data(size_bytes),
+        "token_version": 3
+    }
+
+def benchmarks():
+    """
+    Returns (name, callable) pairs, each callable doing one unit of work.
+    """
+
+    expire = datetime.now(tz=timezone.utc) + timedelta(hours=1)
+    app_id = str(ObjectId())
+
+    app_document = {
+        "_id": ObjectId(app_id),
+        "name": "benchmark_app",
+        "access_token_exp_sec": 60,
+        "refresh_token_exp_sec": 3600,
+        "max_login_attempts": 5,
+        "lockout_time_per_attempt_sec": 60,
+        "api_key_hash": "0" * 64
+    }
+    admin_document = {
+        "_id": ObjectId(),
+        "email": "admin@gmail.com",
+        "hash": "0" * 64,
+        "apps": [ ObjectId() for _ in range(10) ],
+        "login_attempts": 0
+    }
+
+    yield "auth.hash", lambda: hash("0" * 64)
+    yield "App(**document)", lambda: App(**app_document)
+    yield "Admin(**document)", lambda: Admin(**admin_document)
+    yield "success.ok", lambda: success.ok("User data updated.")
+
+    def record_request_metrics():
+        # what MetricsMiddleware records around every request
+        metrics.http_requests_in_progress.inc("GET")
+        started = time.perf_counter()
+        metrics.http_request_duration.observe(time.perf_counter() - started, "GET", "/user", "200")
+        metrics.http_requests_in_progress.dec("GET")
+
+    yield "request metrics", record_request_metrics
+
+    for size_name, size_bytes in DATA_SIZES.items():
+        document = user_document(size_bytes)
+        user = User(**document)
+        claims = user.model_dump(exclude={"hash"})
+        token = generate_token(claims, expire, app_id)
+
+        def decode_cached(token=token):
+            return decode_token(token, app_id)
+
+        def decode_uncached(token=token):
+            token_cache.clear()
+            return decode_token(token, app_id)
+
+        yield f"User(**document) [{size_name}]", lambda document=document: User(**document)
+        yield f"User.model_dump [{size_name}]", lambda user=user: user.model_dump(exclude={"hash"})
+        yield f"generate_token [{size_name}]", lambda claims=claims: generate_token(claims, expire, app_id)
+        yield f"jwt decode [{size_name}]", lambda token=token: signing_keys.decode(token, app_id)
+        yield f"decode_token cached [{size_name}]", decode_cached
+        yield f"decode_token uncached [{size_name}]", decode_uncached
+        yield f"logger._mask_sensitive [{size_name}]", lambda document=document: logger._mask_sensitive(document)
+
+def time_call(call):
+    timer = timeit.Timer(call)
+    number, _ = timer.autorange()
+    per_call_sec = [ total / number for total in timer.repeat(REPEATS, number) ]
+
+    return {
+        "median_us": round(statistics.median(per_call_sec) * 1e6, 3),
+        "min_us": round(min(per_call_sec) * 1e6, 3),
+        "ops_per_sec": round(1 / statistics.median(per_call_sec), 1),
+        "calls": number * REPEATS
+    }
+
+def current_commit():
+    try:
+        return subprocess.run([ "git", "rev-parse", "HEAD" ], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def report(name: str, result: dict, baseline: dict = None):
+    line = f"{name:<36} {result['median_us']:14.2f} us   {result['ops_per_sec']:14.1f} ops/s"
+
+    baseline_result = (baseline or {}).get(name)
+    if (baseline_result):
+        change = (result["median_us"] - baseline_result["median_us"]) / baseline_result["median_us"] * 100
+        line += f"   baseline {baseline_result['median_us']:14.2f} us   {change:+7.1f}%"
+
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    baseline = None
+    if (args.compare):
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+
+    results = {}
+    for name, call in benchmarks():
+        if (args.filter and args.filter not in name):
+            continue
+
+        results[name] = time_call(call)
+        report(name, results[name], baseline)
+
+    if (args.save):
+        with open(args.save, "w") as file:
+            json.dump({
+                "commit": current_commit(),
+                "created_at": datetime.now(tz=timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "processor": platform.processor() or None,
+                "results": results
+            }, file, indent=2)
+            file.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Measures password verifications per second, overall and per worker, for a few scrypt
+parameter sets next to the legacy SHA-256 hash, to help pick PASSWORD_SCRYPT_N and
+PASSWORD_HASH_WORKERS for a deployment.
+
+    python benchmark_passwords.py [--logins 200] [--workers 4]
+
+Each login is one verify against a stored hash, the same work POST /user/login does.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import time
+
+from passwords import PasswordHasher
+
+PARAMETER_SETS = [
+    { "n": 2 ** 13, "r": 8, "p": 1 },
+    { "n": 2 ** 14, "r": 8, "p": 1 },
+    { "n": 2 ** 15, "r": 8, "p": 1 },
+    { "n": 2 ** 16, "r": 8, "p": 1 },
+]
+
+
+async def time_logins(hasher: PasswordHasher, stored_hash: str, logins: int):
+    started = time.perf_counter()
+    results = await asyncio.gather(*[ hasher.verify("client_hash", stored_hash) for _ in range(logins) ])
+    elapsed = time.perf_counter() - started
+
+    assert all(matches for matches, _ in results)
+    return logins / elapsed
+
+def report(name: str, logins_per_sec: float, workers: int):
+    print(f"{name:<24} {logins_per_sec:10.1f} logins/s   {logins_per_sec / workers:10.1f} logins/s per core")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    # legacy hashes verify inline, time them without the upgrade a login would trigger
+    legacy_hash = hashlib.sha256(b"client_hash").hexdigest()
+    started = time.perf_counter()
+    for _ in range(args.logins):
+        hashlib.sha256(b"client_hash").hexdigest() == legacy_hash
+    report("sha256 (legacy)", args.logins / (time.perf_counter() - started), 1)
+
+    for params in PARAMETER_SETS:
+        hasher = PasswordHasher(args.workers, args.logins, **params)
+        try:
+            stored_hash = await hasher.hash("client_hash")
+            report(f"scrypt n=2^{params['n'].bit_length() - 1} r={params['r']} p={params['p']}",
+                await time_logins(hasher, stored_hash, args.logins), args.workers)
+        finally:
+            hasher.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,139 @@
 from typing import Callable
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 import os
 
 from utils import exception
 from utils.logging import logger
 
-db = MongoClient(os.environ["MONGODB_URL"]).warden
\ No newline at end of file
+# "async" uses PyMongo's native asyncio client. "sync" keeps the blocking
+# MongoClient and runs each call in Starlette's threadpool, for comparison.
+MONGODB_DRIVER = os.environ.get("MONGODB_DRIVER", "async")
+
+
+class _ThreadedCursor:
+    """
+    Sync cursor exposed through the same awaitable interface as AsyncCursor.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._cursor, name)
+
+        if (not callable(attr)):
+            return attr
+
+        # keep chained calls such as .sort().limit() wrapped
+        def chained(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return self if result is self._cursor else result
+
+        return chained
+
+    async def to_list(self, length: int = None):
+        return await run_in_threadpool(self._cursor.to_list, length)
+
+    async def close(self):
+        await run_in_threadpool(self._cursor.close)
+
+    def __aiter__(self):
+        return iterate_in_threadpool(self._cursor)
+
+
+class _ThreadedCollection:
+    """
+    Sync collection exposed through the same awaitable interface as AsyncCollection.
+    """
+
+    def __init__(self, collection: Collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return _ThreadedCursor(self._collection.find(*args, **kwargs))
+
+    async def aggregate(self, *args, **kwargs):
+        return _ThreadedCursor(await run_in_threadpool(self._collection.aggregate, *args, **kwargs))
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._collection, name)
+
+        if (not callable(attr) or isinstance(attr, Collection)):
+            return attr
+
+        async def threaded(*args, **kwargs):
+            return await run_in_threadpool(attr, *args, **kwargs)
+
+        return threaded
+
+
+class _ThreadedDatabase:
+    """
+    Sync database exposed through the same awaitable interface as AsyncDatabase.
+    """
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name: str):
+        return _ThreadedCollection(self._database[name])
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._database, name)
+
+        if (isinstance(attr, Collection)):
+            return _ThreadedCollection(attr)
+
+        if (not callable(attr)):
+            return attr
+
+        async def threaded(*args, **kwargs):
+            return await run_in_threadpool(attr, *args, **kwargs)
+
+        return threaded
+
+
+if (MONGODB_DRIVER == "sync"):
+    client = MongoClient(os.environ["MONGODB_URL"])
+    db = _ThreadedDatabase(client.warden)
+elif (MONGODB_DRIVER == "async"):
+    client = AsyncMongoClient(os.environ["MONGODB_URL"])
+    db = client.warden
+else:
+    raise EnvironmentError(f"Unknown MONGODB_DRIVER '{MONGODB_DRIVER}', expected 'async' or 'sync'.")
+
+async def close_client():
+    if (MONGODB_DRIVER == "sync"):
+        await run_in_threadpool(client.close)
+    else:
+        await client.close()
+
+async def ensure_app_indexes(app_id: str):
+    await db[f"app_{app_id}"].create_index("email", unique=True)
+
+async def ensure_indexes():
+    """
+    Idempotently creates the indexes every collection relies on.
+
+    Returns the names of collections whose indexes could not be built,
+    e.g. because they already hold duplicate emails.
+    """
+
+    failed = []
+
+    collections = [ "admin" ] + [
+        name for name in await db.list_collection_names()
+        if name.startswith("app_")
+    ]
+
+    for name in collections:
+        try:
+            await db[name].create_index("email", unique=True)
+        except OperationFailure as error:
+            logger.error(f"Could not create email index on {name}.", error)
+            failed.append(name)
+
+    return failed
@@ -0,0 +1,398 @@
+"""
+End-to-end load test. Runs Warden in uvicorn against a local MongoDB and an SMTP sink,
+drives a register/verify/login/get/patch mix at a fixed concurrency and prints latency
+percentiles and RPS per route as JSON.
+
+    python loadtest.py [--concurrency 50] [--duration 30] [--mix get=60,patch=25,login=10,register=5]
+                       [--workers 1] [--mongodb-url mongodb://localhost:27017/] [--output results.json]
+
+Without --mongodb-url a throwaway mongod from PATH is started on a temporary data
+directory, or pymongo_inmemory's when mongod isn't installed. Verification codes are
+read from the mails the SMTP sink receives, so registrations go through the outbox like
+in production. Rate limits are switched off, everything else comes from the environment,
+e.g. PASSWORD_SCRYPT_N or MONGODB_DRIVER. The report carries the current commit so runs
+can be compared across commits.
+"""
+
+import argparse
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import json
+import os
+import random
+import re
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from aiosmtpd.controller import Controller
+import httpx
+
+OPERATIONS = ( "get", "patch", "login", "register" )
+DEFAULT_MIX = "get=60,patch=25,login=10,register=5"
+SERVER_START_TIMEOUT_SEC = 30
+VERIFICATION_EMAIL_TIMEOUT_SEC = 10
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def current_commit():
+    try:
+        return subprocess.run(
+            [ "git", "rev-parse", "HEAD" ], cwd=SRC_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_mix(value: str):
+    mix = {}
+    for item in value.split(","):
+        operation, weight = item.split("=")
+        if (operation not in OPERATIONS):
+            raise argparse.ArgumentTypeError(f"Unknown operation '{operation}', expected one of {', '.join(OPERATIONS)}.")
+        mix[operation] = float(weight)
+    return mix
+
+
+class SMTPSink:
+    """
+    Accepts every mail and keeps the latest verification code per recipient.
+    """
+
+    def __init__(self):
+        self.codes: dict[str, str] = {}
+        self.messages = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        match = re.search(rb"verification code is (\d{6})", envelope.content)
+        if (match):
+            for recipient in envelope.rcpt_tos:
+                self.codes[recipient] = match.group(1).decode()
+        return "250 Message accepted for delivery"
+
+    async def wait_for_code(self, email: str):
+        deadline = time.monotonic() + VERIFICATION_EMAIL_TIMEOUT_SEC
+        while (email not in self.codes):
+            if (time.monotonic() > deadline):
+                raise TimeoutError(f"No verification email for {email}.")
+            await asyncio.sleep(0.01)
+        return self.codes.pop(email)
+
+@contextmanager
+def smtp_sink():
+    sink = SMTPSink()
+    port = free_port()
+    controller = Controller(sink, hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        yield sink, port
+    finally:
+        controller.stop()
+
+@contextmanager
+def local_mongodb(mongodb_url: str = None):
+    if (mongodb_url):
+        yield mongodb_url
+        return
+
+    mongod = shutil.which("mongod")
+
+    if (mongod is None):
+        try:
+            import pymongo_inmemory
+        except ImportError:
+            raise SystemExit("Neither mongod nor pymongo_inmemory is installed, pass --mongodb-url.")
+
+        client = pymongo_inmemory.MongoClient()
+        try:
+            host, port = client.address
+            yield f"mongodb://{host}:{port}/"
+        finally:
+            client.close()
+        return
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as dbpath:
+        process = subprocess.Popen(
+            [ mongod, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet" ],
+            stdout=subprocess.DEVNULL
+        )
+        try:
+            yield f"mongodb://127.0.0.1:{port}/"
+        finally:
+            process.terminate()
+            process.wait()
+
+@contextmanager
+def warden_server(mongodb_url: str, smtp_port: int, workers: int):
+    port = free_port()
+
+    env = {
+        "SECRET_KEY": secrets.token_hex(32),
+        "HASHING_ALGORITHM": "HS256",
+        "EMAIL_SERVICE_USER": "loadtest@warden.test",
+        "EMAIL_SERVICE_PASSWORD": "loadtest",
+        **os.environ,
+        "MONGODB_URL": mongodb_url,
+        "EMAIL_SMTP_HOST": "127.0.0.1",
+        "EMAIL_SMTP_PORT": str(smtp_port),
+        "EMAIL_SMTP_STARTTLS": "false",
+        # the harness sends everything from one address, so limits would measure 429s
+        "RATE_LIMIT_IP": "",
+        "RATE_LIMIT_APP": "",
+        "RATE_LIMIT_APP_IP": "",
+        "RATE_LIMIT_EMAIL": "",
+    }
+
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--port", str(port), "--workers", str(workers), "--log-level", "warning"
+        ],
+        cwd=SRC_DIR,
+        env=env
+    )
+
+    base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        deadline = time.monotonic() + SERVER_START_TIMEOUT_SEC
+        while (True):
+            try:
+                httpx.get(f"{base_url}/.well-known/jwks.json")
+                break
+            except httpx.TransportError:
+                if (process.poll() is not None or time.monotonic() > deadline):
+                    raise SystemExit("Warden didn't start.")
+                time.sleep(0.1)
+
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+class Recorder:
+    """
+    Latencies and status codes per route, only while recording is on.
+    """
+
+    def __init__(self):
+        self.recording = False
+        self.latencies: dict[str, list[float]] = {}
+        self.statuses: dict[str, dict[int, int]] = {}
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        res = await client.request(method, url, **kwargs)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        if (self.recording):
+            self.latencies.setdefault(route, []).append(elapsed_ms)
+            statuses = self.statuses.setdefault(route, {})
+            statuses[res.status_code] = statuses.get(res.status_code, 0) + 1
+
+        return res
+
+    @staticmethod
+    def _summary(latencies: list[float], statuses: dict[int, int], duration_sec: float):
+        latencies = sorted(latencies)
+
+        def percentile(p: float):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 2)
+
+        return {
+            "requests": len(latencies),
+            "errors": sum(count for status, count in statuses.items() if status >= 400),
+            "rps": round(len(latencies) / duration_sec, 1),
+            "mean_ms": round(sum(latencies) / len(latencies), 2),
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(latencies[-1], 2),
+            "statuses": { str(status): count for status, count in sorted(statuses.items()) }
+        }
+
+    def report(self, duration_sec: float):
+        routes = {
+            route: self._summary(latencies, self.statuses[route], duration_sec)
+            for route, latencies in sorted(self.latencies.items())
+        }
+
+        all_statuses = {}
+        for statuses in self.statuses.values():
+            for status, count in statuses.items():
+                all_statuses[status] = all_statuses.get(status, 0) + count
+
+        all_latencies = [ latency for latencies in self.latencies.values() for latency in latencies ]
+        total = self._summary(all_latencies, all_statuses, duration_sec) if all_latencies else None
+
+        return { "routes": routes, "total": total }
+
+
+class VirtualUser:
+    """
+    One client with its own account and cookie jar, running operations back to back.
+    """
+
+    def __init__(self, base_url: str, app_headers: dict, sink: SMTPSink, recorder: Recorder, run_id: str, index: int):
+        self.client = httpx.AsyncClient(base_url=base_url, headers=app_headers, timeout=None)
+        self.sink = sink
+        self.recorder = recorder
+        self.run_id = run_id
+        self.index = index
+
+        self.email: str = None
+        self.hash = secrets.token_hex(32)
+        self.registrations = 0
+        self.patches = 0
+
+    async def register(self):
+        self.registrations += 1
+        email = f"load{self.run_id}u{self.index}r{self.registrations}@gmail.com"
+
+        res = await self.recorder.request(self.client, "POST /user/register", "POST", "/user/register",
+            json={ "email": email, "hash": self.hash })
+        res.raise_for_status()
+        user_id = res.json()["message"]
+
+        verification_code = await self.sink.wait_for_code(email)
+
+        res = await self.recorder.request(self.client, "POST /user/{user_id}/verify", "POST", f"/user/{user_id}/verify",
+            json={ "verification_code": verification_code })
+        res.raise_for_status()
+
+        return email
+
+    async def login(self):
+        await self.recorder.request(self.client, "POST /user/login", "POST", "/user/login",
+            json={ "email": self.email, "hash": self.hash })
+
+    async def get(self):
+        await self.recorder.request(self.client, "GET /user", "GET", "/user")
+
+    async def patch(self):
+        self.patches += 1
+        await self.recorder.request(self.client, "PATCH /user", "PATCH", "/user",
+            headers={ "Content-Type": "application/merge-patch+json" },
+            content=json.dumps({ "theme": random.choice([ "dark", "light" ]), "patches": self.patches }))
+
+    async def setup(self):
+        self.email = await self.register()
+        await self.login()
+
+    async def run(self, mix: dict[str, float], deadline: float):
+        operations = list(mix)
+        weights = list(mix.values())
+
+        while (time.monotonic() < deadline):
+            operation = random.choices(operations, weights)[0]
+            if (operation == "register"):
+                # a throwaway account, this user keeps its own session
+                await self.register()
+            else:
+                await getattr(self, operation)()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+async def create_app(base_url: str, sink: SMTPSink, run_id: str):
+    """
+    Registers an admin and an app, returns the headers virtual users authenticate with.
+    """
+
+    email = f"loadadmin{run_id}@gmail.com"
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as admin:
+        res = await admin.post("/admin/register", json={ "email": email, "hash": "loadtest" })
+        res.raise_for_status()
+        admin_id = res.json()["message"]
+
+        res = await admin.post(f"/admin/{admin_id}/verify", json={ "verification_code": await sink.wait_for_code(email) })
+        res.raise_for_status()
+
+        (await admin.post("/admin/login", json={ "email": email, "hash": "loadtest" })).raise_for_status()
+
+        res = await admin.post("/admin/app", json={
+            "name": f"loadtest_{run_id}",
+            "access_token_exp_sec": 3600,
+            "refresh_token_exp_sec": 3600,
+            "max_login_attempts": 100,
+            "lockout_time_per_attempt_sec": 1
+        })
+        res.raise_for_status()
+        app_id = res.json()["message"]
+
+        res = await admin.get(f"/admin/app/{app_id}/generate_api_key")
+        res.raise_for_status()
+
+        return { "Warden-App-ID": app_id, "Warden-App-API-Key": res.json()["message"] }
+
+async def run_load(base_url: str, sink: SMTPSink, args: argparse.Namespace):
+    run_id = secrets.token_hex(4)
+    recorder = Recorder()
+
+    app_headers = await create_app(base_url, sink, run_id)
+
+    users = [ VirtualUser(base_url, app_headers, sink, recorder, run_id, index) for index in range(args.concurrency) ]
+
+    try:
+        # every user starts logged in, setup traffic isn't measured
+        await asyncio.gather(*[ user.setup() for user in users ])
+
+        recorder.recording = True
+        started = time.monotonic()
+        await asyncio.gather(*[ user.run(args.mix, started + args.duration) for user in users ])
+        duration_sec = time.monotonic() - started
+        recorder.recording = False
+    finally:
+        await asyncio.gather(*[ user.aclose() for user in users ])
+
+    return {
+        "commit": current_commit(),
+        "started_at": datetime.now(tz=timezone.utc).isoformat(),
+        "config": {
+            "concurrency": args.concurrency,
+            "duration_sec": args.duration,
+            "workers": args.workers,
+            "mix": args.mix,
+            "mongodb_driver": os.environ.get("MONGODB_DRIVER", "async")
+        },
+        "duration_sec": round(duration_sec, 2),
+        **recorder.report(duration_sec)
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured traffic")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"operation weights, default {DEFAULT_MIX}")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--mongodb-url", help="use this MongoDB instead of starting one, data goes to its warden database")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    with smtp_sink() as (sink, smtp_port), local_mongodb(args.mongodb_url) as mongodb_url:
+        with warden_server(mongodb_url, smtp_port, args.workers) as base_url:
+            report = asyncio.run(run_load(base_url, sink, args))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+
+    if (args.output):
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,9 @@
-import json
+from contextlib import asynccontextmanager
 from typing import Callable
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI
 from dotenv import load_dotenv
 import os
 
-from fastapi.responses import JSONResponse
-from fastapi import status
-
 from utils import exception
 from utils.logging import logger
 
@@ -24,34 +21,38 @@ for env_var in ENV_VARIABLES:
     if (os.environ.get(env_var) is None):
         raise EnvironmentError(f"{env_var} environment variable is not set.")
 
+from database import close_client, ensure_indexes
+from outbox import outbox
+from passwords import password_hasher
+from sessions import sessions
+import throttling
 from routers.admin import admin_router
 from routers.app import app_router
-
-app = FastAPI()
-
-@app.middleware("http")
-async def error_logger(request: Request, call_next):
-    req_body = await request.body()
-
-    if (req_body.__len__() > 0):
-        req_body = json.loads(req_body)
-
-    try:
-        response = await call_next(request)
-    except HTTPException:
-        return response
-    except Exception as error:
-        logger.error(
-            f"{request.method} {request.url}\n{type(error).__name__}", 
-            error, 
-            query_params = request.query_params, 
-            body = req_body
-        )
-        return JSONResponse(
-            { "reason": type(error).__name__ }, 
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
-    return response
+from routers.jwks import jwks_router
+from routers.metrics import metrics_router
+from utils.middleware import ErrorLoggerMiddleware, MetricsMiddleware
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.start()
+    await ensure_indexes()
+    await outbox.ensure_indexes()
+    await throttling.store.ensure_indexes()
+    await sessions.ensure_indexes()
+    outbox.start()
+    yield
+    await outbox.stop()
+    password_hasher.shutdown()
+    await close_client()
+    logger.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(ErrorLoggerMiddleware)
+# outermost, so the 500s ErrorLoggerMiddleware answers with are recorded too
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(admin_router)
-app.include_router(app_router)
\ No newline at end of file
+app.include_router(app_router)
+app.include_router(jwks_router)
+app.include_router(metrics_router)
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""
+Creates missing indexes on existing collections. Safe to run repeatedly.
+
+Usage: python src/migrate.py (from the server directory, with the usual environment).
+"""
+import asyncio
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import close_client, ensure_indexes
+from utils.logging import logger
+
+
+async def migrate():
+    try:
+        failed = await ensure_indexes()
+    finally:
+        await close_client()
+        logger.stop()
+
+    if (failed):
+        print(f"Index creation failed for: {', '.join(failed)}. Resolve duplicate emails and re-run.")
+        return 1
+
+    print("Indexes are up to date.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(migrate()))
@@ -5,12 +5,20 @@ from pydantic import BaseModel, BeforeValidator, Field
 AnnotatedObjectId = Annotated[str, BeforeValidator(str)]
 
 
+class RateLimit(BaseModel):
+    requests: int = Field(gt=0)
+    period_sec: int = Field(gt=0)
+
 class AppBase(BaseModel):
     name: str
     access_token_exp_sec: int
     refresh_token_exp_sec: int
     max_login_attempts: int
     lockout_time_per_attempt_sec: int
+    # None falls back to the server-wide defaults
+    app_rate_limit: RateLimit | None = None
+    ip_rate_limit: RateLimit | None = None
+    email_rate_limit: RateLimit | None = None
 
 class AppID(BaseModel):
     id: AnnotatedObjectId = Field(alias='_id')
@@ -39,6 +47,7 @@ class User(BaseModel):
     hash: str
     login_attempts: int
     data: dict
+    token_version: int = 0
 
 class UnverifiedUser(User):
     verification_code: str
\ No newline at end of file
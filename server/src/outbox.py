@@ -0,0 +1,267 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import os
+import random
+import time
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+from utils import metrics
+from utils.email import SMTPConnectionPool, build_verification_email
+from utils.logging import logger
+
+EMAIL_POOL_SIZE = int(os.environ.get("EMAIL_POOL_SIZE", 2))
+EMAIL_BATCH_SIZE = int(os.environ.get("EMAIL_BATCH_SIZE", 20))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get("EMAIL_MAX_ATTEMPTS", 5))
+EMAIL_RETRY_BASE_SEC = float(os.environ.get("EMAIL_RETRY_BASE_SEC", 5))
+EMAIL_POLL_INTERVAL_SEC = float(os.environ.get("EMAIL_POLL_INTERVAL_SEC", 5))
+EMAIL_LEASE_SEC = float(os.environ.get("EMAIL_LEASE_SEC", 60))
+EMAIL_DRAIN_TIMEOUT_SEC = float(os.environ.get("EMAIL_DRAIN_TIMEOUT_SEC", 10))
+# failed messages are kept this long for inspection, then removed by a TTL index
+EMAIL_FAILED_RETENTION_SEC = float(os.environ.get("EMAIL_FAILED_RETENTION_SEC", 7 * 24 * 60 * 60))
+
+PENDING = "pending"
+SENDING = "sending"
+FAILED = "failed"
+
+
+class EmailOutbox:
+    """
+    Persisted email queue drained by a background task.
+
+    Messages are claimed with a lease, so several workers can share one
+    collection and messages held by a crashed worker are picked up again.
+    """
+
+    def __init__(self, collection, pool: SMTPConnectionPool):
+        self.collection = collection
+        self.pool = pool
+
+        self._task: asyncio.Task = None
+        self._wakeup: asyncio.Event = None
+        self._stopping = False
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([ ("status", 1), ("next_attempt_at", 1) ])
+        # only failed messages carry expires_at
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        # at most one pending message per recipient and kind
+        await self.collection.create_index(
+            "dedupe_key",
+            unique=True,
+            partialFilterExpression={ "status": PENDING }
+        )
+
+    @staticmethod
+    def _verification_upsert(scope: str, app: str, recipient_email: str, message: str):
+        now = datetime.now(tz=timezone.utc)
+
+        # keyed by the app id, names are only unique per admin
+        query = { "dedupe_key": f"verification:{scope}:{recipient_email}", "status": PENDING }
+        update = {
+            "$set": {
+                "app": app,
+                "recipient": recipient_email,
+                "message": message,
+                "attempts": 0,
+                "next_attempt_at": now
+            },
+            "$setOnInsert": { "created_at": now }
+        }
+        return query, update
+
+    async def enqueue_verification_email(self, scope: str, app: str, recipient_email: str, message: str):
+        """
+        Queues a verification email, replacing one still pending for the same recipient.
+        scope is the app id, or "admin" for admins, app the name shown in the email.
+        """
+
+        query, update = self._verification_upsert(scope, app, recipient_email, message)
+
+        try:
+            await self.collection.update_one(query, update, upsert=True)
+        except DuplicateKeyError:
+            # a concurrent enqueue inserted it first, update that one instead
+            await self.collection.update_one(query, update)
+
+        self._wake()
+
+    async def enqueue_verification_emails(self, scope: str, app: str, emails: list[tuple[str, str]]):
+        """
+        Queues (recipient_email, message) pairs in a single round trip.
+        """
+
+        if (not emails):
+            return
+
+        await self.collection.bulk_write([
+            UpdateOne(*self._verification_upsert(scope, app, recipient_email, message), upsert=True)
+            for recipient_email, message in emails
+        ], ordered=False)
+
+        self._wake()
+
+    def _wake(self):
+        if (self._wakeup is not None):
+            self._wakeup.set()
+
+    def start(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, drain_timeout_sec: float = EMAIL_DRAIN_TIMEOUT_SEC):
+        """
+        Sends whatever is due before returning, for at most drain_timeout_sec.
+        """
+
+        if (self._task is None):
+            return
+
+        self._stopping = True
+        self._wakeup.set()
+
+        try:
+            await asyncio.wait_for(self._task, drain_timeout_sec)
+        except asyncio.TimeoutError:
+            logger.info("Email outbox drain timed out, remaining emails stay queued.")
+
+        self._task = None
+        await run_in_threadpool(self.pool.close)
+
+    async def _run(self):
+        while (True):
+            try:
+                sent = await self.process_due()
+            except Exception as error:
+                logger.error("Email outbox iteration failed.", error)
+                sent = 0
+
+            if (sent):
+                continue
+
+            if (self._stopping):
+                return
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), EMAIL_POLL_INTERVAL_SEC)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _claim_batch(self):
+        now = datetime.now(tz=timezone.utc)
+        batch = []
+
+        for _ in range(EMAIL_BATCH_SIZE):
+            message = await self.collection.find_one_and_update(
+                {
+                    "$or": [
+                        { "status": PENDING, "next_attempt_at": { "$lte": now } },
+                        { "status": SENDING, "lease_until": { "$lte": now } }
+                    ]
+                },
+                { "$set": { "status": SENDING, "lease_until": now + timedelta(seconds=EMAIL_LEASE_SEC) } },
+                sort=[ ("next_attempt_at", 1) ],
+                return_document=ReturnDocument.AFTER
+            )
+
+            if (not message):
+                break
+
+            batch.append(message)
+
+        return batch
+
+    async def process_due(self):
+        """
+        Claims and sends one batch of due messages. Returns how many were claimed.
+        """
+
+        batch = await self._claim_batch()
+
+        if (not batch):
+            return 0
+
+        # spread the batch over the pooled connections
+        chunks = [ batch[i::self.pool.size] for i in range(self.pool.size) ]
+        chunks = [ chunk for chunk in chunks if chunk ]
+
+        results = await asyncio.gather(*[
+            run_in_threadpool(self._timed_send_batch, [
+                (message["recipient"], build_verification_email(message["app"], message["recipient"], message["message"]))
+                for message in chunk
+            ])
+            for chunk in chunks
+        ])
+
+        sent_ids = []
+
+        for chunk, errors in zip(chunks, results):
+            for message, error in zip(chunk, errors):
+                if (error is None):
+                    sent_ids.append(message["_id"])
+                else:
+                    await self._retry_later(message, error)
+
+        metrics.emails.inc("sent", amount=len(sent_ids))
+
+        if (sent_ids):
+            await self.collection.delete_many({ "_id": { "$in": sent_ids } })
+
+        return len(batch)
+
+    def _timed_send_batch(self, messages: list):
+        started = time.perf_counter()
+        try:
+            return self.pool.send_batch(messages)
+        finally:
+            metrics.email_send_duration.observe(time.perf_counter() - started)
+
+    async def _retry_later(self, message: dict, error: Exception):
+        attempts = message.get("attempts", 0) + 1
+
+        if (attempts >= EMAIL_MAX_ATTEMPTS):
+            metrics.emails.inc("failed")
+            await self.collection.update_one(
+                { "_id": message["_id"] },
+                { "$set": {
+                    "status": FAILED,
+                    "attempts": attempts,
+                    "error": repr(error),
+                    "expires_at": datetime.now(tz=timezone.utc) + timedelta(seconds=EMAIL_FAILED_RETENTION_SEC)
+                } }
+            )
+            logger.error(f"Email {message['_id']} failed after {attempts} attempts.", error)
+            return
+
+        metrics.emails.inc("retry")
+
+        # exponential backoff with jitter
+        delay_sec = EMAIL_RETRY_BASE_SEC * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+
+        try:
+            await self.collection.update_one(
+                { "_id": message["_id"] },
+                { "$set": {
+                    "status": PENDING,
+                    "attempts": attempts,
+                    "next_attempt_at": datetime.now(tz=timezone.utc) + timedelta(seconds=delay_sec),
+                    "error": repr(error)
+                } }
+            )
+        except DuplicateKeyError:
+            # a newer message for the same recipient was queued meanwhile and supersedes this one
+            await self.collection.delete_one({ "_id": message["_id"] })
+
+
+outbox = EmailOutbox(
+    db.email_outbox,
+    SMTPConnectionPool(
+        size=EMAIL_POOL_SIZE,
+        username=os.environ["EMAIL_SERVICE_USER"],
+        password=os.environ["EMAIL_SERVICE_PASSWORD"]
+    )
+)
@@ -0,0 +1,159 @@
+"""
+Password hashing with scrypt in a bounded process pool.
+
+Stored hashes are versioned, "$scrypt$n=<n>,r=<r>,p=<p>$<salt>$<key>". Hashes from before
+are a bare SHA-256 hex digest. Both verify, and login upgrades any hash that isn't scrypt
+with the current parameters while the password is at hand. Stored parameters needing more
+than PASSWORD_SCRYPT_MAX_MEMORY_BYTES are never computed and match nothing.
+
+The KDF runs in worker processes so it never blocks the event loop or the threadpool.
+Once PASSWORD_HASH_MAX_PENDING hashes are queued or running, new ones fail fast with a 503
+instead of queueing requests behind a login storm.
+"""
+import asyncio
+import base64
+import binascii
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+from fastapi import HTTPException
+
+from utils import exception
+
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 8))
+PASSWORD_SCRYPT_N = int(os.environ.get("PASSWORD_SCRYPT_N", 2 ** 14))
+PASSWORD_SCRYPT_R = int(os.environ.get("PASSWORD_SCRYPT_R", 8))
+PASSWORD_SCRYPT_P = int(os.environ.get("PASSWORD_SCRYPT_P", 1))
+# stored hashes asking for more than this are never computed, e.g. ones imported verbatim
+PASSWORD_SCRYPT_MAX_MEMORY_BYTES = int(os.environ.get("PASSWORD_SCRYPT_MAX_MEMORY_BYTES", 64 * 1024 * 1024))
+PASSWORD_SCRYPT_MAX_P = 16
+
+SCRYPT_PREFIX = "$scrypt$"
+SCRYPT_SALT_BYTES = 16
+SCRYPT_KEY_BYTES = 32
+
+
+def scrypt(password: str, salt: bytes, n: int, r: int, p: int):
+    """
+    Runs in a worker process.
+    """
+
+    # scrypt needs about 128 * r * (n + p) bytes, leave headroom over OpenSSL's 32 MB default
+    maxmem = 256 * r * (n + p)
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=SCRYPT_KEY_BYTES)
+
+def _b64encode(data: bytes):
+    return base64.b64encode(data).decode().rstrip("=")
+
+def _b64decode(data: str):
+    return base64.b64decode(data + "=" * (-len(data) % 4), validate=True)
+
+def _scrypt_memory(params: dict):
+    return 128 * params["r"] * (params["n"] + params["p"])
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_pending: int, n: int, r: int, p: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.params = { "n": n, "r": r, "p": p }
+
+        # hashes made with the configured parameters always verify, even past the cap
+        self.max_memory = max(PASSWORD_SCRYPT_MAX_MEMORY_BYTES, _scrypt_memory(self.params))
+
+        self._pool: ProcessPoolExecutor = None
+        self.pending = 0
+        self.rejected = 0
+
+    async def _run(self, password: str, salt: bytes, params: dict):
+        if (self.pending >= self.max_pending):
+            self.rejected += 1
+            raise exception.service_unavailable(1)
+
+        if (self._pool is None):
+            # forking would copy the logging listener's and the Mongo client's threads' locks
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._pool, scrypt, password, salt, params["n"], params["r"], params["p"]
+            )
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str):
+        salt = secrets.token_bytes(SCRYPT_SALT_BYTES)
+        key = await self._run(password, salt, self.params)
+
+        params = ",".join(f"{name}={value}" for name, value in self.params.items())
+        return f"{SCRYPT_PREFIX}{params}${_b64encode(salt)}${_b64encode(key)}"
+
+    async def verify(self, password: str, stored_hash: str):
+        """
+        Returns (matches, upgraded_hash). upgraded_hash is set when the password matches
+        a hash that should be replaced, store it in place of stored_hash.
+        """
+
+        if (not stored_hash.startswith(SCRYPT_PREFIX)):
+            legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+            if (not hmac.compare_digest(legacy_hash.encode(), stored_hash.encode())):
+                return False, None
+            return True, await self._upgrade(password)
+
+        try:
+            params, salt, key = stored_hash[len(SCRYPT_PREFIX):].split("$")
+            params = { name: int(value) for name, value in (item.split("=") for item in params.split(",")) }
+            salt, key = _b64decode(salt), _b64decode(key)
+            if (set(params) != { "n", "r", "p" }):
+                raise ValueError("Unknown scrypt parameters.")
+        except (ValueError, binascii.Error):
+            # a malformed hash matches nothing
+            return False, None
+
+        # too costly to compute, the account needs a password reset
+        if (not self._within_bounds(params)):
+            return False, None
+
+        candidate = await self._run(password, salt, params)
+
+        if (not hmac.compare_digest(candidate, key)):
+            return False, None
+
+        if (params != self.params):
+            return True, await self._upgrade(password)
+
+        return True, None
+
+    def _within_bounds(self, params: dict):
+        n, r, p = params["n"], params["r"], params["p"]
+        return (
+            n > 1 and n & (n - 1) == 0
+            and r >= 1 and 1 <= p <= PASSWORD_SCRYPT_MAX_P
+            and _scrypt_memory(params) <= self.max_memory
+        )
+
+    async def _upgrade(self, password: str):
+        # a full pool must not fail a login whose password already matched, upgrade next time
+        try:
+            return await self.hash(password)
+        except HTTPException:
+            return None
+
+    def shutdown(self):
+        if (self._pool is not None):
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+password_hasher = PasswordHasher(
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_MAX_PENDING,
+    PASSWORD_SCRYPT_N,
+    PASSWORD_SCRYPT_R,
+    PASSWORD_SCRYPT_P
+)
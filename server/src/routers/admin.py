@@ -1,32 +1,45 @@
+import asyncio
+import base64
+import binascii
+import csv
 from datetime import datetime, timedelta, timezone
-import os
+import json
 import re
 import secrets
-from jose import jwt
-from typing import List
+import zlib
+from typing import List, Literal
 from bson import ObjectId
-from fastapi import APIRouter, Depends, Request, Response
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from models import Admin, UnverifiedAdmin
-from schemas import AppCreate, AppInsert, AppResponse, AppUpdate, ChangePassword, Credentials, VerificationCode
-from database import db
+from schemas import AppCreate, AppInsert, AppResponse, AppUpdate, BatchRequest, BatchResponse, ChangePassword, Credentials, ImportRowError, ImportSummary, UserImport, UserPage, UserSummary, VerificationCode
+from batch import run_user_batch
+from database import db, ensure_app_indexes
+from throttling import limit_account, limit_by_ip
+from utils.lockout import is_locked, record_failed_attempt, reset_attempts
+from utils import metrics
 from utils.logging import logger
+from utils.streaming import iter_lines
 
-from utils.email import send_verification_email
+from outbox import outbox
+from passwords import password_hasher
+from sessions import ADMIN_SCOPE, sessions
+from signing import ADMIN_AUDIENCE
 import utils.exception as exception
-from auth import SECRET_KEY, generate_api_key, generate_token, get_current_admin, hash
+from auth import app_cache, current_session_id, decode_token, generate_api_key, generate_token, get_current_admin, hash, invalidate_app, token_cache
 import utils.success as success
 
-SECRET_KEY = os.environ["SECRET_KEY"]
-ALGORITHM = os.environ["HASHING_ALGORITHM"]
-
 ADMIN_ALLOWED_LOGIN_ATTEMPTS = 3
+ADMIN_LOCKOUT_TIME_PER_ATTEMPT_SEC = 60 * 5
 ADMIN_ACCESS_TOKEN_EXP_SECS = 60 * 1
 ADMIN_REFRESH_TOKEN_EXP_SECS = 60 * 2
 
 admin_col = db.admin
 app_col = db.app
 
-admin_router = APIRouter()
+admin_router = APIRouter(dependencies=[ Depends(limit_by_ip) ])
 
 
 # Unprotected routes
@@ -34,46 +47,42 @@ admin_router = APIRouter()
 # Admin Account
 
 @admin_router.post("/admin/login", tags=["Admin Account"])
-def admin_login(credentials: Credentials, res: Response):
-    admin: dict = admin_col.find_one({ "email": credentials.email })
+async def admin_login(credentials: Credentials, res: Response):
+    await limit_account(credentials.email)
+
+    admin: dict = await admin_col.find_one({ "email": credentials.email })
 
     if (not admin):
         raise exception.invalid_credentials
 
     if (admin.get("verification_code")):
         raise exception.account_not_verified
-    
-    admin: Admin = Admin(**admin)
 
-    if (admin.login_attempts >= ADMIN_ALLOWED_LOGIN_ATTEMPTS):
+    if (is_locked(admin)):
         raise exception.account_locked
+
+    admin_doc = admin
+    admin: Admin = Admin(**admin)
     
-    double_hash = hash(credentials.hash)
-
-    if (double_hash != admin.hash):
-        # increment login attempts
-        admin_col.update_one({ 
-            "_id": ObjectId(admin.id) 
-        }, { 
-            "$set": { "login_attempts": admin.login_attempts + 1 }
-        })
+    password_matches, upgraded_hash = await password_hasher.verify(credentials.hash, admin.hash)
+
+    if (not password_matches):
+        metrics.login_failures.inc(ADMIN_SCOPE)
+        if (await record_failed_attempt(admin_col, admin.id, ADMIN_ALLOWED_LOGIN_ATTEMPTS, ADMIN_LOCKOUT_TIME_PER_ATTEMPT_SEC)):
+            metrics.lockouts.inc(ADMIN_SCOPE)
         raise exception.invalid_credentials
 
-    # reset login attempts
-    admin_col.update_one({ 
-        "_id": ObjectId(admin.id) 
-    }, { 
-        "$set": { "login_attempts": 0 }
-    })
+    # only writes when there were failed attempts to clear or a legacy hash to upgrade
+    await reset_attempts(admin_col, admin_doc, { "$set": { "hash": upgraded_hash } } if upgraded_hash else None)
     
     access_token_exp = datetime.now(tz=timezone.utc) + timedelta(seconds=ADMIN_ACCESS_TOKEN_EXP_SECS)
     refresh_token_exp = datetime.now(tz=timezone.utc) + timedelta(seconds=ADMIN_REFRESH_TOKEN_EXP_SECS)
 
     access_token_data = admin.model_dump(exclude={"hash"})
-    refresh_token_data = { "id": admin.id }
+    refresh_token_data = await sessions.create(ADMIN_SCOPE, admin.id, ADMIN_REFRESH_TOKEN_EXP_SECS)
     
-    access_token = generate_token(access_token_data, access_token_exp)
-    refresh_token = generate_token(refresh_token_data, refresh_token_exp)
+    access_token = generate_token(access_token_data, access_token_exp, ADMIN_AUDIENCE)
+    refresh_token = generate_token(refresh_token_data, refresh_token_exp, ADMIN_AUDIENCE)
     
     res.set_cookie(
         "access_token", 
@@ -90,40 +99,47 @@ def admin_login(credentials: Credentials, res: Response):
         max_age=ADMIN_REFRESH_TOKEN_EXP_SECS,
     )
 
-    logger.info(f"Admin {admin.id} authenticated.")
+    logger.info("Admin %s authenticated.", admin.id, channel="auth")
     # can't use success.ok() becase cookies will not be included, breaking the endpoint.
     return { "message": "Admin authenticated." }
 
 @admin_router.post("/admin/register", tags=["Admin Account"])
-def admin_register(credentials: Credentials):
+async def admin_register(credentials: Credentials):
+    await limit_account(credentials.email)
+
 
     if (not re.fullmatch(r"^[a-zA-Z0-9]([a-zA-Z0-9]){1,}((\.|-|\+|_)([a-zA-Z0-9]){2,})*@g(oogle)?mail\.com$", credentials.email)):
         raise exception.bad_request("Invalid email format.")
 
-    user_exist = admin_col.find_one({ "email": credentials.email }) is not None
+    verification_code = ''.join(str(secrets.randbelow(10)) for _ in range(6))
 
-    if (user_exist):
+    # the unique email index rejects duplicates, no need to look the email up first
+    try:
+        user_id = (await admin_col.insert_one({
+                "email": credentials.email,
+                "hash": await password_hasher.hash(credentials.hash),
+                "apps": [],
+                "login_attempts": 0,
+                "verification_code": verification_code
+            })).inserted_id
+    except DuplicateKeyError:
         raise exception.data_conflict("Email already used.")
-    
-    verification_code = ''.join(str(secrets.randbelow(10)) for _ in range(6))
+
     # TODO: Add link to frontend
     message = f"You verification code is {verification_code}"
 
-    send_verification_email("Warden", credentials.email, message)
-
-    user_id = admin_col.insert_one({
-            "email": credentials.email,
-            "hash": hash(credentials.hash),
-            "apps": [],
-            "login_attempts": 0,
-            "verification_code": verification_code
-        }).inserted_id
+    await outbox.enqueue_verification_email(ADMIN_SCOPE, "Warden", credentials.email, message)
 
-    logger.info(f"Admin {str(user_id)} registered successfully.")
+    logger.info("Admin %s registered successfully.", user_id, channel="account")
     return success.created(str(user_id))
 
 @admin_router.get("/admin/logout", tags=["Admin Account"])
-def admin_logout(res: Response):
+async def admin_logout(req: Request, res: Response):
+    session_id = current_session_id(req, ADMIN_AUDIENCE)
+
+    if (session_id):
+        await sessions.revoke(session_id)
+
     res.delete_cookie(key="access_token")
     res.delete_cookie(key="refresh_token")
 
@@ -131,65 +147,64 @@ def admin_logout(res: Response):
     return { "message": "Admin logged out." }
 
 @admin_router.post("/admin/{admin_id}/verify", tags=["Admin Account"])
-def admin_verify_account(body: VerificationCode, admin_id: str):
-    admin = admin_col.find_one({ "_id": ObjectId(admin_id) })
+async def admin_verify_account(body: VerificationCode, admin_id: str):
+    await limit_account(admin_id)
+
+    admin = await admin_col.find_one({ "_id": ObjectId(admin_id) })
 
     if (not admin):
         raise exception.invalid_credentials
 
-    admin = UnverifiedAdmin(**admin)
-    
-    if (admin.login_attempts >= ADMIN_ALLOWED_LOGIN_ATTEMPTS):
+    if (is_locked(admin)):
         raise exception.account_locked
+
+    admin_doc = admin
+    admin = UnverifiedAdmin(**admin)
     
     if (body.verification_code != admin.verification_code):
-        # increment login attempts when wrong password
-        admin_col.update_one({ 
-                "_id": ObjectId(admin.id) 
-            }, { 
-                "$set": { "login_attempts": admin.login_attempts + 1 }
-            })
-
-    admin_col.update_one({ 
-            "_id": ObjectId(admin.id) 
-        }, { 
-            "$set": { 
-                "login_attempts": 0,
-            },
-            "$unset": {
-                "verification_code": ""
-            }
-        })
+        if (await record_failed_attempt(admin_col, admin.id, ADMIN_ALLOWED_LOGIN_ATTEMPTS, ADMIN_LOCKOUT_TIME_PER_ATTEMPT_SEC)):
+            metrics.lockouts.inc(ADMIN_SCOPE)
+        raise exception.invalid_credentials
+
+    await reset_attempts(admin_col, admin_doc, { "$unset": { "verification_code": "" } })
 
-    logger.info(f"Admin {admin.id} was verified.")
+    logger.info("Admin %s was verified.", admin.id, channel="account")
     return success.ok("Account verified successfully.")
 
 @admin_router.get("/admin/refresh", tags=["Admin Account"])
-def admin_refresh_token(req: Request, res: Response):
+async def admin_refresh_token(req: Request, res: Response):
     refresh_token = req.cookies.get("refresh_token")
 
     if (not refresh_token):
         raise exception.unauthorized_access
     
     try:
-        admin_id = jwt.decode(refresh_token, SECRET_KEY, ALGORITHM)["id"] 
+        claims = decode_token(refresh_token, ADMIN_AUDIENCE)
     except:
         raise exception.unauthorized_access
 
-    admin: dict = admin_col.find_one({ "_id": ObjectId(admin_id) })
+    # the admin is checked before rotating, a deleted or unverified admin's session ends here
+    admin_id = claims.get("id")
+    admin: dict = await admin_col.find_one({ "_id": ObjectId(admin_id) }) if ObjectId.is_valid(admin_id) else None
 
-    if (not admin):
-        raise exception.unauthorized_access
+    if (not admin or admin.get("verification_code")):
+        if (isinstance(claims.get("sid"), str)):
+            await sessions.revoke(claims["sid"])
+        raise exception.account_not_verified if admin else exception.unauthorized_access
 
-    if (admin.get("verification_code")):
-        return exception.account_not_verified
+    refresh_token_data = await sessions.rotate(ADMIN_SCOPE, claims, ADMIN_REFRESH_TOKEN_EXP_SECS)
+
+    if (not refresh_token_data):
+        raise exception.unauthorized_access
     
-    access_token_exp = datetime.utcnow() + timedelta(seconds=ADMIN_ACCESS_TOKEN_EXP_SECS)
+    access_token_exp = datetime.now(tz=timezone.utc) + timedelta(seconds=ADMIN_ACCESS_TOKEN_EXP_SECS)
+    refresh_token_exp = datetime.now(tz=timezone.utc) + timedelta(seconds=ADMIN_REFRESH_TOKEN_EXP_SECS)
 
     admin: Admin = Admin(**admin)
     access_token_data = admin.model_dump(exclude={"hash"})
     
-    access_token = generate_token(access_token_data, access_token_exp)
+    access_token = generate_token(access_token_data, access_token_exp, ADMIN_AUDIENCE)
+    refresh_token = generate_token(refresh_token_data, refresh_token_exp, ADMIN_AUDIENCE)
     
     res.set_cookie(
         "access_token", 
@@ -198,8 +213,15 @@ def admin_refresh_token(req: Request, res: Response):
         samesite="strict",
         max_age=ADMIN_ACCESS_TOKEN_EXP_SECS,
     )
+    res.set_cookie(
+        "refresh_token", 
+        refresh_token,
+        httponly=True,
+        samesite="strict",
+        max_age=ADMIN_REFRESH_TOKEN_EXP_SECS,
+    )
 
-    logger.info(f"Admin {admin.id} access token refreshed.")
+    logger.info("Admin %s access token refreshed.", admin.id, channel="auth")
     # can't use success.ok() becase cookies will not be included, breaking the endpoint.
     return { "message": "Admin access token refreshed." }
 
@@ -208,103 +230,377 @@ def admin_refresh_token(req: Request, res: Response):
 # Admin Account
 
 @admin_router.get("/admin", tags=["Admin Account"], response_model=Admin, response_model_exclude={"hash", "login_attempts"})
-def get_admin(admin: Admin = Depends(get_current_admin)):
+async def get_admin(admin: Admin = Depends(get_current_admin)):
     return admin
 
 @admin_router.delete("/admin", tags=["Admin Account"])
-def delete_admin(admin: Admin = Depends(get_current_admin)):
-    admin_col.delete_one({ "_id": ObjectId(admin.id) })
+async def delete_admin(admin: Admin = Depends(get_current_admin)):
+    await admin_col.delete_one({ "_id": ObjectId(admin.id) })
+    await sessions.revoke_account(ADMIN_SCOPE, admin.id)
 
     return success.ok("Account deleted successfully.")
 
 @admin_router.patch("/admin/changepassword", tags=["Admin Account"])
-def admin_change_password(body: ChangePassword, admin: Admin = Depends(get_current_admin)):
-    double_hash = hash(body.hash)
-    if (double_hash != admin.hash):
+async def admin_change_password(body: ChangePassword, req: Request, admin: Admin = Depends(get_current_admin)):
+    password_matches, _ = await password_hasher.verify(body.hash, admin.hash)
+    if (not password_matches):
         raise exception.invalid_credentials
     
-    double_new_hash = hash(body.new_hash)
-    admin_col.update_one({
+    new_hash = await password_hasher.hash(body.new_hash)
+    await admin_col.update_one({
             "_id": ObjectId(admin.id)
         }, {
-            "$set": { "hash": double_new_hash }
+            "$set": { "hash": new_hash }
         })
 
-    logger.info(f"Admin {admin.id} successfully changed password.")
+    # sign out other devices, the session this request refreshes from stays
+    await sessions.revoke_account(ADMIN_SCOPE, admin.id, current_session_id(req, ADMIN_AUDIENCE))
+
+    logger.info("Admin %s successfully changed password.", admin.id, channel="account")
     return success.ok("Password changed successfully.")
 
 # Admin Apps
 
 @admin_router.get("/admin/app", tags=["Admin Apps"], response_model=List[AppResponse])
-def get_admin_registered_apps(admin: Admin = Depends(get_current_admin)):
+async def get_admin_registered_apps(admin: Admin = Depends(get_current_admin)):
     app_ids = [ ObjectId(app_id) for app_id in admin.apps ]
-    return app_col.find({ "_id": { "$in": app_ids }}).to_list()
+    return await app_col.find({ "_id": { "$in": app_ids }}).to_list()
 
 @admin_router.post("/admin/app", tags=["Admin Apps"])
-def create_admin_app(app: AppCreate, admin: Admin = Depends(get_current_admin)):
+async def create_admin_app(app: AppCreate, admin: Admin = Depends(get_current_admin)):
     app_ids = [ ObjectId(app_id) for app_id in admin.apps ]
-    app_exist = app_col.find_one({ "_id": { "$in": app_ids }, "name": app.name })
+    app_exist = await app_col.find_one({ "_id": { "$in": app_ids }, "name": app.name })
     if (app_exist):
         raise exception.data_conflict("App already exists.")
     
     app: AppInsert = AppInsert(**app.model_dump(), api_key_hash="")
 
-    app_id: str = app_col.insert_one(app.model_dump()).inserted_id
+    app_id: str = (await app_col.insert_one(app.model_dump())).inserted_id
 
     # create collection for new app
-    db.create_collection(f"app_{app_id}")
+    await db.create_collection(f"app_{app_id}")
+    await ensure_app_indexes(app_id)
 
     # update admin apps
-    admin_col.update_one(
+    await admin_col.update_one(
             { "_id": ObjectId(admin.id) }, 
             { "$push": { "apps": app_id }}
         )
 
-    logger.info(f"Admin {admin.id} registered app {app_id}.")
+    logger.info("Admin %s registered app %s.", admin.id, app_id, channel="apps")
     return success.created(str(app_id))
 
 @admin_router.patch("/admin/app/{app_id}", tags=["Admin Apps"])
-def edit_admin_app(app: AppUpdate, app_id: str, admin: Admin = Depends(get_current_admin)):
+async def edit_admin_app(app: AppUpdate, app_id: str, admin: Admin = Depends(get_current_admin)):
     if (app_id not in admin.apps):
         raise exception.data_conflict("App doesn't exist.")
 
-    app_col.update_one(
+    await app_col.update_one(
             { "_id": ObjectId(app_id) }, 
             { "$set": app.model_dump() }
         )
 
-    logger.info(f"Admin {admin.id} updated app {app_id}.")
+    invalidate_app(app_id)
+
+    logger.info("Admin %s updated app %s.", admin.id, app_id, channel="apps")
     return success.ok(f"App {app_id} has been updated.")
 
 @admin_router.get("/admin/app/{app_id}/generate_api_key", tags=["Admin Apps"], response_model=str)
-def admin_app_generate_api_key(app_id: str, admin: Admin = Depends(get_current_admin)):
+async def admin_app_generate_api_key(app_id: str, admin: Admin = Depends(get_current_admin)):
     if (app_id not in admin.apps):
         raise exception.data_conflict("App doesn't exist.")
 
     api_key = generate_api_key()
     api_key_hash = hash(api_key)
 
-    app_col.update_one(
+    await app_col.update_one(
             { "_id": ObjectId(app_id) }, 
             { "$set": { "api_key_hash": api_key_hash }}
         )
 
-    logger.info(f"Admin {admin.id} generated API key for app {app_id}.")
+    invalidate_app(app_id)
+
+    logger.info("Admin %s generated API key for app %s.", admin.id, app_id, channel="apps")
     return success.ok(api_key)
 
 @admin_router.delete("/admin/app/{app_id}", tags=["Admin Apps"])
-def delete_admin_app(app_id: str, admin: Admin = Depends(get_current_admin)):
+async def delete_admin_app(app_id: str, admin: Admin = Depends(get_current_admin)):
     if (app_id not in admin.apps):
         raise exception.data_conflict(f"App {app_id} doesn't exist.")
 
-    db[f"app_{app_id}"].drop()
+    await db[f"app_{app_id}"].drop()
+    await sessions.revoke_scope(app_id)
+
+    await app_col.delete_one({ "_id": ObjectId(app_id)})
 
-    app_col.delete_one({ "_id": ObjectId(app_id)})
+    invalidate_app(app_id)
 
-    admin_col.update_one(
+    await admin_col.update_one(
             { "_id": ObjectId(admin.id) }, 
             {"$pull": { "apps": ObjectId(app_id) }}, 
         )
 
-    logger.info(f"Admin {admin.id} deleted app {app_id}.")
+    logger.info("Admin %s deleted app %s.", admin.id, app_id, channel="apps")
     return success.ok(f"App {app_id} deleted.")
+
+@admin_router.delete("/admin/app/{app_id}/sessions", tags=["Admin Apps"])
+async def revoke_admin_app_sessions(app_id: str, admin: Admin = Depends(get_current_admin)):
+    """
+    Signs every user of the app out. Access tokens already issued stay valid until they expire.
+    """
+
+    if (app_id not in admin.apps):
+        raise exception.data_conflict("App doesn't exist.")
+
+    revoked = await sessions.revoke_scope(app_id)
+
+    logger.info("Admin %s revoked %s sessions of app %s.", admin.id, revoked, app_id, channel="apps")
+    return success.ok(f"{revoked} sessions revoked.")
+
+# Admin App Users
+
+USERS_PAGE_MAX_LIMIT = 200
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+def _encode_users_cursor(order_by: str, value: str):
+    return base64.urlsafe_b64encode(f"{order_by}:{value}".encode()).decode()
+
+def _decode_users_cursor(order_by: str, cursor: str):
+    try:
+        cursor_order_by, value = base64.urlsafe_b64decode(cursor.encode()).decode().split(":", 1)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise exception.bad_request("Invalid cursor.")
+
+    if (cursor_order_by != order_by):
+        raise exception.bad_request("Cursor doesn't match the requested order.")
+
+    if (order_by == "_id"):
+        if (not ObjectId.is_valid(value)):
+            raise exception.bad_request("Invalid cursor.")
+        return ObjectId(value)
+
+    return value
+
+@admin_router.get("/admin/app/{app_id}/users", tags=["Admin App Users"], response_model=UserPage)
+async def get_admin_app_users(
+    app_id: str,
+    limit: int = Query(50, ge=1, le=USERS_PAGE_MAX_LIMIT),
+    order_by: Literal["_id", "email"] = "_id",
+    email_prefix: str = None,
+    cursor: str = None,
+    admin: Admin = Depends(get_current_admin)
+):
+    """
+    Lists the app's users a page at a time, without password hashes or user data.
+
+    Pages are keyset paginated on the unique _id or email index, so every page costs
+    the same however deep it is. email_prefix is a case-sensitive prefix match on the
+    email index and always pages in email order.
+    """
+
+    if (app_id not in admin.apps):
+        raise exception.data_conflict("App doesn't exist.")
+
+    if (email_prefix):
+        order_by = "email"
+
+    query = {}
+    if (email_prefix):
+        query["email"] = { "$regex": f"^{re.escape(email_prefix)}" }
+    if (cursor is not None):
+        query.setdefault(order_by, {})["$gt"] = _decode_users_cursor(order_by, cursor)
+
+    # one extra user tells whether there is a next page
+    users = await db[f"app_{app_id}"].find(
+        query,
+        { "email": 1, "verification_code": 1, "login_attempts": 1, "locked_until": 1 },
+        sort=[ (order_by, 1) ],
+        limit=limit + 1
+    ).to_list()
+
+    next_cursor = None
+    if (len(users) > limit):
+        users = users[:limit]
+        next_cursor = _encode_users_cursor(order_by, str(users[-1][order_by]))
+
+    for user in users:
+        user["verified"] = "verification_code" not in user
+        user.pop("verification_code", None)
+
+    return UserPage(users=[ UserSummary(**user) for user in users ], next_cursor=next_cursor)
+
+@admin_router.post("/admin/app/{app_id}/users/import", tags=["Admin App Users"], response_model=ImportSummary)
+async def import_admin_app_users(
+    req: Request,
+    app_id: str,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    verified: bool = False,
+    batch_size: int = Query(1000, ge=1, le=10_000),
+    admin: Admin = Depends(get_current_admin)
+):
+    """
+    Streams NDJSON objects or CSV rows (email,hash[,data as JSON]) into the app's users.
+
+    hash is stored as is, so it must already be the stored form of the password hash.
+    Users that aren't imported as verified get a verification email.
+    """
+
+    if (app_id not in admin.apps):
+        raise exception.data_conflict("App doesn't exist.")
+
+    app = await app_col.find_one({ "_id": ObjectId(app_id) }, { "name": 1 })
+    app_users_col = db[f"app_{app_id}"]
+
+    summary = ImportSummary(inserted=0, failed=0, errors=[])
+
+    def fail(row: int, error: str):
+        summary.failed += 1
+        if (len(summary.errors) < IMPORT_MAX_REPORTED_ERRORS):
+            summary.errors.append(ImportRowError(row=row, error=error))
+
+    async def insert_batch(rows: list[int], users: list[dict]):
+        try:
+            result = await app_users_col.insert_many(users, ordered=False)
+            inserted_ids = result.inserted_ids
+        except BulkWriteError as error:
+            failed_indexes = set()
+            for write_error in error.details["writeErrors"]:
+                failed_indexes.add(write_error["index"])
+                reason = "Email already used." if write_error["code"] == 11000 else write_error["errmsg"]
+                fail(rows[write_error["index"]], reason)
+            inserted_ids = [ user["_id"] for index, user in enumerate(users) if index not in failed_indexes ]
+
+        summary.inserted += len(inserted_ids)
+
+        if (not verified):
+            inserted = set(inserted_ids)
+            await outbox.enqueue_verification_emails(app_id, app["name"], [
+                (user["email"], f"You verification code is {user['verification_code']}")
+                for user in users if user["_id"] in inserted
+            ])
+
+    pending_insert: asyncio.Task = None
+    rows: list[int] = []
+    users: list[dict] = []
+    header = None
+    row = 0
+
+    try:
+        async for row, line in iter_lines(req.stream()):
+            try:
+                if (format == "csv"):
+                    values = next(csv.reader([ line.decode() ]))
+                    if (header is None):
+                        header = values
+                        continue
+                    fields = dict(zip(header, values))
+                    if (fields.get("data")):
+                        fields["data"] = json.loads(fields["data"])
+                    user = UserImport(**fields)
+                else:
+                    user = UserImport.model_validate_json(line)
+            except ValidationError as error:
+                first_error = error.errors()[0]
+                location = ".".join(str(part) for part in first_error["loc"])
+                fail(row, f"{location}: {first_error['msg']}" if location else first_error["msg"])
+                continue
+            except (ValueError, csv.Error) as error:
+                fail(row, str(error))
+                continue
+
+            user_doc = { "_id": ObjectId(), **user.model_dump(), "login_attempts": 0 }
+            if (not verified):
+                user_doc["verification_code"] = ''.join(str(secrets.randbelow(10)) for _ in range(6))
+
+            rows.append(row)
+            users.append(user_doc)
+
+            if (len(users) >= batch_size):
+                # keep one insert in flight while the next batch is parsed
+                if (pending_insert):
+                    await pending_insert
+                pending_insert = asyncio.create_task(insert_batch(rows, users))
+                rows, users = [], []
+    except ValueError as error:
+        fail(row + 1, str(error))
+    finally:
+        if (pending_insert):
+            await pending_insert
+
+    if (users):
+        await insert_batch(rows, users)
+
+    logger.info("Admin %s imported %s users into app %s.", admin.id, summary.inserted, app_id, channel="apps")
+    return summary
+
+@admin_router.get("/admin/app/{app_id}/users/export", tags=["Admin App Users"])
+async def export_admin_app_users(
+    app_id: str,
+    gzip: bool = False,
+    batch_size: int = Query(1000, ge=1, le=10_000),
+    after: str = None,
+    admin: Admin = Depends(get_current_admin)
+):
+    """
+    Streams the app's users as NDJSON in _id order, without password hashes or verification codes.
+
+    Pass the _id of the last received user as after to resume an interrupted export.
+    """
+
+    if (app_id not in admin.apps):
+        raise exception.data_conflict("App doesn't exist.")
+
+    query = {}
+    if (after is not None):
+        if (not ObjectId.is_valid(after)):
+            raise exception.bad_request("Invalid after cursor.")
+        query["_id"] = { "$gt": ObjectId(after) }
+
+    cursor = db[f"app_{app_id}"].find(
+        query,
+        { "hash": 0, "verification_code": 0 },
+        sort=[ ("_id", 1) ],
+        batch_size=batch_size
+    )
+
+    async def export_lines():
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if gzip else None
+        lines = []
+
+        try:
+            async for user in cursor:
+                user["_id"] = str(user["_id"])
+                lines.append(json.dumps(user, default=str))
+
+                if (len(lines) >= batch_size):
+                    chunk = ("\n".join(lines) + "\n").encode()
+                    lines.clear()
+                    yield compressor.compress(chunk) if compressor else chunk
+        finally:
+            await cursor.close()
+
+        chunk = ("\n".join(lines) + "\n").encode() if lines else b""
+        yield compressor.compress(chunk) + compressor.flush() if compressor else chunk
+
+    headers = { "Content-Disposition": f'attachment; filename="app_{app_id}_users.ndjson"' }
+    if (gzip):
+        headers["Content-Encoding"] = "gzip"
+
+    logger.info("Admin %s exported users of app %s.", admin.id, app_id, channel="apps")
+    return StreamingResponse(export_lines(), media_type="application/x-ndjson", headers=headers)
+
+@admin_router.post("/admin/app/{app_id}/users/batch", tags=["Admin App Users"], response_model=BatchResponse)
+async def admin_app_users_batch(body: BatchRequest, app_id: str, admin: Admin = Depends(get_current_admin)):
+    if (app_id not in admin.apps):
+        raise exception.data_conflict("App doesn't exist.")
+
+    results = await run_user_batch(app_id, body.operations)
+
+    logger.info("Admin %s ran a batch of %s operations on app %s.", admin.id, len(results), app_id, channel="apps")
+    return BatchResponse(results=results)
+
+# Admin Stats
+
+@admin_router.get("/admin/stats/cache", tags=["Admin Stats"])
+async def get_cache_stats(admin: Admin = Depends(get_current_admin)):
+    return { "app_cache": app_cache.stats(), "token_cache": token_cache.stats() }
@@ -1,17 +1,26 @@
 from datetime import datetime, timedelta, timezone
 import secrets
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, WriteError
 from fastapi import APIRouter, Depends, Request, Response
-from pydantic import BaseModel
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
 from models import App, UnverifiedUser, User
-from schemas import ChangePassword, Credentials, EditUserRequest, VerificationCode
+from schemas import BatchRequest, BatchResponse, ChangePassword, Credentials, EditUserRequest, UserDataResponse, VerificationCode
 
+from batch import run_user_batch
 from database import db
-from utils import success
-from utils.email import send_verification_email
+from utils import metrics, success
+from outbox import outbox
+from passwords import password_hasher
+from sessions import sessions
+from throttling import limit_account
+from utils.lockout import is_locked, record_failed_attempt, reset_attempts
+from utils.fields import fields_to_projection
 from utils.logging import logger
+from utils.patch import JSON_PATCH_MEDIA_TYPE, MERGE_PATCH_MEDIA_TYPE, json_patch_to_update, merge_patch_to_update
 import utils.exception as exception
-from auth import generate_token, get_app, get_app_and_current_user, hash
+from auth import current_session_id, decode_token, generate_token, get_app, get_app_and_current_user, get_app_and_current_user_id, revoke_user_tokens
 
 
 app_router = APIRouter()
@@ -19,48 +28,44 @@ app_router = APIRouter()
 # Unprotected routes
 
 @app_router.post("/user/login", tags=["User Account"])
-def user_login(credentials: Credentials, res: Response, app: App = Depends(get_app)):
+async def user_login(credentials: Credentials, res: Response, app: App = Depends(get_app)):
+    await limit_account(credentials.email, app)
+
     app_col = db[f"app_{app.id}"]
 
-    user: dict = app_col.find_one({ "email": credentials.email })
+    user: dict = await app_col.find_one({ "email": credentials.email })
 
     if (not user):
         raise exception.invalid_credentials
 
     if (user.get("verification_code")):
         raise exception.account_not_verified
-    
-    user: User = User(**user)
 
-    if (user.login_attempts >= app.max_login_attempts):
+    if (is_locked(user)):
         raise exception.account_locked
 
-    double_hash = hash(credentials.hash)
+    user_doc = user
+    user: User = User(**user)
 
-    if (double_hash != user.hash):
-        # increment login attempts
-        app_col.update_one({ 
-            "_id": ObjectId(user.id) 
-        }, { 
-            "$set": { "login_attempts": user.login_attempts + 1 }
-        })
+    password_matches, upgraded_hash = await password_hasher.verify(credentials.hash, user.hash)
+
+    if (not password_matches):
+        metrics.login_failures.inc(app.id)
+        if (await record_failed_attempt(app_col, user.id, app.max_login_attempts, app.lockout_time_per_attempt_sec)):
+            metrics.lockouts.inc(app.id)
         raise exception.invalid_credentials
 
-    # reset login attempts
-    app_col.update_one({ 
-        "_id": ObjectId(user.id) 
-    }, { 
-        "$set": { "login_attempts": 0 }
-    })
+    # only writes when there were failed attempts to clear or a legacy hash to upgrade
+    await reset_attempts(app_col, user_doc, { "$set": { "hash": upgraded_hash } } if upgraded_hash else None)
     
     access_token_exp = datetime.now(tz=timezone.utc) + timedelta(seconds=app.access_token_exp_sec)
     refresh_token_exp = datetime.now(tz=timezone.utc) + timedelta(seconds=app.refresh_token_exp_sec)
 
     access_token_data = user.model_dump(exclude={"hash"})
-    refresh_token_data = { "_id": user.id }
+    refresh_token_data = await sessions.create(app.id, user.id, app.refresh_token_exp_sec)
     
-    access_token = generate_token(access_token_data, access_token_exp)
-    refresh_token = generate_token(refresh_token_data, refresh_token_exp)
+    access_token = generate_token(access_token_data, access_token_exp, app.id)
+    refresh_token = generate_token(refresh_token_data, refresh_token_exp, app.id)
     
     res.set_cookie(
         "access_token", 
@@ -77,123 +82,303 @@ def user_login(credentials: Credentials, res: Response, app: App = Depends(get_a
         max_age=app.refresh_token_exp_sec,
     )
 
-    logger.info(f"App {app.id} - User {user.id} authenticated.")
+    logger.info("App %s - User %s authenticated.", app.id, user.id, channel="auth")
     # can't use success.ok() becase cookies will not be included breaking the endpoint.
     return { "message": "User authenticated." }
 
 @app_router.post("/user/register", tags=["User Account"])
-def user_register(credentials: Credentials, app: App = Depends(get_app)):
+async def user_register(credentials: Credentials, app: App = Depends(get_app)):
+    await limit_account(credentials.email, app)
+
     app_col = db[f"app_{app.id}"]
 
-    user_exist = app_col.find_one({ "email": credentials.email }) is not None
+    verification_code = ''.join(str(secrets.randbelow(10)) for _ in range(6))
 
-    if (user_exist):
+    # the unique email index rejects duplicates, no need to look the email up first
+    try:
+        user_id = (await app_col.insert_one({
+                "email": credentials.email,
+                "hash": await password_hasher.hash(credentials.hash),
+                "data": {},
+                "login_attempts": 0,
+                "verification_code": verification_code
+            })).inserted_id
+    except DuplicateKeyError:
         raise exception.data_conflict("Email already used.")
-    
-    verification_code = ''.join(str(secrets.randbelow(10)) for _ in range(6))
+
     # TODO: Add link to frontend
     message = f"You verification code is {verification_code}"
 
-    send_verification_email(app.name, credentials.email, message)
+    await outbox.enqueue_verification_email(app.id, app.name, credentials.email, message)
 
-    user_id = app_col.insert_one({
-            "email": credentials.email,
-            "hash": hash(credentials.hash),
-            "data": {},
-            "login_attempts": 0,
-            "verification_code": verification_code
-        }).inserted_id
-
-    logger.info(f"App {app.id} - User {str(user_id)} registered successfully.")
+    logger.info("App %s - User %s registered successfully.", app.id, user_id, channel="account")
     return success.created(str(user_id))
 
 @app_router.post("/user/{user_id}/verify", tags=["User Account"])
-def user_verify_account(body: VerificationCode, user_id: str, app: App = Depends(get_app)):
+async def user_verify_account(body: VerificationCode, user_id: str, app: App = Depends(get_app)):
+    await limit_account(user_id, app)
+
     app_col = db[f"app_{app.id}"]
 
-    user = app_col.find_one({ "_id": ObjectId(user_id) })
+    user = await app_col.find_one({ "_id": ObjectId(user_id) })
 
     if (not user):
         raise exception.invalid_credentials
 
-    user = UnverifiedUser(**user)
-    
-    if (user.login_attempts >= app.max_login_attempts):
+    if (is_locked(user)):
         raise exception.account_locked
+
+    user_doc = user
+    user = UnverifiedUser(**user)
     
     if (body.verification_code != user.verification_code):
-        # increment login attempts when wrong password
-        app_col.update_one({ 
-                "_id": ObjectId(user.id) 
-            }, { 
-                "$set": { "login_attempts": user.login_attempts + 1 }
-            })
-
-    app_col.update_one({ 
-            "_id": ObjectId(user.id) 
-        }, { 
-            "$set": { 
-                "login_attempts": 0,
-            },
-            "$unset": {
-                "verification_code": ""
-            }
-        })
+        if (await record_failed_attempt(app_col, user.id, app.max_login_attempts, app.lockout_time_per_attempt_sec)):
+            metrics.lockouts.inc(app.id)
+        raise exception.invalid_credentials
 
-    logger.info(f"App {app.id} - User {user.id} was verified.")
+    await reset_attempts(app_col, user_doc, { "$unset": { "verification_code": "" } })
+
+    logger.info("App %s - User %s was verified.", app.id, user.id, channel="account")
     return success.ok("Account verified successfully.")
 
+@app_router.post("/user/refresh", tags=["User Account"])
+async def user_refresh_token(req: Request, res: Response, app: App = Depends(get_app)):
+    """
+    Rotates the refresh token and issues a new access token. Presenting a refresh token
+    that was already rotated away revokes its session, so this is a POST that clients
+    must not retry blindly.
+    """
+
+    refresh_token = req.cookies.get("refresh_token")
+
+    if (not refresh_token):
+        raise exception.unauthorized_access
+
+    try:
+        claims = decode_token(refresh_token, app.id)
+    except:
+        raise exception.unauthorized_access
+
+    app_col = db[f"app_{app.id}"]
+
+    # the user is checked before rotating, a deleted or unverified user's session ends here
+    user_id = claims.get("id")
+    user: dict = await app_col.find_one({ "_id": ObjectId(user_id) }) if ObjectId.is_valid(user_id) else None
+
+    if (not user or user.get("verification_code")):
+        if (isinstance(claims.get("sid"), str)):
+            await sessions.revoke(claims["sid"])
+        raise exception.account_not_verified if user else exception.unauthorized_access
+
+    refresh_token_data = await sessions.rotate(app.id, claims, app.refresh_token_exp_sec)
+
+    if (not refresh_token_data):
+        raise exception.unauthorized_access
+
+    user: User = User(**user)
+
+    access_token_exp = datetime.now(tz=timezone.utc) + timedelta(seconds=app.access_token_exp_sec)
+    refresh_token_exp = datetime.now(tz=timezone.utc) + timedelta(seconds=app.refresh_token_exp_sec)
+
+    access_token_data = user.model_dump(exclude={"hash"})
+
+    access_token = generate_token(access_token_data, access_token_exp, app.id)
+    refresh_token = generate_token(refresh_token_data, refresh_token_exp, app.id)
+
+    res.set_cookie(
+        "access_token", 
+        access_token,
+        httponly=True,
+        samesite="strict",
+        max_age=app.access_token_exp_sec,
+    )
+    res.set_cookie(
+        "refresh_token", 
+        refresh_token,
+        httponly=True,
+        samesite="strict",
+        max_age=app.refresh_token_exp_sec,
+    )
+
+    logger.info("App %s - User %s access token refreshed.", app.id, user.id, channel="auth")
+    # can't use success.ok() becase cookies will not be included breaking the endpoint.
+    return { "message": "User access token refreshed." }
+
+@app_router.get("/user/logout", tags=["User Account"])
+async def user_logout(req: Request, res: Response, app: App = Depends(get_app)):
+    session_id = current_session_id(req, app.id)
+
+    if (session_id):
+        await sessions.revoke(session_id)
+
+    res.delete_cookie(key="access_token")
+    res.delete_cookie(key="refresh_token")
+
+    # can't use success.ok() becase cookies removal will not be included breaking the endpoint.
+    return { "message": "User logged out." }
+
 # Protected routes
 
 @app_router.patch("/user/changepassword", tags=["User Account"])
-def user_change_password(body: ChangePassword, app_user: tuple[App, User] = Depends(get_app_and_current_user)):
+async def user_change_password(body: ChangePassword, req: Request, res: Response, app_user: tuple[App, User] = Depends(get_app_and_current_user)):
     app, user = app_user
 
     app_col = db[f"app_{app.id}"]
 
-    double_hash = hash(body.hash)
-    if (double_hash != user.hash):
+    password_matches, _ = await password_hasher.verify(body.hash, user.hash)
+    if (not password_matches):
         raise exception.invalid_credentials
     
-    double_new_hash = hash(body.new_hash)
-    app_col.update_one({
+    new_hash = await password_hasher.hash(body.new_hash)
+    await app_col.update_one({
             "_id": ObjectId(user.id)
         }, {
-            "$set": { "hash": double_new_hash }
+            "$set": { "hash": new_hash },
+            "$inc": { "token_version": 1 }
         })
 
-    logger.info(f"App {app.id} - User {user.id} successfully changed password.")
-    return success.ok("Password changed successfully.")
+    revoke_user_tokens(app.id, user.id)
+    await sessions.revoke_account(app.id, user.id, current_session_id(req, app.id))
+
+    # other sessions are now revoked, keep this one alive with the new token version
+    access_token_exp = datetime.now(tz=timezone.utc) + timedelta(seconds=app.access_token_exp_sec)
+    access_token_data = user.model_dump(exclude={"hash"}) | { "token_version": user.token_version + 1 }
+
+    res.set_cookie(
+        "access_token", 
+        generate_token(access_token_data, access_token_exp, app.id),
+        httponly=True,
+        samesite="strict",
+        max_age=app.access_token_exp_sec,
+    )
+
+    logger.info("App %s - User %s successfully changed password.", app.id, user.id, channel="account")
+    # can't use success.ok() becase cookies will not be included breaking the endpoint.
+    return { "message": "Password changed successfully." }
+
+@app_router.get("/user", tags=["User Account"], response_model=UserDataResponse)
+async def get_user(fields: str = None, app_user: tuple[App, str] = Depends(get_app_and_current_user_id)):
+    """
+    Returns the user's email and data. fields, e.g. "theme,profile.name", limits data
+    to the given dotted paths.
+    """
+
+    app, user_id = app_user
 
-@app_router.get("/user", tags=["User Account"], response_model=User, response_model_exclude=["_id", "hash", "login_attempts"])
-def get_user(app_user: tuple[App, User] = Depends(get_app_and_current_user)):
-    app, user = app_user
-    
     app_col = db[f"app_{app.id}"]
 
-    app_col.find_one({ "_id": user.id })
+    projection = { "_id": 0, "email": 1 }
+    if (fields):
+        projection.update(fields_to_projection(fields))
+    else:
+        projection["data"] = 1
 
-    logger.info(f"App {app.id} - User {user.id} data updated.")
-    return success.ok("User data updated.")
+    user = await app_col.find_one({ "_id": ObjectId(user_id) }, projection)
 
-@app_router.patch("/user", tags=["User Account"])
-def edit_user(body: EditUserRequest, app_user: tuple[App, User] = Depends(get_app_and_current_user)):
-    app, user = app_user
+    if (not user):
+        raise exception.unauthorized_access
+
+    return { "email": user["email"], "data": user.get("data", {}) }
+
+EDIT_USER_REQUEST_BODY = {
+    "content": {
+        "application/json": { "schema": EditUserRequest.model_json_schema() },
+        MERGE_PATCH_MEDIA_TYPE: { "schema": { "type": "object" } },
+        JSON_PATCH_MEDIA_TYPE: { "schema": { "type": "array", "items": { "type": "object" } } }
+    },
+    "required": True
+}
+
+@app_router.patch("/user", tags=["User Account"], openapi_extra={ "requestBody": EDIT_USER_REQUEST_BODY })
+async def edit_user(req: Request, app_user: tuple[App, str] = Depends(get_app_and_current_user_id)):
+    """
+    application/json replaces the whole user data with user_data. A merge patch
+    (application/merge-patch+json) or JSON patch (application/json-patch+json)
+    only writes the fields it changes.
+    """
+
+    app, user_id = app_user
+
+    content_type = req.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+
+    try:
+        body = await req.json()
+    except ValueError:
+        raise exception.bad_request("Request body isn't valid JSON.")
+
+    query = { "_id": ObjectId(user_id) }
+
+    if (content_type == MERGE_PATCH_MEDIA_TYPE):
+        update = merge_patch_to_update(body)
+    elif (content_type == JSON_PATCH_MEDIA_TYPE):
+        try:
+            conditions, update = json_patch_to_update(body)
+        except ValueError as error:
+            raise exception.bad_request(f"Patch can't be applied: {error}")
+        query.update(conditions)
+    elif (content_type == "application/json"):
+        try:
+            body = EditUserRequest.model_validate(body)
+        except ValidationError as error:
+            raise RequestValidationError(error.errors())
+        update = { "$set": { "data": body.user_data } }
+    else:
+        raise exception.unsupported_media_type
 
     app_col = db[f"app_{app.id}"]
 
-    app_col.update_one({ "_id": ObjectId(user.id) }, { "$set": { "data": body.user_data }})
+    if (update):
+        try:
+            matched = (await app_col.update_one(query, update)).matched_count
+        except WriteError as error:
+            raise exception.bad_request(f"Patch can't be applied: {error.details.get('errmsg', 'invalid path')}")
+    else:
+        # nothing to write, but a patch made only of tests still has to hold
+        matched = await app_col.count_documents(query, limit=1)
 
-    logger.info(f"App {app.id} - User {user.id} data updated.")
+    if (not matched):
+        raise exception.data_conflict("Patch test failed.") if (len(query) > 1) else exception.unauthorized_access
+
+    logger.info("App %s - User %s data updated.", app.id, user_id, channel="account")
     return success.ok("User data updated.")
 
 @app_router.delete("/user", tags=["User Account"])
-def delete_user(app_user: tuple[App, User] = Depends(get_app_and_current_user)):
-    app, user = app_user
+async def delete_user(app_user: tuple[App, str] = Depends(get_app_and_current_user_id)):
+    app, user_id = app_user
 
     app_col = db[f"app_{app.id}"]
 
-    app_col.delete_one({ "_id": user.id })
+    await app_col.delete_one({ "_id": ObjectId(user_id) })
+
+    revoke_user_tokens(app.id, user_id)
+    await sessions.revoke_account(app.id, user_id)
+
+    logger.info("App %s - User %s deleted.", app.id, user_id, channel="account")
+    return success.ok("Account deleted successfully.")
+
+@app_router.delete("/user/sessions", tags=["User Account"])
+async def revoke_user_sessions(app_user: tuple[App, str] = Depends(get_app_and_current_user_id)):
+    """
+    Signs the user out everywhere. Access tokens already issued stay valid until they expire.
+    """
+
+    app, user_id = app_user
+
+    revoked = await sessions.revoke_account(app.id, user_id)
+
+    logger.info("App %s - User %s revoked %s sessions.", app.id, user_id, revoked, channel="auth")
+    return success.ok(f"{revoked} sessions revoked.")
+
+# App Backend
+
+@app_router.post("/batch", tags=["App Backend"], response_model=BatchResponse)
+async def app_batch(body: BatchRequest, app: App = Depends(get_app)):
+    """
+    Runs get/update_data/delete/lock/unlock operations on many of the app's users in
+    one request, authenticated by the app's API key alone. Meant for the app's backend.
+    """
+
+    results = await run_user_batch(app.id, body.operations)
 
-    logger.info(f"App {app.id} - User {user.id} deleted.")
-    return success.ok("Account deleted successfully.")
\ No newline at end of file
+    logger.info("App %s - ran a batch of %s operations.", app.id, len(results), channel="account")
+    return BatchResponse(results=results)
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends, Response
+
+from signing import signing_keys
+from throttling import limit_by_ip
+
+JWKS_MAX_AGE_SEC = 300
+
+jwks_router = APIRouter(dependencies=[ Depends(limit_by_ip) ])
+
+
+@jwks_router.get("/.well-known/jwks.json", tags=["Keys"])
+async def get_jwks(res: Response):
+    """
+    Public keys that verify Warden's tokens, empty when tokens are signed with a shared secret.
+    """
+
+    res.headers["Cache-Control"] = f"public, max-age={JWKS_MAX_AGE_SEC}"
+    return signing_keys.jwks
@@ -0,0 +1,45 @@
+import hmac
+import os
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+from auth import app_cache, token_cache, token_version_cache
+from utils import exception, metrics
+
+# when set, scrapers must send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics_router = APIRouter()
+
+
+@metrics.registry.collector
+def collect_cache_metrics():
+    caches = { "app": app_cache, "token": token_cache, "token_version": token_version_cache }
+
+    lookups = metrics.Counter("warden_auth_cache_lookups_total", "Auth dependency cache lookups by outcome.", ("cache", "outcome"))
+    evictions = metrics.Counter("warden_auth_cache_evictions_total", "Entries evicted to stay within max size.", ("cache",))
+    size = metrics.Gauge("warden_auth_cache_size", "Entries in the cache.", ("cache",))
+
+    for name, cache in caches.items():
+        stats = cache.stats()
+        lookups.inc(name, "hit", amount=stats["hits"])
+        lookups.inc(name, "miss", amount=stats["misses"])
+        lookups.inc(name, "coalesced", amount=stats["coalesced"])
+        evictions.inc(name, amount=stats["evictions"])
+        size.inc(name, amount=stats["size"])
+
+    return lookups, evictions, size
+
+
+@metrics_router.get("/metrics", tags=["Metrics"], response_class=PlainTextResponse)
+async def get_metrics(req: Request):
+    """
+    Metrics of the worker serving the request, in the Prometheus text format.
+    """
+
+    if (METRICS_TOKEN and not hmac.compare_digest(req.headers.get("Authorization", "").encode(), f"Bearer {METRICS_TOKEN}".encode())):
+        raise exception.unauthorized_access
+
+    return PlainTextResponse(metrics.registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
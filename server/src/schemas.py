@@ -1,7 +1,8 @@
-from typing import Any, Dict
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Any, Dict, Literal
+from pydantic import BaseModel, Field
 
-from models import AppID, AppAPIKey, AppBase
+from models import AnnotatedObjectId, AppID, AppAPIKey, AppBase
 
 
 class AppCreate(AppBase):
@@ -32,4 +33,56 @@ class VerificationCode(BaseModel):
     verification_code: str
 
 class EditUserRequest(BaseModel):
-    user_data: dict
\ No newline at end of file
+    user_data: dict
+
+class UserDataResponse(BaseModel):
+    email: str
+    data: dict
+
+
+class UserImport(BaseModel):
+    email: str
+    hash: str
+    data: dict = {}
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportSummary(BaseModel):
+    inserted: int
+    failed: int
+    errors: list[ImportRowError]
+
+class UserSummary(BaseModel):
+    id: AnnotatedObjectId = Field(alias='_id')
+    email: str
+    verified: bool
+    login_attempts: int = 0
+    locked_until: datetime | None = None
+
+class UserPage(BaseModel):
+    users: list[UserSummary]
+    # pass back as cursor for the next page, None on the last page
+    next_cursor: str | None
+
+
+class BatchOperation(BaseModel):
+    op: Literal["get", "update_data", "delete", "lock", "unlock"]
+    user_id: str
+    # merge patch for update_data
+    data: dict | None = None
+    # lock duration for lock
+    lock_sec: int | None = Field(None, gt=0)
+
+class BatchRequest(BaseModel):
+    operations: list[BatchOperation] = Field(max_length=1000)
+
+class BatchResult(BaseModel):
+    status: int
+    user: UserDataResponse | None = None
+    error: str | None = None
+
+class BatchResponse(BaseModel):
+    # in the order of the operations
+    results: list[BatchResult]
@@ -0,0 +1,120 @@
+"""
+Server-side sessions behind refresh tokens.
+
+A session is one login, stored as { _id: session id, scope: "admin" or the app id,
+account_id, generation, expires_at }. The refresh token carries the session id and
+generation. Every refresh bumps the generation and issues a new token, so a token that
+was already rotated away is a replay and revokes the whole session.
+
+Expired sessions are removed by a TTL index on expires_at.
+"""
+from datetime import datetime, timedelta, timezone
+import secrets
+
+from database import db
+from utils.logging import logger
+
+ADMIN_SCOPE = "admin"
+
+
+class SessionStore:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        # revoking every session of an account or of an app
+        await self.collection.create_index([ ("scope", 1), ("account_id", 1) ])
+
+    async def create(self, scope: str, account_id: str, lifetime_sec: float):
+        """
+        Returns the claims for the session's first refresh token.
+        """
+
+        now = datetime.now(tz=timezone.utc)
+        session_id = secrets.token_urlsafe(12)
+
+        await self.collection.insert_one({
+            "_id": session_id,
+            "scope": scope,
+            "account_id": account_id,
+            "generation": 0,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=lifetime_sec)
+        })
+
+        return { "id": account_id, "sid": session_id, "gen": 0 }
+
+    async def rotate(self, scope: str, claims: dict, lifetime_sec: float):
+        """
+        Takes verified refresh token claims and returns the claims for the next refresh
+        token, or None when the session is gone, expired or the token was replayed.
+
+        One read and one write by _id, however many sessions exist.
+        """
+
+        session_id = claims.get("sid")
+        generation = claims.get("gen")
+
+        if (not isinstance(session_id, str) or not isinstance(generation, int)):
+            return None
+
+        session: dict = await self.collection.find_one({ "_id": session_id })
+
+        if (
+            not session
+            or session["scope"] != scope
+            or session["account_id"] != claims.get("id")
+            or session["expires_at"].replace(tzinfo=timezone.utc) <= datetime.now(tz=timezone.utc)
+        ):
+            return None
+
+        if (session["generation"] != generation):
+            await self._revoke_replayed(session)
+            return None
+
+        # conditional on the generation so two refreshes with the same token can't both win
+        result = await self.collection.update_one(
+            { "_id": session_id, "generation": generation },
+            {
+                "$inc": { "generation": 1 },
+                "$set": { "expires_at": datetime.now(tz=timezone.utc) + timedelta(seconds=lifetime_sec) }
+            }
+        )
+
+        if (result.modified_count == 0):
+            await self._revoke_replayed(session)
+            return None
+
+        return { "id": session["account_id"], "sid": session_id, "gen": generation + 1 }
+
+    async def _revoke_replayed(self, session: dict):
+        await self.collection.delete_one({ "_id": session["_id"] })
+        logger.info(
+            "Refresh token reuse on session %s of %s in %s, session revoked.",
+            session["_id"], session["account_id"], session["scope"], channel="auth"
+        )
+
+    async def revoke(self, session_id: str):
+        await self.collection.delete_one({ "_id": session_id })
+
+    async def revoke_account(self, scope: str, account_id: str, keep_session_id: str = None):
+        """
+        Revokes every session of the account, except keep_session_id when given.
+        """
+
+        query = { "scope": scope, "account_id": account_id }
+        if (keep_session_id):
+            query["_id"] = { "$ne": keep_session_id }
+
+        return (await self.collection.delete_many(query)).deleted_count
+
+    async def revoke_accounts(self, scope: str, account_ids: list[str]):
+        if (account_ids):
+            await self.collection.delete_many({ "scope": scope, "account_id": { "$in": account_ids } })
+
+    async def revoke_scope(self, scope: str):
+        return (await self.collection.delete_many({ "scope": scope })).deleted_count
+
+
+sessions = SessionStore(db.sessions)
@@ -0,0 +1,106 @@
+"""
+Signs and verifies the access and refresh tokens.
+
+HS* algorithms sign with SECRET_KEY, like before. ES256 signs with the private key whose
+kid is JWT_ACTIVE_KID. The public halves of all configured keys are published at
+/.well-known/jwks.json, so integrating apps can verify tokens without calling Warden.
+
+To rotate, add the new key, switch JWT_ACTIVE_KID to it, and remove the old key once
+every token it signed has expired.
+
+Usage: python src/signing.py <kid> prints a new ES256 key for JWT_SIGNING_KEYS.
+"""
+import json
+import os
+import sys
+from datetime import datetime
+from jose import jwk, jwt
+
+JWT_ALGORITHM = os.environ.get("JWT_ALGORITHM", os.environ.get("HASHING_ALGORITHM", "HS256"))
+# JSON object of kid -> PEM key, only used by asymmetric algorithms
+JWT_SIGNING_KEYS = os.environ.get("JWT_SIGNING_KEYS", "")
+JWT_ACTIVE_KID = os.environ.get("JWT_ACTIVE_KID")
+JWT_ISSUER = os.environ.get("JWT_ISSUER", "warden")
+
+ADMIN_AUDIENCE = "warden-admin"
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class SigningKeys:
+    def __init__(self, algorithm: str, secret_key: str, pem_keys: dict[str, str] = None, active_kid: str = None, issuer: str = JWT_ISSUER):
+        self.algorithm = algorithm
+        self.issuer = issuer
+        self.symmetric = algorithm.startswith("HS")
+
+        if (self.symmetric):
+            self.active_kid = None
+            self.keys = { None: secret_key }
+            self.verifying_keys = self.keys
+            self.jwks = { "keys": [] }
+            return
+
+        if (not pem_keys):
+            raise ValueError(f"{algorithm} needs at least one key in JWT_SIGNING_KEYS.")
+
+        self.keys = { kid: jwk.construct(pem, algorithm) for kid, pem in pem_keys.items() }
+        self.active_kid = active_kid or max(self.keys)
+
+        if (self.active_kid not in self.keys or self.keys[self.active_kid].is_public()):
+            raise ValueError(f"JWT_ACTIVE_KID {self.active_kid} must name a private key in JWT_SIGNING_KEYS.")
+
+        self.verifying_keys = { kid: key.public_key() for kid, key in self.keys.items() }
+        self.jwks = { "keys": [
+            { **key.to_dict(), "kid": kid, "use": "sig" }
+            for kid, key in self.verifying_keys.items()
+        ] }
+
+    def encode(self, claims: dict, expire: datetime, audience: str):
+        to_encode = { **claims, "exp": expire, "aud": audience, "iss": self.issuer }
+        headers = { "kid": self.active_kid } if self.active_kid else None
+        return jwt.encode(to_encode, self.keys[self.active_kid], self.algorithm, headers=headers)
+
+    def decode(self, token: str, audience: str):
+        """
+        Raises InvalidToken unless the token is signed by a known key, unexpired and meant for audience.
+        """
+
+        try:
+            kid = None if self.symmetric else jwt.get_unverified_header(token).get("kid")
+            key = self.verifying_keys.get(kid)
+
+            if (key is None):
+                raise InvalidToken("Unknown signing key.")
+
+            claims = jwt.decode(token, key, algorithms=[ self.algorithm ], audience=audience, issuer=self.issuer)
+        except InvalidToken:
+            raise
+        except Exception as error:
+            raise InvalidToken(str(error))
+
+        # python-jose accepts tokens without an aud claim even when an audience is expected
+        if (claims.get("aud") != audience):
+            raise InvalidToken("Invalid audience.")
+
+        return claims
+
+
+signing_keys = SigningKeys(
+    JWT_ALGORITHM,
+    os.environ.get("SECRET_KEY"),
+    json.loads(JWT_SIGNING_KEYS) if JWT_SIGNING_KEYS else None,
+    JWT_ACTIVE_KID
+)
+
+
+if __name__ == "__main__":
+    import ecdsa
+
+    if (len(sys.argv) != 2):
+        print("Usage: python src/signing.py <kid>")
+        sys.exit(1)
+
+    pem = ecdsa.SigningKey.generate(curve=ecdsa.NIST256p).to_pem().decode()
+    print(json.dumps({ sys.argv[1]: pem }))
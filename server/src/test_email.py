@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=".env.development")
+load_dotenv()
+
+from aiosmtpd.controller import Controller
+from pymongo import AsyncMongoClient
+import os
+import pytest
+import socket
+
+import outbox as outbox_module
+from outbox import EmailOutbox
+from utils.email import SMTPConnectionPool, build_verification_email
+
+
+class SinkHandler:
+    """
+    Local SMTP stand-in that records every session and message.
+    """
+
+    def __init__(self):
+        self.sessions = 0
+        self.messages = []
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos, envelope.content))
+        return "250 Message accepted for delivery"
+
+
+@pytest.fixture
+def smtp_sink():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    handler = SinkHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    yield handler, "127.0.0.1", port
+    controller.stop()
+
+def test_pool_reuses_connections(smtp_sink):
+    handler, host, port = smtp_sink
+    pool = SMTPConnectionPool(host, port, size=2, starttls=False, sender="noreply@warden.test")
+
+    for batch in range(3):
+        pool.send_batch([
+            (f"user{batch}{i}@gmail.com", build_verification_email("Test", f"user{batch}{i}@gmail.com", "123456"))
+            for i in range(2)
+        ])
+
+    pool.close()
+
+    assert len(handler.messages) == 6
+    assert pool.connections_opened <= 2
+    assert handler.sessions <= 2
+
+def test_outbox_dedupes_and_drains_on_stop(smtp_sink):
+    handler, host, port = smtp_sink
+
+    async def run():
+        client = AsyncMongoClient(os.environ["MONGODB_URL"])
+        collection = client.warden.email_outbox_test
+        await collection.drop()
+
+        outbox = EmailOutbox(
+            collection,
+            SMTPConnectionPool(host, port, size=2, starttls=False, sender="noreply@warden.test")
+        )
+        await outbox.ensure_indexes()
+
+        # queued before the worker runs, the second code for the same recipient replaces the first
+        await outbox.enqueue_verification_email("app_a", "Test", "a@gmail.com", "111111")
+        await outbox.enqueue_verification_email("app_a", "Test", "a@gmail.com", "222222")
+        await outbox.enqueue_verification_email("app_a", "Test", "b@gmail.com", "333333")
+        # another app with the same name keeps its own pending email
+        await outbox.enqueue_verification_email("app_b", "Test", "a@gmail.com", "444444")
+
+        outbox.start()
+        await outbox.stop()
+
+        remaining = await collection.count_documents({})
+
+        await collection.drop()
+        await client.close()
+        return remaining
+
+    remaining = asyncio.run(run())
+
+    assert remaining == 0
+    assert len(handler.messages) == 3
+    contents = b"".join(content for _, content in handler.messages)
+    assert b"222222" in contents and b"444444" in contents and b"111111" not in contents
+
+def test_failed_messages_expire(monkeypatch):
+    class FailingPool:
+        size = 1
+
+        def send_batch(self, messages: list):
+            return [ ConnectionRefusedError("SMTP is down") for _ in messages ]
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(outbox_module, "EMAIL_MAX_ATTEMPTS", 1)
+
+    async def run():
+        client = AsyncMongoClient(os.environ["MONGODB_URL"])
+        collection = client.warden.email_outbox_failed_test
+        await collection.drop()
+
+        outbox = EmailOutbox(collection, FailingPool())
+        await outbox.ensure_indexes()
+        await outbox.enqueue_verification_email("app_a", "Test", "a@gmail.com", "111111")
+        await outbox.process_due()
+
+        message = await collection.find_one({})
+        indexes = await collection.index_information()
+
+        await collection.drop()
+        await client.close()
+        return message, indexes
+
+    message, indexes = asyncio.run(run())
+
+    assert message["status"] == "failed"
+    # kept for inspection, then removed by the TTL index like expired sessions
+    retention = message["expires_at"].replace(tzinfo=timezone.utc) - datetime.now(tz=timezone.utc)
+    assert timedelta(seconds=outbox_module.EMAIL_FAILED_RETENTION_SEC - 60) < retention <= timedelta(seconds=outbox_module.EMAIL_FAILED_RETENTION_SEC)
+    assert any(index.get("expireAfterSeconds") == 0 and index["key"] == [ ("expires_at", 1) ] for index in indexes.values())
@@ -0,0 +1,118 @@
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=".env.development")
+load_dotenv()
+
+import httpx
+import json
+import os
+import psutil
+from pymongo import MongoClient
+import pytest
+import socket
+import subprocess
+import sys
+import time
+
+# starts a server against a live MongoDB, so it only runs when asked for:
+#   RUN_EXPORT_TEST=1 EXPORT_TEST_USERS=1000000 python -m pytest test_export.py
+pytestmark = pytest.mark.skipif(os.environ.get("RUN_EXPORT_TEST") != "1", reason="set RUN_EXPORT_TEST=1 to run")
+
+# size of the synthetic collection, the memory bound only proves streaming from about 1M users
+EXPORT_TEST_USERS = int(os.environ.get("EXPORT_TEST_USERS", 10_000))
+# the export must stay well below the size of the data it streams (~150 bytes per user)
+EXPORT_MAX_RSS_GROWTH_BYTES = 64 * 1024 * 1024
+
+db = MongoClient(os.environ["MONGODB_URL"]).warden
+
+
+@pytest.fixture(scope="module")
+def server():
+    """
+    Runs the app in a real uvicorn process, TestClient buffers whole responses
+    and would hide whether the export streams.
+    """
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    process = subprocess.Popen(
+        [ sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning" ],
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+
+    base_url = f"http://127.0.0.1:{port}"
+
+    for _ in range(100):
+        try:
+            httpx.get(f"{base_url}/docs")
+            break
+        except httpx.TransportError:
+            time.sleep(0.1)
+
+    yield process, base_url
+
+    process.terminate()
+    process.wait()
+
+def synthetic_users(count: int):
+    for i in range(count):
+        line = { "email": f"export{i}@gmail.com", "hash": "0" * 64, "data": { "index": i, "plan": "free" } }
+        yield (json.dumps(line) + "\n").encode()
+
+def test_export_streams_in_constant_memory(server):
+    process, base_url = server
+    server_process = psutil.Process(process.pid)
+
+    with httpx.Client(base_url=base_url, timeout=None) as client:
+        res = client.post("/admin/register", json={ "email": "exporttest@gmail.com", "hash": "test" })
+        assert res.status_code == 201
+
+        admin_id = res.json()["message"]
+        verification_code = db.admin.find_one({ "email": "exporttest@gmail.com" })["verification_code"]
+
+        res = client.post(f"/admin/{admin_id}/verify", json={ "verification_code": verification_code })
+        assert res.status_code == 200
+
+        res = client.post("/admin/login", json={ "email": "exporttest@gmail.com", "hash": "test" })
+        assert res.status_code == 200
+
+        res = client.post("/admin/app", json={
+            "name": "export_test_app",
+            "access_token_exp_sec": 60,
+            "refresh_token_exp_sec": 60,
+            "max_login_attempts": 3,
+            "lockout_time_per_attempt_sec": 60
+        })
+        assert res.status_code == 201
+
+        app_id = res.json()["message"]
+
+        try:
+            res = client.post(
+                f"/admin/app/{app_id}/users/import?verified=true&batch_size=10000",
+                content=synthetic_users(EXPORT_TEST_USERS)
+            )
+            assert res.status_code == 200
+            assert res.json()["inserted"] == EXPORT_TEST_USERS
+
+            rss_before = server_process.memory_info().rss
+            rss_peak = rss_before
+            exported = 0
+
+            with client.stream("GET", f"/admin/app/{app_id}/users/export?batch_size=5000") as res:
+                assert res.status_code == 200
+
+                for line in res.iter_lines():
+                    if (not line):
+                        continue
+                    exported += 1
+                    if (exported % 10_000 == 0):
+                        rss_peak = max(rss_peak, server_process.memory_info().rss)
+
+            assert exported == EXPORT_TEST_USERS
+            assert rss_peak - rss_before < EXPORT_MAX_RSS_GROWTH_BYTES
+        finally:
+            client.delete(f"/admin/app/{app_id}")
+            client.delete("/admin")
@@ -0,0 +1,51 @@
+import json
+import logging
+import random
+
+from utils.logging import MASK_MAX_ITEMS, _JSONFormatter, logger
+
+
+def test_sensitive_fields_never_reach_the_output():
+    record = logging.LogRecord("warden", logging.ERROR, __file__, 1, "POST /user/login", None, None)
+    record.data = {
+        "body": {
+            "email": "user@gmail.com",
+            "hash": "client-hash",
+            "profile": { "password": "hunter2", "tokens": [ { "access_token": "eyJ.access" } ] }
+        },
+        "cookies": { "refresh_token": "eyJ.refresh" },
+        "items": list(range(MASK_MAX_ITEMS + 10))
+    }
+
+    output = _JSONFormatter().format(record)
+
+    for secret in ("user@gmail.com", "client-hash", "hunter2", "eyJ.access", "eyJ.refresh"):
+        assert secret not in output
+
+    data = json.loads(output)["data"]
+    assert data["body"]["hash"] == "[REDACTED]"
+    assert data["body"]["profile"]["tokens"][0]["access_token"] == "[REDACTED]"
+    assert data["items"][-1] == "[10 more]" and len(data["items"]) == MASK_MAX_ITEMS + 1
+
+def test_sampling_rate_is_applied(monkeypatch):
+    kept = []
+
+    class Capture(logging.Handler):
+        def emit(self, record: logging.LogRecord):
+            kept.append(record.name)
+
+    for channel in ("sampled", "muted", "unsampled"):
+        channel_logger = logging.getLogger(f"warden.{channel}")
+        monkeypatch.setattr(channel_logger, "propagate", False)
+        monkeypatch.setattr(channel_logger, "handlers", [ Capture() ])
+
+    monkeypatch.setattr(logger, "sample_rates", { "warden.sampled": 0.25, "warden.muted": 0.0 })
+    random.seed(7)
+
+    for _ in range(4000):
+        for channel in ("sampled", "muted", "unsampled"):
+            logger.info("User %s authenticated.", "id", channel=channel)
+
+    assert 800 < kept.count("warden.sampled") < 1200
+    assert kept.count("warden.muted") == 0
+    assert kept.count("warden.unsampled") == 4000
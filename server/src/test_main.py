@@ -1,26 +1,56 @@
 from bson import ObjectId
+from datetime import datetime, timezone
+import hashlib
+import json
 from dotenv import load_dotenv
+from pymongo import MongoClient
+import pytest
+import time
 
-from models import Admin, App, UnverifiedAdmin, UnverifiedUser
+from models import Admin, App, RateLimit, UnverifiedAdmin, UnverifiedUser
 from schemas import AppResponse
+from signing import ADMIN_AUDIENCE
 load_dotenv(dotenv_path=".env.development")
 
 from fastapi.testclient import TestClient
 from main import app
-from auth import get_current_admin
+import auth
+from auth import decode_token, get_current_admin
+import routers.metrics
+import throttling
+from utils.patch import json_patch_to_update
+from utils.rate_limit import MemoryRateLimitStore
 import os
-from database import db
+
+# the app's own client may be async, so the test inspects the database through a sync one
+db = MongoClient(os.environ["MONGODB_URL"]).warden
 
 admin_col = db.admin
 
 client = TestClient(app)
 
+@pytest.fixture(scope="module", autouse=True)
+def lifespan():
+    # keep a single event loop for the whole module so the async Mongo client stays bound to it
+    with client:
+        yield
+
 def test_environment_variables():
     secret_key = os.environ.get("SECRET_KEY")
     assert secret_key is not None, "API_KEY environment variable not set"
     mongodb_url = os.environ.get("MONGODB_URL")
     assert mongodb_url is not None, "MONGODB_URL environment variable not set"
 
+def test_non_json_body():
+    # the error logging middleware must not choke on bodies it can't parse
+    res = client.post("/admin/login", content=b"not json", headers={ "content-type": "text/plain" })
+    assert res.status_code == 422
+
+def test_jwks():
+    res = client.get("/.well-known/jwks.json")
+    assert res.status_code == 200
+    assert "keys" in res.json()
+
 def test_admin_create_account():
     res = client.post("/admin/register", json={ "email": "test@gmail.com", "hash": "test" })
     assert res.status_code == 201
@@ -29,6 +59,9 @@ def test_admin_create_account():
 
     admin = UnverifiedAdmin(**admin_col.find_one({ "_id": ObjectId(admin_id) }))
 
+    res = client.post(f"/admin/{admin_id}/verify", json={ "verification_code": "wrong" })
+    assert res.status_code == 400
+
     res = client.post(f"/admin/{admin_id}/verify", json={ "verification_code": admin.verification_code })
     assert res.status_code == 200
 
@@ -38,6 +71,50 @@ def test_admin_login():
 
     return res
 
+def test_admin_refresh_rotation():
+    test_admin_login()
+
+    first_refresh_token = client.cookies["refresh_token"]
+
+    res = client.get("/admin/refresh")
+    assert res.status_code == 200
+    assert client.cookies["refresh_token"] != first_refresh_token
+
+    res = client.get("/admin/refresh")
+    assert res.status_code == 200
+    latest_refresh_token = client.cookies["refresh_token"]
+
+    # replaying a rotated token revokes the session, so the latest token dies with it
+    client.cookies.set("refresh_token", first_refresh_token)
+    res = client.get("/admin/refresh")
+    assert res.status_code == 401
+
+    client.cookies.set("refresh_token", latest_refresh_token)
+    res = client.get("/admin/refresh")
+    assert res.status_code == 401
+
+    res = client.get("/admin/logout")
+    assert res.status_code == 200
+
+    # drop the cookies set by hand, logout only expires the ones the server set
+    client.cookies.clear()
+
+    # an admin who is no longer verified can't refresh, and the session is revoked
+    test_admin_login()
+    session_id = decode_token(client.cookies["refresh_token"], ADMIN_AUDIENCE)["sid"]
+    admin_col.update_one({ "email": "test@gmail.com" }, { "$set": { "verification_code": "123456" } })
+
+    try:
+        res = client.get("/admin/refresh")
+    finally:
+        admin_col.update_one({ "email": "test@gmail.com" }, { "$unset": { "verification_code": "" } })
+
+    assert res.status_code == 401
+    assert res.json()["detail"] == "Account not verified."
+    assert db.sessions.find_one({ "_id": session_id }) is None
+
+    client.cookies.clear()
+
 def test_admin_change_password():
     res = test_admin_login()
 
@@ -67,6 +144,19 @@ def test_admin_change_password():
     )
     assert res.status_code == 200
 
+def test_admin_legacy_hash_upgrade():
+    # accounts from before scrypt store a bare SHA-256 of the client hash
+    legacy_hash = hashlib.sha256(b"test").hexdigest()
+    admin_col.update_one({ "email": "test@gmail.com" }, { "$set": { "hash": legacy_hash } })
+
+    test_admin_login()
+
+    upgraded_hash = admin_col.find_one({ "email": "test@gmail.com" })["hash"]
+    assert upgraded_hash.startswith("$scrypt$")
+
+    test_admin_login()
+    assert admin_col.find_one({ "email": "test@gmail.com" })["hash"] == upgraded_hash
+
 def test_admin_app():
     res = test_admin_login()
 
@@ -121,6 +211,20 @@ def test_app():
 
     user_id = res.json()["message"]
 
+    # the unique email index rejects a second registration
+    res = client.post(
+        url="/user/register", 
+        headers={
+            "Warden-App-ID": app.id,
+            "Warden-App-API-Key": app_api_key
+        },
+        json={ 
+            "email": "apptest@gmail.com", 
+            "hash": "apptest" 
+        }
+    )
+    assert res.status_code == 409
+
     app_col = db[f"app_{app.id}"]
 
     user = UnverifiedUser(**app_col.find_one({ "_id": ObjectId(user_id) }))
@@ -154,6 +258,33 @@ def test_app():
     )
     assert res.status_code == 200
 
+    res = client.post(
+        url="/user/refresh",
+        headers={
+            "Warden-App-ID": app.id,
+            "Warden-App-API-Key": app_api_key
+        }
+    )
+    assert res.status_code == 200
+    assert db.sessions.count_documents({ "scope": app.id, "account_id": user_id }) == 1
+
+    # a user who is no longer verified can't refresh, and the session is revoked
+    app_col.update_one({ "_id": ObjectId(user_id) }, { "$set": { "verification_code": "123456" } })
+    try:
+        res = client.post("/user/refresh", headers={ "Warden-App-ID": app.id, "Warden-App-API-Key": app_api_key })
+    finally:
+        app_col.update_one({ "_id": ObjectId(user_id) }, { "$unset": { "verification_code": "" } })
+    assert res.status_code == 401
+    assert res.json()["detail"] == "Account not verified."
+    assert db.sessions.count_documents({ "scope": app.id, "account_id": user_id }) == 0
+
+    res = client.post(
+        url="/user/login",
+        headers={ "Warden-App-ID": app.id, "Warden-App-API-Key": app_api_key },
+        json={ "email": "apptest@gmail.com", "hash": "apptest" }
+    )
+    assert res.status_code == 200
+
     res = client.patch(
         url="/user",
         headers={
@@ -169,6 +300,131 @@ def test_app():
     )
     assert res.status_code == 200
 
+    res = client.patch(
+        url="/user",
+        headers={
+            "Warden-App-ID": app.id,
+            "Warden-App-API-Key": app_api_key,
+            "Content-Type": "application/merge-patch+json"
+        },
+        content=json.dumps({ "testDataB": None, "profile": { "name": "test" } })
+    )
+    assert res.status_code == 200
+
+    res = client.patch(
+        url="/user",
+        headers={
+            "Warden-App-ID": app.id,
+            "Warden-App-API-Key": app_api_key,
+            "Content-Type": "application/json-patch+json"
+        },
+        content=json.dumps([
+            { "op": "test", "path": "/testDataA", "value": 123 },
+            { "op": "inc", "path": "/testDataA", "value": 1 },
+            { "op": "add", "path": "/tags", "value": [] },
+            { "op": "replace", "path": "/profile/name", "value": "tested" }
+        ])
+    )
+    assert res.status_code == 200
+
+    assert app_col.find_one({ "_id": ObjectId(user_id) })["data"] == {
+        "testDataA": 124,
+        "profile": { "name": "tested" },
+        "tags": []
+    }
+
+    # add at an index inserts rather than overwrites
+    for value in ([ "a", "c" ], "b"):
+        res = client.patch(
+            url="/user",
+            headers={
+                "Warden-App-ID": app.id,
+                "Warden-App-API-Key": app_api_key,
+                "Content-Type": "application/json-patch+json"
+            },
+            content=json.dumps([ { "op": "add", "path": "/tags/1" if value == "b" else "/tags", "value": value } ])
+        )
+        assert res.status_code == 200
+    assert app_col.find_one({ "_id": ObjectId(user_id) })["data"]["tags"] == [ "a", "b", "c" ]
+
+    # removing by index would leave null behind
+    res = client.patch(
+        url="/user",
+        headers={
+            "Warden-App-ID": app.id,
+            "Warden-App-API-Key": app_api_key,
+            "Content-Type": "application/json-patch+json"
+        },
+        content=json.dumps([ { "op": "remove", "path": "/tags/1" } ])
+    )
+    assert res.status_code == 400
+    assert len(app_col.find_one({ "_id": ObjectId(user_id) })["data"]["tags"]) == 3
+
+    # "²" passes str.isdigit but is no index, it's left to MongoDB as a field name
+    assert json_patch_to_update([ { "op": "add", "path": "/tags/²", "value": "x" } ])[1] == { "$set": { "data.tags.²": "x" } }
+
+    # data must stay an object
+    for op in ("add", "replace"):
+        res = client.patch(
+            url="/user",
+            headers={
+                "Warden-App-ID": app.id,
+                "Warden-App-API-Key": app_api_key,
+                "Content-Type": "application/json-patch+json"
+            },
+            content=json.dumps([ { "op": op, "path": "", "value": "not an object" } ])
+        )
+        assert res.status_code == 400
+
+    app_col.update_one({ "_id": ObjectId(user_id) }, { "$set": { "data.tags": [] } })
+
+    res = client.get(
+        url="/user",
+        headers={
+            "Warden-App-ID": app.id,
+            "Warden-App-API-Key": app_api_key
+        },
+        params={ "fields": "profile.name,profile,testDataA" }
+    )
+    assert res.status_code == 200
+    assert res.json() == { "email": "apptest@gmail.com", "data": { "testDataA": 124, "profile": { "name": "tested" } } }
+
+    res = client.get(
+        url="/user",
+        headers={
+            "Warden-App-ID": app.id,
+            "Warden-App-API-Key": app_api_key
+        },
+        params={ "fields": ".".join([ "a" ] * 9) }
+    )
+    assert res.status_code == 400
+
+    res = client.patch(
+        url="/user",
+        headers={
+            "Warden-App-ID": app.id,
+            "Warden-App-API-Key": app_api_key,
+            "Content-Type": "application/json-patch+json"
+        },
+        content=json.dumps([
+            { "op": "test", "path": "/testDataA", "value": 123 },
+            { "op": "add", "path": "/tags/-", "value": "stale" }
+        ])
+    )
+    assert res.status_code == 409
+
+    # operators and dotted names can't be smuggled in through field names
+    res = client.patch(
+        url="/user",
+        headers={
+            "Warden-App-ID": app.id,
+            "Warden-App-API-Key": app_api_key,
+            "Content-Type": "application/merge-patch+json"
+        },
+        content=json.dumps({ "$where": "1", "a.b": 1 })
+    )
+    assert res.status_code == 400
+
     res = client.patch(
         url="/user/changepassword",
         headers={
@@ -192,16 +448,329 @@ def test_app():
     )
     assert res.status_code == 200
 
+    # the deleted user's access token must no longer authenticate
+    res = client.delete(
+        url="/user",
+        headers={
+            "Warden-App-ID": app.id,
+            "Warden-App-API-Key": app_api_key
+        }, 
+    )
+    assert res.status_code in (401, 403)
+
+def test_user_lockout():
+    res = test_admin_login()
+
+    app = AppResponse(**client.get("/admin/app").json()[0])
+    headers = {
+        "Warden-App-ID": app.id,
+        "Warden-App-API-Key": client.get(f"/admin/app/{app.id}/generate_api_key").json()["message"]
+    }
+    app_col = db[f"app_{app.id}"]
+
+    res = client.patch(f"/admin/app/{app.id}", json=app.model_dump(exclude={"id"}) | {
+        "max_login_attempts": 2,
+        "lockout_time_per_attempt_sec": 1
+    })
+    assert res.status_code == 200
+
+    def login(password: str):
+        return client.post("/user/login", headers=headers, json={ "email": "lockout@gmail.com", "hash": password })
+
+    try:
+        user_id = client.post("/user/register", headers=headers, json={ "email": "lockout@gmail.com", "hash": "lockout" }).json()["message"]
+        user = UnverifiedUser(**app_col.find_one({ "_id": ObjectId(user_id) }))
+        client.post(f"/user/{user_id}/verify", headers=headers, json={ "verification_code": user.verification_code })
+
+        # a successful login clears earlier failures
+        assert login("wrong").status_code == 400
+        assert app_col.find_one({ "_id": ObjectId(user_id) })["login_attempts"] == 1
+        assert login("lockout").status_code == 200
+        assert app_col.find_one({ "_id": ObjectId(user_id) })["login_attempts"] == 0
+
+        # reaching max_login_attempts locks the account, even for the right password
+        assert login("wrong").status_code == 400
+        assert login("wrong").status_code == 400
+
+        locked_until = app_col.find_one({ "_id": ObjectId(user_id) })["locked_until"].replace(tzinfo=timezone.utc)
+        assert locked_until > datetime.now(tz=timezone.utc)
+
+        res = login("lockout")
+        assert res.status_code == 429
+        assert res.json()["detail"] == "Account locked. Try again later."
+
+        time.sleep(max(0, (locked_until - datetime.now(tz=timezone.utc)).total_seconds()) + 0.1)
+
+        assert login("lockout").status_code == 200
+        user = app_col.find_one({ "_id": ObjectId(user_id) })
+        assert user["login_attempts"] == 0 and "locked_until" not in user
+    finally:
+        # the user's login replaced the admin's cookies
+        client.cookies.clear()
+        test_admin_login()
+        client.patch(f"/admin/app/{app.id}", json=app.model_dump(exclude={"id"}))
+        client.cookies.clear()
+
+def test_app_rate_limit_by_ip(monkeypatch):
+    res = test_admin_login()
+
+    app = AppResponse(**client.get("/admin/app").json()[0])
+    app_api_key = client.get(f"/admin/app/{app.id}/generate_api_key").json()["message"]
+
+    monkeypatch.setattr(throttling, "store", MemoryRateLimitStore(max_keys=100))
+    monkeypatch.setattr(throttling, "RATE_LIMIT_IP", RateLimit(requests=1, period_sec=60))
+
+    # an app's backend sends every user's requests from one address, a verified key isn't held to its limit
+    for _ in range(5):
+        res = client.get("/user", headers={ "Warden-App-ID": app.id, "Warden-App-API-Key": app_api_key })
+        assert res.status_code in (401, 403)
+
+    res = client.get("/user", headers={ "Warden-App-ID": app.id, "Warden-App-API-Key": "wrong" })
+    assert res.status_code == 429
+    assert int(res.headers["Retry-After"]) > 0
+
+def test_user_token_mode_revocation(monkeypatch):
+    res = test_admin_login()
+
+    app = AppResponse(**client.get("/admin/app").json()[0])
+    headers = {
+        "Warden-App-ID": app.id,
+        "Warden-App-API-Key": client.get(f"/admin/app/{app.id}/generate_api_key").json()["message"]
+    }
+
+    monkeypatch.setattr(auth, "USER_AUTH_MODE", "token")
+    monkeypatch.setattr(auth.token_version_cache, "ttl_sec", 1)
+
+    res = client.post("/user/register", headers=headers, json={ "email": "tokenmode@gmail.com", "hash": "tokenmode" })
+    user_id = res.json()["message"]
+    user = UnverifiedUser(**db[f"app_{app.id}"].find_one({ "_id": ObjectId(user_id) }))
+    client.post(f"/user/{user_id}/verify", headers=headers, json={ "verification_code": user.verification_code })
+
+    res = client.post("/user/login", headers=headers, json={ "email": "tokenmode@gmail.com", "hash": "tokenmode" })
+    assert res.status_code == 200
+    access_token = res.cookies["access_token"]
+
+    def get_user_with(token: str):
+        client.cookies.clear()
+        client.cookies.set("access_token", token)
+        return client.get("/user", headers=headers)
+
+    assert get_user_with(access_token).status_code == 200
+
+    # a password change revokes tokens issued before it
+    res = client.patch("/user/changepassword", headers=headers, json={
+        "email": "tokenmode@gmail.com",
+        "hash": "tokenmode",
+        "new_hash": "tokenmodes"
+    })
+    assert res.status_code == 200
+    new_access_token = res.cookies["access_token"]
+
+    assert get_user_with(access_token).status_code == 401
+    assert get_user_with(new_access_token).status_code == 200
+
+    # a bump made elsewhere, e.g. by another worker, is seen once the cached version expires
+    db[f"app_{app.id}"].update_one({ "_id": ObjectId(user_id) }, { "$inc": { "token_version": 1 } })
+    assert get_user_with(new_access_token).status_code == 200
+    time.sleep(1.1)
+    assert get_user_with(new_access_token).status_code == 401
+
+    # deleting the user revokes its tokens
+    res = client.post("/user/login", headers=headers, json={ "email": "tokenmode@gmail.com", "hash": "tokenmodes" })
+    access_token = res.cookies["access_token"]
+    assert get_user_with(access_token).status_code == 200
+
+    assert client.delete("/user", headers=headers).status_code == 200
+    assert get_user_with(access_token).status_code == 401
+
+    client.cookies.clear()
+
+
+def test_admin_app_users():
+    res = test_admin_login()
+
+    res = client.get("/admin/app")
+    assert res.status_code == 200
+
+    app = AppResponse(**res.json()[0])
+
+    rows = [
+        { "email": "import1@gmail.com", "hash": "hash1", "data": { "plan": "free" } },
+        { "email": "import2@gmail.com", "hash": "hash2" },
+        { "email": "import1@gmail.com", "hash": "hash3" },
+        { "email": "missing_hash@gmail.com" },
+    ]
+    body = "\n".join(json.dumps(row) for row in rows) + "\nnot json\n"
+
+    res = client.post(f"/admin/app/{app.id}/users/import?verified=true", content=body)
+    assert res.status_code == 200
+
+    summary = res.json()
+    assert summary["inserted"] == 2
+    assert summary["failed"] == 3
+    assert sorted(error["row"] for error in summary["errors"]) == [3, 4, 5]
+
+    res = client.post(
+        f"/admin/app/{app.id}/users/import?format=csv", 
+        content='email,hash,data\nimport3@gmail.com,hash3,"{""plan"": ""pro""}"\n'
+    )
+    assert res.status_code == 200
+    assert res.json()["inserted"] == 1
+
+    app_col = db[f"app_{app.id}"]
+    assert app_col.find_one({ "email": "import1@gmail.com" })["data"] == { "plan": "free" }
+    assert "verification_code" in app_col.find_one({ "email": "import3@gmail.com" })
+
+    res = client.get(f"/admin/app/{app.id}/users/export?batch_size=2&gzip=true")
+    assert res.status_code == 200
+
+    exported = [ json.loads(line) for line in res.text.splitlines() ]
+    assert { "import1@gmail.com", "import2@gmail.com", "import3@gmail.com" } <= { user["email"] for user in exported }
+    assert all("hash" not in user and "verification_code" not in user for user in exported)
+
+    res = client.get(f"/admin/app/{app.id}/users/export", params={ "after": exported[-2]["_id"] })
+    assert res.status_code == 200
+    assert [ json.loads(line)["_id"] for line in res.text.splitlines() ] == [ exported[-1]["_id"] ]
+
+    listed = []
+    cursor = None
+    while True:
+        res = client.get(f"/admin/app/{app.id}/users", params={ "limit": 2, "cursor": cursor } if cursor else { "limit": 2 })
+        assert res.status_code == 200
+        page = res.json()
+        listed += page["users"]
+        cursor = page["next_cursor"]
+        if (cursor is None):
+            break
+
+    assert [ user["_id"] for user in listed ] == [ user["_id"] for user in exported ]
+    assert all("hash" not in user and "data" not in user for user in listed)
+
+    res = client.get(f"/admin/app/{app.id}/users", params={ "email_prefix": "import", "limit": 2 })
+    assert res.status_code == 200
+    page = res.json()
+    assert [ user["email"] for user in page["users"] ] == [ "import1@gmail.com", "import2@gmail.com" ]
+    assert page["users"][0]["verified"]
+
+    res = client.get(f"/admin/app/{app.id}/users", params={ "email_prefix": "import", "cursor": page["next_cursor"] })
+    assert res.status_code == 200
+    page = res.json()
+    assert [ (user["email"], user["verified"]) for user in page["users"] ] == [ ("import3@gmail.com", False) ]
+    assert page["next_cursor"] is None
+
+    res = client.get(f"/admin/app/{app.id}/users", params={ "cursor": "not a cursor" })
+    assert res.status_code == 400
+
+    user_ids = { user["email"]: user["_id"] for user in listed }
+
+    res = client.post(f"/admin/app/{app.id}/users/batch", json={ "operations": [
+        { "op": "update_data", "user_id": user_ids["import1@gmail.com"], "data": { "plan": "pro", "seats": 3 } },
+        { "op": "get", "user_id": user_ids["import1@gmail.com"] },
+        { "op": "lock", "user_id": user_ids["import2@gmail.com"], "lock_sec": 60 },
+        { "op": "get", "user_id": str(ObjectId()) },
+        { "op": "update_data", "user_id": user_ids["import2@gmail.com"], "data": { "$set": 1 } },
+        { "op": "lock", "user_id": user_ids["import2@gmail.com"] },
+        { "op": "get", "user_id": "not an id" }
+    ] })
+    assert res.status_code == 200
+
+    results = res.json()["results"]
+    assert [ result["status"] for result in results ] == [ 200, 200, 200, 404, 400, 400, 400 ]
+    assert results[1]["user"] == { "email": "import1@gmail.com", "data": { "plan": "pro", "seats": 3 } }
+    assert "locked_until" in app_col.find_one({ "email": "import2@gmail.com" })
+
+    res = client.get(f"/admin/app/{app.id}/generate_api_key")
+    assert res.status_code == 200
+
+    res = client.post(
+        "/batch",
+        headers={ "Warden-App-ID": app.id, "Warden-App-API-Key": res.json()["message"] },
+        json={ "operations": [
+            { "op": "unlock", "user_id": user_ids["import2@gmail.com"] },
+            { "op": "delete", "user_id": user_ids["import3@gmail.com"] },
+            { "op": "get", "user_id": user_ids["import3@gmail.com"] }
+        ] }
+    )
+    assert res.status_code == 200
+    assert [ result["status"] for result in res.json()["results"] ] == [ 200, 200, 404 ]
+    assert "locked_until" not in app_col.find_one({ "email": "import2@gmail.com" })
+    assert app_col.find_one({ "email": "import3@gmail.com" }) is None
+
+def test_metrics():
+    res = client.post("/admin/login", json={ "email": "test@gmail.com", "hash": "wrong" })
+    assert res.status_code == 400
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    metrics = res.text
+    # routes are labelled by template, not by the ids in their paths
+    assert 'route="/user/{user_id}/verify",status="200"' in metrics
+    assert 'route="/admin/login",status="400"' in metrics
+    assert 'warden_login_failures_total{app="admin"}' in metrics
+    assert 'warden_auth_cache_lookups_total{cache="app",outcome="hit"}' in metrics
+    assert 'warden_http_requests_in_progress{method="GET"} 1' in metrics
+
+    # the failed login counted an attempt, clear it for the tests after this one
+    admin_col.update_one({ "email": "test@gmail.com" }, { "$set": { "login_attempts": 0 } })
+
+def test_metrics_token(monkeypatch):
+    monkeypatch.setattr(routers.metrics, "METRICS_TOKEN", "scrape")
+
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={ "Authorization": "Bearer wrong" }).status_code == 401
+    # non-ASCII header values are rejected, not a 500
+    assert client.get("/metrics", headers={ "Authorization": "Bearer ü".encode("latin-1") }).status_code == 401
+    assert client.get("/metrics", headers={ "Authorization": "Bearer scrape" }).status_code == 200
 
 def test_admin_cleanup():
     res = client.post("/admin/login", json={ "email": "test@gmail.com", "hash": "test" })
     assert res.status_code == 200
+
+    res = client.get("/admin/stats/cache")
+    assert res.status_code == 200
+    assert res.json()["app_cache"]["hits"] > 0
+    # the admin session cookie is verified once and then served from the token cache
+    assert res.json()["token_cache"]["hits"] > 0
     
     res = client.get("/admin/app")
     assert res.status_code == 200
 
     app = AppResponse(**res.json()[0])
 
+    # cached apps are dropped as soon as the admin changes them
+    old_api_key = client.get(f"/admin/app/{app.id}/generate_api_key").json()["message"]
+    # the id is spelled in uppercase, it must still hit the same cache entry
+    old_headers = { "Warden-App-ID": app.id.upper(), "Warden-App-API-Key": old_api_key }
+
+    res = client.post("/user/register", headers=old_headers, json={ "email": "cachetest@gmail.com", "hash": "cachetest" })
+    assert res.status_code == 201
+    user_id = res.json()["message"]
+
+    new_api_key = client.get(f"/admin/app/{app.id}/generate_api_key").json()["message"]
+    headers = { "Warden-App-ID": app.id, "Warden-App-API-Key": new_api_key }
+
+    res = client.post("/user/login", headers=old_headers, json={ "email": "cachetest@gmail.com", "hash": "cachetest" })
+    assert res.status_code == 400
+    assert res.json()["detail"] == "An HTTP header that's mandatory for this request is invalid."
+
+    user = UnverifiedUser(**db[f"app_{app.id}"].find_one({ "_id": ObjectId(user_id) }))
+    res = client.post(f"/user/{user_id}/verify", headers=headers, json={ "verification_code": user.verification_code })
+    assert res.status_code == 200
+
+    res = client.patch(f"/admin/app/{app.id}", json=app.model_dump(exclude={"id"}) | { "access_token_exp_sec": 77 })
+    assert res.status_code == 200
+
+    res = client.post("/user/login", headers=headers, json={ "email": "cachetest@gmail.com", "hash": "cachetest" })
+    assert res.status_code == 200
+    access_cookie = next(cookie for cookie in res.headers.get_list("set-cookie") if cookie.startswith("access_token="))
+    assert "Max-Age=77" in access_cookie
+
+    # the user's login replaced the admin's cookies
+    client.cookies.clear()
+    test_admin_login()
+
     res = client.delete(f"/admin/app/{app.id}")
     assert res.status_code == 200
 
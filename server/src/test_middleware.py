@@ -0,0 +1,49 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+import pytest
+
+from utils import middleware
+from utils.middleware import ErrorLoggerMiddleware
+
+
+@pytest.fixture
+def logged(monkeypatch):
+    """
+    Errors logged by the middleware, as (message, data) pairs.
+    """
+
+    errors = []
+    monkeypatch.setattr(middleware.logger, "error", lambda message, error, **data: errors.append((message, data)))
+    return errors
+
+def failing_client():
+    app = FastAPI()
+    app.add_middleware(ErrorLoggerMiddleware, max_body_bytes=16)
+
+    @app.api_route("/fail", methods=[ "GET", "POST" ])
+    async def fail(req: Request):
+        await req.body()
+        raise RuntimeError("boom")
+
+    return TestClient(app)
+
+def test_error_logs_request_body(logged):
+    client = failing_client()
+
+    res = client.post("/fail?page=2", json={ "a": 1 })
+    assert res.status_code == 500
+    assert res.json() == { "reason": "RuntimeError" }
+
+    message, data = logged[-1]
+    assert message.startswith("POST http://testserver/fail?page=2")
+    assert data["body"] == { "a": 1 }
+    assert data["query_params"]["page"] == "2"
+
+def test_error_log_body_is_capped(logged):
+    client = failing_client()
+
+    client.post("/fail", content=b"x" * 100)
+    assert logged[-1][1]["body"] == "x" * 16 + "... [truncated]"
+
+    client.get("/fail")
+    assert logged[-1][1]["body"] is None
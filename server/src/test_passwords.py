@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+from fastapi import HTTPException
+import pytest
+
+from passwords import PasswordHasher
+
+
+def new_hasher(max_pending: int = 8, n: int = 2 ** 10):
+    return PasswordHasher(workers=1, max_pending=max_pending, n=n, r=8, p=1)
+
+def test_hash_verify_and_upgrade():
+    async def run():
+        hasher = new_hasher()
+        try:
+            stored_hash = await hasher.hash("client_hash")
+            assert stored_hash.startswith("$scrypt$n=1024,r=8,p=1$")
+            assert await hasher.verify("client_hash", stored_hash) == (True, None)
+            assert await hasher.verify("wrong", stored_hash) == (False, None)
+
+            # a legacy SHA-256 hash verifies and comes back upgraded
+            matches, upgraded_hash = await hasher.verify("client_hash", hashlib.sha256(b"client_hash").hexdigest())
+            assert matches and upgraded_hash.startswith("$scrypt$")
+
+            # so does a scrypt hash with old parameters
+            stronger = new_hasher(n=2 ** 11)
+            matches, upgraded_hash = await stronger.verify("client_hash", stored_hash)
+            stronger.shutdown()
+            assert matches and upgraded_hash.startswith("$scrypt$n=2048,")
+        finally:
+            hasher.shutdown()
+
+    asyncio.run(run())
+
+def test_malformed_and_costly_hashes_match_nothing():
+    async def run():
+        hasher = new_hasher()
+        try:
+            stored_hash = await hasher.hash("client_hash")
+            salt, key = stored_hash.split("$")[-2:]
+
+            for bad_hash in [
+                "$scrypt$n=1024,r=8,p=1$not*base64$" + key,
+                "$scrypt$n=1024,r=8,p=1$" + salt,
+                "$scrypt$n=1000,r=8,p=1$" + salt + "$" + key,
+                "$scrypt$n=1024,r=8$" + salt + "$" + key,
+                # about 128 GB, never handed to scrypt
+                "$scrypt$n=1048576,r=1024,p=1$" + salt + "$" + key,
+                "ünïcode"
+            ]:
+                assert await hasher.verify("client_hash", bad_hash) == (False, None)
+        finally:
+            hasher.shutdown()
+
+    asyncio.run(run())
+
+def test_full_queue_fails_fast():
+    async def run():
+        hasher = new_hasher(max_pending=2, n=2 ** 14)
+        try:
+            results = await asyncio.gather(*[ hasher.hash("client_hash") for _ in range(4) ], return_exceptions=True)
+        finally:
+            hasher.shutdown()
+
+        rejected = [ result for result in results if isinstance(result, HTTPException) ]
+        assert len(rejected) == 2
+        assert all(error.status_code == 503 and "Retry-After" in error.headers for error in rejected)
+        assert hasher.rejected == 2
+
+    asyncio.run(run())
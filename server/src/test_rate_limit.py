@@ -0,0 +1,90 @@
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=".env.development")
+load_dotenv()
+
+from bson import ObjectId
+from fastapi import HTTPException, Request
+from pymongo import AsyncMongoClient
+import os
+import pytest
+
+import auth
+from models import RateLimit
+import throttling
+from utils.rate_limit import MemoryRateLimitStore, MongoRateLimitStore
+
+
+async def hit_until_limited(store, monkeypatch):
+    monkeypatch.setattr(throttling, "store", store)
+    limit = RateLimit(requests=2, period_sec=60)
+
+    await throttling.check("ip:203.0.113.7", limit)
+    await throttling.check("ip:203.0.113.7", limit)
+    # another key has its own budget
+    await throttling.check("ip:203.0.113.8", limit)
+
+    with pytest.raises(HTTPException) as error:
+        await throttling.check("ip:203.0.113.7", limit)
+
+    assert error.value.status_code == 429
+    assert 1 <= int(error.value.headers["Retry-After"]) <= 60
+
+def test_token_bucket_limit(monkeypatch):
+    asyncio.run(hit_until_limited(MemoryRateLimitStore(max_keys=100), monkeypatch))
+
+def test_mongo_window_limit(monkeypatch):
+    async def run():
+        client = AsyncMongoClient(os.environ["MONGODB_URL"])
+        collection = client.warden.rate_limits_test
+        await collection.drop()
+
+        try:
+            await hit_until_limited(MongoRateLimitStore(collection), monkeypatch)
+        finally:
+            await collection.drop()
+            await client.close()
+
+    asyncio.run(run())
+
+def test_limited_caller_doesnt_fail_a_shared_app_load(monkeypatch):
+    app_id = str(ObjectId())
+    document = {
+        "_id": ObjectId(app_id),
+        "name": "rate_limit_app",
+        "access_token_exp_sec": 60,
+        "refresh_token_exp_sec": 60,
+        "max_login_attempts": 3,
+        "lockout_time_per_attempt_sec": 60,
+        "api_key_hash": auth.hash("key")
+    }
+
+    class SlowAppCollection:
+        async def find_one(self, query: dict):
+            await asyncio.sleep(0.05)
+            return document
+
+    def request_from(ip: str):
+        headers = [ (b"warden-app-id", app_id.encode()), (b"warden-app-api-key", b"key") ]
+        return Request({ "type": "http", "headers": headers, "client": (ip, 1234) })
+
+    limit = RateLimit(requests=1, period_sec=60)
+    monkeypatch.setattr(auth, "app_col", SlowAppCollection())
+    monkeypatch.setattr(throttling, "store", MemoryRateLimitStore(max_keys=100))
+    monkeypatch.setattr(throttling, "RATE_LIMIT_IP", limit)
+
+    async def run():
+        await throttling.check("ip:203.0.113.7", limit)
+
+        # the limited caller comes first, the other one must not share its 429
+        return await asyncio.gather(
+            auth.get_app(request_from("203.0.113.7")),
+            auth.get_app(request_from("203.0.113.8")),
+            return_exceptions=True
+        )
+
+    limited, allowed = asyncio.run(run())
+
+    assert isinstance(limited, HTTPException) and limited.status_code == 429
+    assert allowed.id == app_id
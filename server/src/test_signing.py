@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+import time
+import ecdsa
+import pytest
+
+from signing import InvalidToken, SigningKeys
+
+
+def new_pem():
+    return ecdsa.SigningKey.generate(curve=ecdsa.NIST256p).to_pem().decode()
+
+def test_es256_rotation():
+    expire = datetime.now(tz=timezone.utc) + timedelta(minutes=1)
+    old_pem = new_pem()
+
+    old_keys = SigningKeys("ES256", None, { "2026-01": old_pem })
+    old_token = old_keys.encode({ "id": "user" }, expire, "app")
+
+    rotated_keys = SigningKeys("ES256", None, { "2026-01": old_pem, "2026-02": new_pem() }, "2026-02")
+    new_token = rotated_keys.encode({ "id": "user" }, expire, "app")
+
+    # tokens signed before the rotation stay valid while their key is configured
+    assert rotated_keys.decode(old_token, "app")["id"] == "user"
+    assert rotated_keys.decode(new_token, "app")["id"] == "user"
+    assert [ key["kid"] for key in rotated_keys.jwks["keys"] ] == [ "2026-01", "2026-02" ]
+    assert all("d" not in key for key in rotated_keys.jwks["keys"])
+
+    with pytest.raises(InvalidToken):
+        old_keys.decode(new_token, "app")
+
+    with pytest.raises(InvalidToken):
+        rotated_keys.decode(new_token, "other_app")
+
+def test_rejects_other_algorithms_and_missing_audience():
+    expire = datetime.now(tz=timezone.utc) + timedelta(minutes=1)
+
+    hs_keys = SigningKeys("HS256", "secret")
+    es_keys = SigningKeys("ES256", None, { "kid": new_pem() })
+
+    with pytest.raises(InvalidToken):
+        es_keys.decode(hs_keys.encode({ "id": "user" }, expire, "app"), "app")
+
+    from jose import jwt
+    token = jwt.encode({ "id": "user", "exp": expire, "iss": "warden" }, "secret", "HS256")
+
+    with pytest.raises(InvalidToken):
+        hs_keys.decode(token, "app")
+
+def test_active_key_must_be_private():
+    public_pem = ecdsa.SigningKey.from_pem(new_pem()).get_verifying_key().to_pem().decode()
+
+    with pytest.raises(ValueError):
+        SigningKeys("ES256", None, { "kid": public_pem })
+
+def test_token_cache_keeps_audience_and_expiry():
+    from auth import decode_token, generate_token, token_cache
+
+    token = generate_token({ "id": "user" }, datetime.now(tz=timezone.utc) + timedelta(seconds=1), "app")
+
+    hits = token_cache.hits
+    assert decode_token(token, "app")["id"] == "user"
+    assert decode_token(token, "app")["id"] == "user"
+    assert token_cache.hits == hits + 1
+
+    # a cached token is still rejected for another audience
+    with pytest.raises(InvalidToken):
+        decode_token(token, "other_app")
+
+    # jose compares whole seconds, so wait past the second after exp
+    time.sleep(2.1)
+    with pytest.raises(InvalidToken):
+        decode_token(token, "app")
@@ -0,0 +1,77 @@
+import os
+from fastapi import Request
+
+from database import db
+from models import App, RateLimit
+from utils import exception
+from utils.rate_limit import MemoryRateLimitStore, MongoRateLimitStore
+
+# "memory" keeps buckets per worker, "mongo" shares fixed windows across workers
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 1_000_000))
+# use the first X-Forwarded-For address, only when running behind a trusted proxy
+RATE_LIMIT_TRUST_PROXY = os.environ.get("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+
+def parse_rate_limit(value: str):
+    """
+    Parses "<requests>/<period_sec>", an empty value disables the limit.
+    """
+
+    if (not value):
+        return None
+
+    requests, period_sec = value.split("/")
+    return RateLimit(requests=int(requests), period_sec=int(period_sec))
+
+# server-wide defaults, apps can override the last three
+RATE_LIMIT_IP = parse_rate_limit(os.environ.get("RATE_LIMIT_IP", "300/60"))
+RATE_LIMIT_APP = parse_rate_limit(os.environ.get("RATE_LIMIT_APP", ""))
+# off by default, SDK traffic reaches Warden from the app's backend rather than its users
+RATE_LIMIT_APP_IP = parse_rate_limit(os.environ.get("RATE_LIMIT_APP_IP", ""))
+RATE_LIMIT_EMAIL = parse_rate_limit(os.environ.get("RATE_LIMIT_EMAIL", "20/60"))
+
+if (RATE_LIMIT_BACKEND == "mongo"):
+    store = MongoRateLimitStore(db.rate_limits)
+elif (RATE_LIMIT_BACKEND == "memory"):
+    store = MemoryRateLimitStore(RATE_LIMIT_MAX_KEYS)
+else:
+    raise EnvironmentError(f"Unknown RATE_LIMIT_BACKEND '{RATE_LIMIT_BACKEND}', expected 'memory' or 'mongo'.")
+
+def client_ip(req: Request):
+    if (RATE_LIMIT_TRUST_PROXY):
+        forwarded_for = req.headers.get("X-Forwarded-For")
+        if (forwarded_for):
+            return forwarded_for.split(",")[0].strip()
+
+    return req.client.host if req.client else "unknown"
+
+async def check(key: str, limit: RateLimit):
+    if (limit is None):
+        return
+
+    retry_after_sec = await store.hit(key, limit.requests, limit.period_sec)
+
+    if (retry_after_sec):
+        raise exception.too_many_requests(retry_after_sec)
+
+async def limit_by_ip(req: Request):
+    """
+    Router-wide dependency, runs before any other dependency touches the database. App
+    routes only apply it to requests whose app key isn't verified yet, see get_app.
+    """
+
+    await check(f"ip:{client_ip(req)}", RATE_LIMIT_IP)
+
+async def limit_app(req: Request, app: App):
+    await check(f"app:{app.id}", app.app_rate_limit or RATE_LIMIT_APP)
+    await check(f"app:{app.id}:ip:{client_ip(req)}", app.ip_rate_limit or RATE_LIMIT_APP_IP)
+
+async def limit_account(account: str, app: App = None):
+    """
+    Limits requests targeting one account, by email or id, per app or for admins when app is None.
+    """
+
+    scope = app.id if app else "admin"
+    limit = app.email_rate_limit if app and app.email_rate_limit else RATE_LIMIT_EMAIL
+
+    await check(f"account:{scope}:{account.lower()}", limit)
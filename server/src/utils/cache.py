@@ -0,0 +1,117 @@
+import asyncio
+from collections import OrderedDict
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache whose entries expire after a TTL.
+
+    Concurrent misses on the same key share a single load (single-flight).
+    Loaders returning None are not cached.
+    """
+
+    def __init__(self, max_size: int, ttl_sec: float):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._loading: dict[Hashable, asyncio.Future] = {}
+        # bumped on every invalidation so loads started before it are not stored
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable):
+        entry = self._entries.get(key)
+
+        if (entry is None):
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+
+        if (expires_at <= time.monotonic()):
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __contains__(self, key: Hashable):
+        """
+        Whether key has an unexpired entry, without counting a lookup.
+        """
+
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def set(self, key: Hashable, value: Any, ttl_sec: float = None):
+        expires_at = time.monotonic() + (self.ttl_sec if ttl_sec is None else ttl_sec)
+
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+
+        while (len(self._entries) > self.max_size):
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key: Hashable):
+        self._generation += 1
+        self._entries.pop(key, None)
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]):
+        self._generation += 1
+        for key in [ key for key in self._entries if predicate(key) ]:
+            del self._entries[key]
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        value = self.get(key)
+
+        if (value is not None):
+            return value
+
+        load = self._loading.get(key)
+
+        if (load is None):
+            load = asyncio.ensure_future(self._load(key, loader))
+            self._loading[key] = load
+            load.add_done_callback(lambda _: self._loading.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        # shield so a cancelled caller doesn't cancel the load other callers are waiting on
+        return await asyncio.shield(load)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        generation = self._generation
+
+        value = await loader()
+
+        if (value is not None and generation == self._generation):
+            self.set(key, value)
+
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_sec": self.ttl_sec,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
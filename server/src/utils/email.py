@@ -1,10 +1,18 @@
 import os
+import queue
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-import uuid
+import time
 
-def send_verification_email(app: str, recipient_email: str, message: str):
+EMAIL_SMTP_HOST = os.environ.get("EMAIL_SMTP_HOST", "smtp.gmail.com")
+EMAIL_SMTP_PORT = int(os.environ.get("EMAIL_SMTP_PORT", 587))
+EMAIL_SMTP_STARTTLS = os.environ.get("EMAIL_SMTP_STARTTLS", "true").lower() == "true"
+EMAIL_SMTP_TIMEOUT_SEC = float(os.environ.get("EMAIL_SMTP_TIMEOUT_SEC", 10))
+# pooled connections idle for longer than this are checked with NOOP before reuse
+EMAIL_SMTP_IDLE_CHECK_SEC = float(os.environ.get("EMAIL_SMTP_IDLE_CHECK_SEC", 30))
+
+def build_verification_email(app: str, recipient_email: str, message: str):
     # Set up MIME
     msg = MIMEMultipart("alternative")
     msg["Subject"] = f"{app} Verification Code"
@@ -14,8 +22,109 @@ def send_verification_email(app: str, recipient_email: str, message: str):
     # Attach HTML content
     msg.attach(MIMEText(message, "plain"))
 
-    # Send email
-    with smtplib.SMTP("smtp.gmail.com", 587) as server:
-        server.starttls()
-        server.login(os.environ["EMAIL_SERVICE_USER"], os.environ["EMAIL_SERVICE_PASSWORD"])
-        server.sendmail(os.environ["EMAIL_SERVICE_USER"], recipient_email, msg.as_string())
\ No newline at end of file
+    return msg
+
+class SMTPConnectionPool:
+    """
+    Small pool of persistent SMTP connections, each used by one thread at a time.
+
+    Connections are opened lazily, reused across sends and replaced when they fail.
+    """
+
+    def __init__(
+        self,
+        host: str = EMAIL_SMTP_HOST,
+        port: int = EMAIL_SMTP_PORT,
+        size: int = 2,
+        starttls: bool = EMAIL_SMTP_STARTTLS,
+        username: str = None,
+        password: str = None,
+        sender: str = None,
+        timeout_sec: float = EMAIL_SMTP_TIMEOUT_SEC
+    ):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.starttls = starttls
+        self.username = username
+        self.password = password
+        self.sender = sender or username
+        self.timeout_sec = timeout_sec
+
+        # holds (connection or None, last_used) slots, None meaning not connected yet
+        self._slots: queue.Queue = queue.Queue()
+        for _ in range(size):
+            self._slots.put((None, 0.0))
+
+        self.connections_opened = 0
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout_sec)
+        server.ehlo()
+
+        if (self.starttls):
+            server.starttls()
+            server.ehlo()
+
+        # only authenticate against servers that offer it, e.g. not a local test sink
+        if (self.username and server.has_extn("auth")):
+            server.login(self.username, self.password)
+
+        self.connections_opened += 1
+        return server
+
+    @staticmethod
+    def _close(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _is_alive(self, server: smtplib.SMTP):
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send_batch(self, messages: list[tuple[str, MIMEMultipart]]):
+        """
+        Blocking. Sends (recipient, message) pairs over one pooled connection.
+
+        Returns a list with None for each delivered message or the exception that failed it.
+        """
+
+        server, last_used = self._slots.get()
+        results = []
+
+        try:
+            if (server is not None and time.monotonic() - last_used > EMAIL_SMTP_IDLE_CHECK_SEC):
+                if (not self._is_alive(server)):
+                    self._close(server)
+                    server = None
+
+            for recipient, msg in messages:
+                try:
+                    if (server is None):
+                        server = self._connect()
+
+                    server.sendmail(self.sender, recipient, msg.as_string())
+                    results.append(None)
+                except smtplib.SMTPRecipientsRefused as error:
+                    # the connection is still fine, only this recipient failed
+                    results.append(error)
+                except (smtplib.SMTPException, OSError) as error:
+                    results.append(error)
+                    if (server is not None):
+                        self._close(server)
+                    server = None
+        finally:
+            self._slots.put((server, time.monotonic()))
+
+        return results
+
+    def close(self):
+        for _ in range(self.size):
+            server, _ = self._slots.get()
+            if (server is not None):
+                self._close(server)
+            self._slots.put((None, 0.0))
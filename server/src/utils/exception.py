@@ -1,3 +1,4 @@
+import math
 from fastapi import HTTPException, status
 
 missing_headers = HTTPException(status.HTTP_400_BAD_REQUEST, "An HTTP header that's mandatory for this request is not specified.")
@@ -6,7 +7,8 @@ invalid_credentials = HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid creden
 unauthorized_access = HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized access.")
 account_not_verified = HTTPException(status.HTTP_401_UNAUTHORIZED, "Account not verified.")
 invalid_access_token = HTTPException(status.HTTP_403_FORBIDDEN, "Invalid access token.")
-account_locked = HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, "Account locked. Contact support.")
+account_locked = HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, "Account locked. Try again later.")
+unsupported_media_type = HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "Unsupported content type.")
 
 def bad_request(message: str):
     return HTTPException(status.HTTP_400_BAD_REQUEST, message)
@@ -14,4 +16,18 @@ def bad_request(message: str):
 def data_conflict(message: str):
     return HTTPException(status.HTTP_409_CONFLICT, message)
 
+def too_many_requests(retry_after_sec: float):
+    return HTTPException(
+        status.HTTP_429_TOO_MANY_REQUESTS, 
+        "Too many requests.", 
+        headers={ "Retry-After": str(math.ceil(retry_after_sec)) }
+    )
+
+def service_unavailable(retry_after_sec: float):
+    return HTTPException(
+        status.HTTP_503_SERVICE_UNAVAILABLE, 
+        "Server is busy. Try again later.", 
+        headers={ "Retry-After": str(math.ceil(retry_after_sec)) }
+    )
+
 internal_server_error = HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Internal server error.")
\ No newline at end of file
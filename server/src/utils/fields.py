@@ -0,0 +1,46 @@
+import utils.exception as exception
+
+FIELDS_MAX_DEPTH = 8
+FIELDS_MAX_COUNT = 100
+
+
+def validate_field_name(key: str):
+    """
+    Field names end up in dotted update paths and projections, so they can't carry
+    operators or path separators.
+    """
+
+    if (not isinstance(key, str) or not key or key.startswith("$") or "." in key or "\0" in key):
+        raise exception.bad_request(f"Invalid field name {key!r}.")
+
+def fields_to_projection(fields: str, root: str = "data"):
+    """
+    Turns a comma separated list of dotted paths, e.g. "theme,profile.name", into an
+    inclusion projection under root. Paths already covered by a shorter one are dropped,
+    MongoDB rejects overlapping projections.
+    """
+
+    paths = []
+
+    for field in fields.split(","):
+        segments = field.strip().split(".")
+
+        if (len(segments) > FIELDS_MAX_DEPTH):
+            raise exception.bad_request(f"Field {field.strip()!r} is nested deeper than {FIELDS_MAX_DEPTH} levels.")
+
+        for segment in segments:
+            validate_field_name(segment)
+
+        paths.append(segments)
+
+    if (len(paths) > FIELDS_MAX_COUNT):
+        raise exception.bad_request(f"At most {FIELDS_MAX_COUNT} fields can be selected.")
+
+    projection = {}
+
+    for segments in sorted(paths, key=len):
+        if (any(tuple(segments[:depth]) in projection for depth in range(1, len(segments) + 1))):
+            continue
+        projection[tuple(segments)] = 1
+
+    return { ".".join([ root, *segments ]): 1 for segments in projection }
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+
+def is_locked(account: dict):
+    locked_until: datetime = account.get("locked_until")
+
+    if (locked_until is None):
+        return False
+
+    # the driver returns naive UTC datetimes
+    if (locked_until.tzinfo is None):
+        locked_until = locked_until.replace(tzinfo=timezone.utc)
+
+    return locked_until > datetime.now(tz=timezone.utc)
+
+async def record_failed_attempt(collection, account_id: str, max_attempts: int, lockout_time_per_attempt_sec: int):
+    """
+    Atomically counts a failed attempt and, past max_attempts, locks the account
+    for lockout_time_per_attempt_sec per attempt over the limit. Returns whether it locked.
+    """
+
+    account = await collection.find_one_and_update(
+        { "_id": ObjectId(account_id) },
+        { "$inc": { "login_attempts": 1 } },
+        projection={ "login_attempts": 1 },
+        return_document=ReturnDocument.AFTER
+    )
+
+    if (not account or account["login_attempts"] < max_attempts):
+        return False
+
+    attempts_over_limit = account["login_attempts"] - max_attempts + 1
+    locked_until = datetime.now(tz=timezone.utc) + timedelta(seconds=lockout_time_per_attempt_sec * attempts_over_limit)
+
+    # $max so a concurrent failure with a lower count can't shorten the lock
+    await collection.update_one(
+        { "_id": ObjectId(account_id) },
+        { "$max": { "locked_until": locked_until } }
+    )
+
+    return True
+
+async def reset_attempts(collection, account: dict, extra_update: dict = None):
+    """
+    Clears the attempt counter and lock. Skips the write when there is nothing to clear
+    unless extra_update has to be applied anyway.
+    """
+
+    if (not account.get("login_attempts") and "locked_until" not in account and not extra_update):
+        return
+
+    update = { "$set": { "login_attempts": 0 }, "$unset": { "locked_until": "" } }
+
+    for operator, fields in (extra_update or {}).items():
+        update.setdefault(operator, {}).update(fields)
+
+    await collection.update_one({ "_id": account["_id"] }, update)
@@ -1,35 +1,199 @@
-import pprint
+from collections.abc import Mapping
+from datetime import datetime, timezone
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# optional rotating log file, stderr only when unset
+LOG_FILE = os.environ.get("LOG_FILE")
+LOG_FILE_MAX_BYTES = int(os.environ.get("LOG_FILE_MAX_BYTES", 10 * 1024 * 1024))
+LOG_FILE_BACKUP_COUNT = int(os.environ.get("LOG_FILE_BACKUP_COUNT", 5))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10_000))
+# fraction of records kept per logger, e.g. "warden.auth=0.01,warden.account=0.5"
+LOG_SAMPLING = os.environ.get("LOG_SAMPLING", "")
+
+MASK_MAX_DEPTH = 6
+MASK_MAX_ITEMS = 50
+MASK_MAX_STR_LENGTH = 1024
+
+
+class _JSONFormatter(logging.Formatter):
+    """
+    Formats records as single-line JSON. Runs on the listener thread.
+    """
+
+    def format(self, record: logging.LogRecord):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+
+        error = getattr(record, "error", None)
+        if (error is not None):
+            entry["error"] = repr(error)
+
+        data = getattr(record, "data", None)
+        if (data):
+            entry["data"] = { name: logger._mask_sensitive(value) for name, value in data.items() }
+
+        if (record.exc_info):
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener untouched, so formatting happens off the request path,
+    and drops them instead of blocking when the queue is full.
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord):
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+
+def _parse_sampling(config: str):
+    rates = {}
+    for item in config.split(","):
+        if (not item.strip()):
+            continue
+        name, rate = item.split("=")
+        rates[name.strip()] = float(rate)
+    return rates
 
-from pydantic import BaseModel
 
 class logger:
-    uvicorn_logger = logging.getLogger("uvicorn.error")
-    keys_to_mask = ["email", "hash", "api_key_hash"]
+    keys_to_mask = frozenset({
+        "email", "hash", "new_hash", "api_key_hash", "verification_code",
+        "password", "new_password", "access_token", "refresh_token", "api_key"
+    })
+    sample_rates = _parse_sampling(LOG_SAMPLING)
+
+    _root = logging.getLogger("warden")
+    _loggers: dict[str, logging.Logger] = {}
+    _queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener: logging.handlers.QueueListener = None
 
     @staticmethod
-    def info(message: str):
-        logger.uvicorn_logger.info(pprint.pformat(message))
+    def start():
+        """
+        Starts the listener thread that formats and writes queued records. Idempotent.
+        """
+
+        if (logger._listener is not None):
+            return
+
+        formatter = _JSONFormatter()
+        handlers = [ logging.StreamHandler(sys.stderr) ]
+
+        if (LOG_FILE):
+            handlers.append(logging.handlers.RotatingFileHandler(
+                LOG_FILE,
+                maxBytes=LOG_FILE_MAX_BYTES,
+                backupCount=LOG_FILE_BACKUP_COUNT
+            ))
+
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        if (not logger._root.handlers):
+            logger._root.addHandler(_DroppingQueueHandler(logger._queue))
+            logger._root.setLevel(LOG_LEVEL)
+            logger._root.propagate = False
+
+        logger._listener = logging.handlers.QueueListener(logger._queue, *handlers, respect_handler_level=True)
+        logger._listener.start()
 
     @staticmethod
-    def debug(message: str):
-        logger.uvicorn_logger.debug(pprint.pformat(message))
+    def stop():
+        """
+        Flushes queued records and stops the listener thread.
+        """
+
+        if (logger._listener is None):
+            return
+
+        logger._listener.stop()
+        logger._listener = None
+
+    @staticmethod
+    def _get(channel: str):
+        name = f"warden.{channel}" if channel else "warden"
+
+        channel_logger = logger._loggers.get(name)
+        if (channel_logger is None):
+            channel_logger = logger._loggers[name] = logging.getLogger(name)
+
+        return channel_logger
+
+    @staticmethod
+    def _sampled_out(name: str):
+        rate = logger.sample_rates.get(name)
+        return rate is not None and random.random() >= rate
+
+    @staticmethod
+    def info(message: str, *args, channel: str = None):
+        """
+        Arguments are interpolated %-style on the listener thread, not by the caller.
+        """
+
+        channel_logger = logger._get(channel)
+
+        if (not channel_logger.isEnabledFor(logging.INFO) or logger._sampled_out(channel_logger.name)):
+            return
+
+        channel_logger.info(message, *args)
+
+    @staticmethod
+    def debug(message: str, *args, channel: str = None):
+        channel_logger = logger._get(channel)
+
+        if (not channel_logger.isEnabledFor(logging.DEBUG) or logger._sampled_out(channel_logger.name)):
+            return
+
+        channel_logger.debug(message, *args)
 
     @staticmethod
     def error(message: str, error: Exception, **data):
-        content = {}
-        for name, value in data.items():
-            content[name] = logger._mask_sensitive(value)
-
-        logger.uvicorn_logger.error(f"{message}\n{repr(error)}\n{pprint.pformat(content)}")
-
-    @staticmethod
-    def _mask_sensitive(data):  
-        if isinstance(data, dict):
-            return { 
-                key: ("[REDACTED]" if key in logger.keys_to_mask else logger._mask_sensitive(value))
-                for key, value in data.items() 
-            }
-        elif isinstance(data, list):
-            return [ logger._mask_sensitive(item) for item in data ]
-        return data
\ No newline at end of file
+        # never sampled, data is masked by the formatter on the listener thread
+        logger._root.error(message, extra={ "error": error, "data": data })
+
+    @staticmethod
+    def _mask_sensitive(data, depth: int = 0):
+        if (depth >= MASK_MAX_DEPTH):
+            return "[TRUNCATED]"
+
+        if isinstance(data, Mapping):
+            masked = {}
+            for index, (key, value) in enumerate(data.items()):
+                if (index >= MASK_MAX_ITEMS):
+                    masked["..."] = f"[{len(data) - index} more]"
+                    break
+                masked[key] = "[REDACTED]" if key in logger.keys_to_mask else logger._mask_sensitive(value, depth + 1)
+            return masked
+        elif isinstance(data, (list, tuple)):
+            masked = [ logger._mask_sensitive(item, depth + 1) for item in data[:MASK_MAX_ITEMS] ]
+            if (len(data) > MASK_MAX_ITEMS):
+                masked.append(f"[{len(data) - MASK_MAX_ITEMS} more]")
+            return masked
+        elif isinstance(data, str) and len(data) > MASK_MAX_STR_LENGTH:
+            return f"{data[:MASK_MAX_STR_LENGTH]}... [truncated]"
+        return data
+
+
+logger.start()
@@ -0,0 +1,178 @@
+"""
+In-process metrics rendered in the Prometheus text format.
+
+Metrics live in plain dicts keyed by label tuples, so recording is a dict lookup and an
+addition. Every worker process keeps its own values, scrape each worker or run one.
+Values that already exist elsewhere, such as cache statistics, are read at scrape time
+through collectors instead of being counted twice.
+
+Label values must come from bounded sets, route templates rather than paths. Past
+METRICS_MAX_SERIES label sets a metric records new ones under "other" everywhere.
+"""
+from bisect import bisect_left
+import os
+from typing import Callable, Iterable
+
+METRICS_MAX_SERIES = int(os.environ.get("METRICS_MAX_SERIES", 1000))
+
+# seconds, tuned for requests served from the database in a few milliseconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = None):
+    pairs = [ f'{name}="{_escape(value)}"' for name, value in zip(names, values) ]
+    if (extra):
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float):
+    if (value == float("inf")):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series: dict[tuple, object] = {}
+        self._overflow = tuple("other" for _ in self.labels)
+
+    def _key(self, values: tuple):
+        if (values in self._series or len(self._series) < METRICS_MAX_SERIES):
+            return values
+        return self._overflow
+
+    def _header(self):
+        return [ f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}" ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        for labels, value in self._series.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+
+        if (series is None):
+            # per-bucket counts, the last slot is +Inf, then the sum
+            series = self._series[key] = [ 0 ] * (len(self.buckets) + 1) + [ 0.0 ]
+
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = self._header()
+        bounds = self.buckets + (float("inf"),)
+
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {repr(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[_Metric] = []
+        self.collectors: list[Callable[[], Iterable[_Metric]]] = []
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def _register(self, metric: _Metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, collect: Callable[[], Iterable[_Metric]]):
+        """
+        Registers a function returning freshly built metrics, called on every scrape.
+        """
+
+        self.collectors.append(collect)
+        return collect
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            for metric in collect():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "warden_http_request_duration_seconds",
+    "HTTP request latency by route template and status.",
+    ("method", "route", "status")
+)
+http_requests_in_progress = registry.gauge(
+    "warden_http_requests_in_progress",
+    "HTTP requests being served.",
+    ("method",)
+)
+login_failures = registry.counter(
+    "warden_login_failures_total",
+    "Logins rejected for a wrong password, by app, \"admin\" for admins.",
+    ("app",)
+)
+lockouts = registry.counter(
+    "warden_lockouts_total",
+    "Accounts locked after too many failed attempts, by app, \"admin\" for admins.",
+    ("app",)
+)
+email_send_duration = registry.histogram(
+    "warden_email_send_duration_seconds",
+    "Time to send one batch of emails over one pooled SMTP connection.",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+emails = registry.counter(
+    "warden_emails_total",
+    "Emails by outcome: sent, retry or failed.",
+    ("outcome",)
+)
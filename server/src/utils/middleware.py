@@ -0,0 +1,131 @@
+import json
+import os
+import time
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+
+from utils import metrics
+from utils.logging import logger
+
+ERROR_LOG_BODY_MAX_BYTES = int(os.environ.get("ERROR_LOG_BODY_MAX_BYTES", 4096))
+
+
+class ErrorLoggerMiddleware:
+    """
+    Logs unhandled exceptions together with the request that caused them and answers with a 500.
+
+    Body chunks are only referenced as the endpoint reads them, up to max_body_bytes,
+    and are joined and decoded only when an error is actually logged.
+    """
+
+    def __init__(self, app, max_body_bytes: int = ERROR_LOG_BODY_MAX_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http"):
+            return await self.app(scope, receive, send)
+
+        body_chunks = []
+        body_size = 0
+        response_started = False
+
+        async def capturing_receive():
+            nonlocal body_size
+
+            message = await receive()
+
+            if (message["type"] == "http.request" and body_size < self.max_body_bytes):
+                chunk = message.get("body", b"")
+                if (chunk):
+                    body_chunks.append(chunk)
+                    body_size += len(chunk)
+
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+
+            if (message["type"] == "http.response.start"):
+                response_started = True
+
+            await send(message)
+
+        try:
+            await self.app(scope, capturing_receive, tracking_send)
+        except Exception as error:
+            request = Request(scope)
+
+            logger.error(
+                f"{request.method} {request.url}\n{type(error).__name__}",
+                error,
+                query_params = request.query_params,
+                body = self._decode_body(body_chunks)
+            )
+
+            # too late to replace a response that is already on the wire
+            if (response_started):
+                raise
+
+            response = JSONResponse(
+                { "reason": type(error).__name__ },
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+            await response(scope, receive, send)
+
+    def _decode_body(self, body_chunks: list[bytes]):
+        body = b"".join(body_chunks)
+
+        if (len(body) > self.max_body_bytes):
+            truncated = body[:self.max_body_bytes].decode(errors="replace")
+            return f"{truncated}... [truncated]"
+
+        if (not body):
+            return None
+
+        try:
+            return json.loads(body)
+        except ValueError:
+            return body.decode(errors="replace")
+
+
+class MetricsMiddleware:
+    """
+    Records every HTTP request's latency by method, route template and status.
+
+    The route is read from the scope after routing, so paths like /user/{user_id}/verify
+    stay one series. Requests no route matched are recorded as "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http"):
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status_code = 500
+
+        async def status_send(message):
+            nonlocal status_code
+
+            if (message["type"] == "http.response.start"):
+                status_code = message["status"]
+
+            await send(message)
+
+        metrics.http_requests_in_progress.inc(method)
+        started = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, status_send)
+        finally:
+            route = scope.get("route")
+            metrics.http_request_duration.observe(
+                time.perf_counter() - started,
+                method,
+                route.path if route is not None else "unmatched",
+                str(status_code)
+            )
+            metrics.http_requests_in_progress.dec(method)
@@ -0,0 +1,165 @@
+from utils.fields import validate_field_name
+import utils.exception as exception
+
+MERGE_PATCH_MEDIA_TYPE = "application/merge-patch+json"
+JSON_PATCH_MEDIA_TYPE = "application/json-patch+json"
+
+PATCH_MAX_DEPTH = 32
+PATCH_MAX_OPERATIONS = 1000
+
+
+def _validate_value(value, depth: int = 0):
+    if (depth > PATCH_MAX_DEPTH):
+        raise exception.bad_request("Patch is nested too deeply.")
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            validate_field_name(key)
+            _validate_value(item, depth + 1)
+    elif isinstance(value, list):
+        for item in value:
+            _validate_value(item, depth + 1)
+
+def _is_index(segment: str):
+    # str.isdigit also takes digits like "²" that int() rejects
+    return segment.isascii() and segment.isdecimal()
+
+def _pointer_to_path(root: str, pointer: str):
+    """
+    Turns an RFC 6901 JSON pointer into a dotted path under root.
+    """
+
+    if (not isinstance(pointer, str) or (pointer and not pointer.startswith("/"))):
+        raise exception.bad_request(f"Invalid path {pointer!r}.")
+
+    if (not pointer):
+        return root, []
+
+    segments = [ segment.replace("~1", "/").replace("~0", "~") for segment in pointer[1:].split("/") ]
+
+    if (len(segments) > PATCH_MAX_DEPTH):
+        raise exception.bad_request("Patch is nested too deeply.")
+
+    for segment in segments:
+        validate_field_name(segment)
+
+    return ".".join([ root, *segments ]), segments
+
+def merge_patch_to_update(patch: dict, root: str = "data"):
+    """
+    Translates an RFC 7396 merge patch into $set and $unset of only the changed fields.
+
+    Objects are merged field by field, null removes a field, anything else replaces it.
+    An empty object leaves the field as it is.
+    """
+
+    if (not isinstance(patch, dict)):
+        raise exception.bad_request("A merge patch must be a JSON object.")
+
+    update = {}
+
+    def walk(prefix: str, patch: dict, depth: int):
+        if (depth > PATCH_MAX_DEPTH):
+            raise exception.bad_request("Patch is nested too deeply.")
+
+        for key, value in patch.items():
+            validate_field_name(key)
+            path = f"{prefix}.{key}"
+
+            if (value is None):
+                update.setdefault("$unset", {})[path] = ""
+            elif isinstance(value, dict):
+                walk(path, value, depth + 1)
+            else:
+                _validate_value(value, depth + 1)
+                update.setdefault("$set", {})[path] = value
+
+    walk(root, patch, 0)
+
+    return update
+
+def json_patch_to_update(operations: list, root: str = "data"):
+    """
+    Translates an RFC 6902 patch into an update filter and update operators.
+
+    - add and replace become $set, add to the end of an array ("-") becomes $push
+    - add at a numeric index becomes $push with $position, inserting like RFC 6902.
+      The target isn't read first, so a numeric segment always means an array index,
+      adding a member named "0" to an object fails instead
+    - add or replace of the whole document ("") needs an object, data stays an object
+    - remove becomes $unset, move becomes $rename. remove at a numeric index is rejected,
+      $unset would leave null in the array instead of removing the element
+    - test becomes a filter condition, so the update only applies if it holds
+    - inc, not part of RFC 6902, becomes $inc
+
+    copy, which would need the document to be read first, isn't supported.
+    """
+
+    if (not isinstance(operations, list)):
+        raise exception.bad_request("A JSON patch must be a JSON array.")
+
+    if (len(operations) > PATCH_MAX_OPERATIONS):
+        raise exception.bad_request(f"A JSON patch can have at most {PATCH_MAX_OPERATIONS} operations.")
+
+    query = {}
+    update = {}
+    touched_paths = set()
+
+    def touch(path: str):
+        # MongoDB rejects two operators on the same or overlapping paths, report it per operation
+        for touched in touched_paths:
+            if (path == touched or path.startswith(f"{touched}.") or touched.startswith(f"{path}.")):
+                raise exception.bad_request(f"Path {path!r} is changed more than once.")
+        touched_paths.add(path)
+
+    for operation in operations:
+        if (not isinstance(operation, dict)):
+            raise exception.bad_request("Every JSON patch operation must be an object.")
+
+        op = operation.get("op")
+        path, segments = _pointer_to_path(root, operation.get("path"))
+
+        if (op in ("add", "replace", "test", "inc")):
+            if ("value" not in operation):
+                raise exception.bad_request(f"Operation {op} needs a value.")
+            _validate_value(operation["value"])
+
+        if (op == "test"):
+            query[path] = operation["value"]
+        elif (op == "add" and segments and segments[-1] == "-"):
+            path = path[:-len(".-")]
+            touch(path)
+            update.setdefault("$push", {})[path] = operation["value"]
+        elif (op == "add" and segments and _is_index(segments[-1])):
+            path = path[:-len(segments[-1]) - 1]
+            touch(path)
+            update.setdefault("$push", {})[path] = { "$each": [ operation["value"] ], "$position": int(segments[-1]) }
+        elif (op in ("add", "replace")):
+            if (not segments and not isinstance(operation["value"], dict)):
+                raise exception.bad_request("The whole document can only be replaced by an object.")
+            touch(path)
+            update.setdefault("$set", {})[path] = operation["value"]
+        elif (op == "remove"):
+            if (not segments):
+                raise exception.bad_request("The whole document can't be removed.")
+            # $unset would leave null in the array slot instead of removing the element
+            if (_is_index(segments[-1])):
+                raise exception.bad_request("Removing an array element by index isn't supported.")
+            touch(path)
+            update.setdefault("$unset", {})[path] = ""
+        elif (op == "inc"):
+            if (isinstance(operation["value"], bool) or not isinstance(operation["value"], (int, float))):
+                raise exception.bad_request("Operation inc needs a numeric value.")
+            touch(path)
+            update.setdefault("$inc", {})[path] = operation["value"]
+        elif (op == "move"):
+            from_path, from_segments = _pointer_to_path(root, operation.get("from"))
+            if (not segments or not from_segments):
+                raise exception.bad_request("The whole document can't be moved.")
+            touch(from_path)
+            touch(path)
+            update.setdefault("$rename", {})[from_path] = path
+        else:
+            raise exception.bad_request(f"Unsupported operation {op!r}.")
+
+    return query, update
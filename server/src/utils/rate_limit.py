@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import time
+from pymongo import ReturnDocument
+
+
+class MemoryRateLimitStore:
+    """
+    In-process token buckets, one (tokens, updated_at) tuple per key.
+
+    Every hit is O(1). Once max_keys is reached the least recently seen key is
+    dropped, which at worst hands that key a fresh bucket.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def ensure_indexes(self):
+        pass
+
+    async def hit(self, key: str, requests: int, period_sec: float):
+        """
+        Returns 0 when the request is allowed, otherwise the seconds until it would be.
+        """
+
+        now = time.monotonic()
+        refill_per_sec = requests / period_sec
+
+        bucket = self._buckets.get(key)
+
+        if (bucket is None):
+            tokens = requests
+        else:
+            tokens, updated_at = bucket
+            tokens = min(requests, tokens + (now - updated_at) * refill_per_sec)
+            self._buckets.move_to_end(key)
+
+        if (tokens < 1):
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / refill_per_sec
+
+        self._buckets[key] = (tokens - 1, now)
+
+        if (len(self._buckets) > self.max_keys):
+            self._buckets.popitem(last=False)
+
+        return 0
+
+
+class MongoRateLimitStore:
+    """
+    Fixed-window counters shared by every worker through a collection.
+
+    Costs one round trip per check, expired windows are removed by a TTL index.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def hit(self, key: str, requests: int, period_sec: float):
+        now = time.time()
+        window_start = int(now // period_sec * period_sec)
+        window_end = window_start + period_sec
+
+        window = await self.collection.find_one_and_update(
+            { "_id": f"{key}:{window_start}" },
+            {
+                "$inc": { "count": 1 },
+                "$setOnInsert": {
+                    "expires_at": datetime.fromtimestamp(window_end, tz=timezone.utc) + timedelta(seconds=period_sec)
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+        if (window["count"] > requests):
+            return window_end - now
+
+        return 0
@@ -0,0 +1,29 @@
+from typing import AsyncIterator
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int = 1024 * 1024):
+    """
+    Splits a byte stream into lines without buffering more than one partial line.
+
+    Yields (line_number, line) with line numbers starting at 1, skipping blank lines.
+    Lines longer than max_line_bytes raise ValueError.
+    """
+
+    buffer = b""
+    line_number = 0
+
+    async for chunk in chunks:
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+
+        if (len(buffer) > max_line_bytes):
+            raise ValueError(f"Line {line_number + len(lines) + 1} exceeds {max_line_bytes} bytes.")
+
+        for line in lines:
+            line_number += 1
+            if (line.strip()):
+                yield line_number, line
+
+    if (buffer.strip()):
+        yield line_number + 1, buffer